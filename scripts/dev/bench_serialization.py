@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2024-2025 Iliya Yaroshevskiy
+"""
+Benchmark the YAML serialization paths used by Medocker.
+
+Compares the pure-Python loader/dumper with the libyaml C extension and with the
+pickled sidecar cache, on config/default.yml and on a synthetic configuration
+roughly 100 times larger.
+
+Usage:
+    python scripts/dev/bench_serialization.py [--repeat N]
+"""
+
+import argparse
+import copy
+import os
+import sys
+import tempfile
+import timeit
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.join(project_root, 'src'))
+
+import yaml
+
+from medocker import serialization
+from medocker.serialization import dump_yaml, have_libyaml, load_yaml, load_yaml_file
+
+
+def synthetic_config(base, factor=100):
+    """Return a config made of `factor` renamed copies of every top-level section."""
+    config = {}
+    for i in range(factor):
+        for section, value in base.items():
+            config[f"{section}_{i}"] = copy.deepcopy(value)
+    return config
+
+
+def bench(label, func, repeat):
+    best = min(timeit.repeat(func, number=1, repeat=repeat))
+    print(f"  {label:<28} {best * 1000:10.3f} ms")
+    return best
+
+
+def run(name, path, repeat):
+    with open(path, 'r') as f:
+        text = f.read()
+    data = load_yaml(text)
+    print(f"\n{name} ({len(text) / 1024:.1f} KiB)")
+
+    py_load = bench("load (pure Python)", lambda: load_yaml(text, loader=yaml.SafeLoader), repeat)
+    if have_libyaml:
+        c_load = bench("load (libyaml)", lambda: load_yaml(text), repeat)
+        print(f"  {'speedup':<28} {py_load / c_load:10.1f} x")
+
+    load_yaml_file(path, sidecar=True)  # warm the sidecar
+    sidecar = bench("load (sidecar cache hit)", lambda: load_yaml_file(path, sidecar=True), repeat)
+    print(f"  {'speedup vs pure Python':<28} {py_load / sidecar:10.1f} x")
+
+    py_dump = bench("dump (pure Python)", lambda: dump_yaml(data, dumper=yaml.SafeDumper), repeat)
+    if have_libyaml:
+        c_dump = bench("dump (libyaml)", lambda: dump_yaml(data), repeat)
+        print(f"  {'speedup':<28} {py_dump / c_dump:10.1f} x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Medocker YAML serialization')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timed repetitions (best is reported)')
+    args = parser.parse_args()
+
+    print(f"libyaml available: {have_libyaml}")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # Keep sidecars out of the user's real cache directory
+        serialization.SIDECAR_DIR = os.path.join(temp_dir, 'sidecars')
+
+        default_config = os.path.join(project_root, 'config', 'default.yml')
+        run("config/default.yml", default_config, args.repeat)
+
+        large_config = os.path.join(temp_dir, 'large.yml')
+        with open(large_config, 'w') as f:
+            dump_yaml(synthetic_config(load_yaml_file(default_config)), f)
+        run("synthetic config (100x)", large_config, args.repeat)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2024-2025 Iliya Yaroshevskiy
+"""
+Medocker Ansible Configuration
+
+This module builds the inventory and the ansible.cfg shipped with the workstation
+setup playbook. Workstations are listed in `user_setup.workstations`, in groups with
+optional variables per group and per host:
+
+    user_setup:
+      workstations:
+        vars:                       # for all workstations
+          ansible_user: admin
+        groups:
+          reception:
+            vars:
+              configure_browser: true
+            hosts:
+              ws-reception-1:
+                ansible_host: 192.168.1.21
+
+Without workstations the inventory only holds localhost.
+
+The generated ansible.cfg is tuned for running against many workstations: forks are
+sized to the inventory, SSH pipelining and ControlPersist avoid a new connection and
+a file upload per task, and facts are cached between runs.
+"""
+
+MAX_FORKS = 50
+
+# Facts are cached for a day; a new run only gathers them for unknown hosts
+FACT_CACHE_TIMEOUT = 86400
+
+
+def build_inventory(config):
+    """
+    Return the inventory of the workstations to set up.
+
+    Args:
+        config: The configuration dictionary
+
+    Returns:
+        dict: Ansible YAML inventory with one child group per workstation group
+    """
+    workstations = (config.get('user_setup') or {}).get('workstations') or {}
+    common_vars = {'ansible_python_interpreter': '/usr/bin/python3'}
+    common_vars.update(workstations.get('vars') or {})
+
+    groups = workstations.get('groups') or {}
+    if not groups:
+        return {
+            'all': {
+                'hosts': {
+                    'localhost': {
+                        'ansible_connection': 'local'
+                    }
+                },
+                'vars': common_vars
+            }
+        }
+
+    children = {}
+    for name, group in groups.items():
+        group = group or {}
+        child = {'hosts': {host: dict(host_vars or {}) for host, host_vars in (group.get('hosts') or {}).items()}}
+        if group.get('vars'):
+            child['vars'] = dict(group['vars'])
+        children[name] = child
+    return {'all': {'children': children, 'vars': common_vars}}
+
+
+def inventory_hosts(inventory):
+    """Return the names of all hosts in an inventory built by build_inventory."""
+    hosts = set(inventory['all'].get('hosts') or {})
+    for group in (inventory['all'].get('children') or {}).values():
+        hosts.update(group.get('hosts') or {})
+    return sorted(hosts)
+
+
+def build_ansible_cfg(inventory, forks=None):
+    """
+    Return the ansible.cfg for an inventory.
+
+    Args:
+        inventory: Inventory built by build_inventory
+        forks: Number of hosts worked on in parallel (default: one per host, up
+               to MAX_FORKS)
+
+    Returns:
+        str: The configuration file content
+    """
+    hosts = inventory_hosts(inventory)
+    forks = forks or max(1, min(len(hosts), MAX_FORKS))
+    return f"""# Generated by Medocker for {len(hosts)} hosts
+[defaults]
+inventory = inventory.yml
+forks = {forks}
+interpreter_python = auto_silent
+retry_files_enabled = False
+gathering = smart
+fact_caching = jsonfile
+fact_caching_connection = ~/.ansible/medocker_facts
+fact_caching_timeout = {FACT_CACHE_TIMEOUT}
+
+[ssh_connection]
+# Pipelining runs modules without copying them to the host first; it requires
+# that sudo does not enforce requiretty on the workstations
+pipelining = True
+ssh_args = -o ControlMaster=auto -o ControlPersist=300s
+control_path_dir = ~/.ansible/cp
+"""
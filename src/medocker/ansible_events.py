@@ -0,0 +1,206 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2024-2025 Iliya Yaroshevskiy
+"""
+Medocker Ansible Events
+
+This module follows a playbook run through its events, as they are produced, to
+report progress and to time every task on every host. Events come either from
+ansible-runner (its event_handler callback) or, when ansible-playbook is run as a
+subprocess, from the JSON lines written by the ansible.posix.jsonl stdout callback;
+the latter are converted to the ansible-runner event format first.
+
+The resulting summary holds the duration of each task per host, the total time
+spent on each host and the recap statistics (ok, changed, failures, ...) per host.
+"""
+
+import re
+import time
+from datetime import datetime
+
+# Stdout callback used by the subprocess runner, one JSON object per event
+JSONL_CALLBACK = 'ansible.posix.jsonl'
+
+RECAP_KEYS = ('ok', 'changed', 'failures', 'unreachable', 'skipped', 'rescued', 'ignored')
+
+# ansible-runner stats key for each recap key
+RUNNER_STATS_KEYS = {
+    'ok': 'ok',
+    'changed': 'changed',
+    'failures': 'failures',
+    'unreachable': 'dark',
+    'skipped': 'skipped',
+    'rescued': 'rescued',
+    'ignored': 'ignored'
+}
+
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*m')
+
+HOST_RESULT_EVENTS = {
+    'runner_on_ok': 'ok',
+    'runner_on_failed': 'failed',
+    'runner_on_skipped': 'skipped',
+    'runner_on_unreachable': 'unreachable'
+}
+
+
+def _timestamp(value):
+    """Parse an ISO 8601 timestamp as written by Ansible into epoch seconds, or None."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.rstrip('Z')).timestamp()
+    except ValueError:
+        return None
+
+
+def recap_from_runner_stats(stats):
+    """Convert ansible-runner stats ({'ok': {host: n}, 'dark': ...}) to a recap per host."""
+    hosts = sorted({host for key in RUNNER_STATS_KEYS.values() for host in (stats.get(key) or {})})
+    return {
+        host: {key: (stats.get(runner_key) or {}).get(host, 0) for key, runner_key in RUNNER_STATS_KEYS.items()}
+        for host in hosts
+    }
+
+
+def runner_stats_from_recap(recap):
+    """Convert a recap per host back to the ansible-runner stats format."""
+    stats = {runner_key: {host: counts.get(key, 0) for host, counts in recap.items()}
+             for key, runner_key in RUNNER_STATS_KEYS.items()}
+    stats['processed'] = {host: 1 for host in recap}
+    return stats
+
+
+def events_from_jsonl(record):
+    """
+    Convert one record of the ansible.posix.jsonl callback to ansible-runner events.
+
+    Args:
+        record: Parsed JSON line, with the event name under '_event'
+
+    Returns:
+        list: Events with 'event', 'event_data' and a human-readable 'stdout'
+    """
+    name = (record.get('_event') or '').replace('v2_', '', 1)
+    task = record.get('task') or {}
+    if name == 'playbook_on_play_start':
+        play = record.get('play') or {}
+        return [{'event': name, 'event_data': {'play': play.get('name')}, 'stdout': f"PLAY [{play.get('name', '')}]"}]
+    if name == 'playbook_on_task_start':
+        return [{'event': name, 'event_data': {'task': task.get('name'), 'task_uuid': task.get('id')},
+                 'stdout': f"TASK [{task.get('name', '')}]"}]
+    if name in HOST_RESULT_EVENTS:
+        duration = task.get('duration') or {}
+        start, end = _timestamp(duration.get('start')), _timestamp(duration.get('end'))
+        events = []
+        for host, result in (record.get('hosts') or {}).items():
+            status = HOST_RESULT_EVENTS[name]
+            if status == 'ok' and result.get('changed'):
+                status = 'changed'
+            message = f" => {result['msg']}" if status in ('failed', 'unreachable') and result.get('msg') else ''
+            events.append({
+                'event': name,
+                'event_data': {
+                    'task': task.get('name'),
+                    'task_uuid': task.get('id'),
+                    'host': host,
+                    'duration': end - start if start is not None and end is not None else None,
+                    'ignore_errors': bool(result.get('_ansible_ignore_errors')) or None,
+                    'res': result
+                },
+                'stdout': f"{status}: [{host}]{message}"
+            })
+        return events
+    if name == 'playbook_on_stats':
+        return [{'event': name, 'event_data': runner_stats_from_recap(record.get('stats') or {})}]
+    return []
+
+
+class PlaybookRecorder:
+    """Collects the events of one playbook run into timings and a recap."""
+
+    def __init__(self, log=print):
+        """
+        Args:
+            log: Callable receiving the run's output line by line
+        """
+        self.log = log
+        self.started = time.monotonic()
+        self.tasks = {}
+        self.order = []
+        self.host_seconds = {}
+        self.counts = {}
+        self.recap = None
+
+    def handle(self, event):
+        """
+        Process one ansible-runner event; usable as its event_handler.
+
+        Returns:
+            bool: True, so ansible-runner keeps the event
+        """
+        for line in ANSI_ESCAPE.sub('', event.get('stdout') or '').splitlines():
+            if line.strip():
+                self.log(line)
+
+        name = event.get('event')
+        data = event.get('event_data') or {}
+        if name == 'playbook_on_task_start':
+            self._task(data.get('task_uuid'), data.get('task'))
+        elif name in HOST_RESULT_EVENTS:
+            task = self._task(data.get('task_uuid'), data.get('task'))
+            host = data.get('host') or 'unknown'
+            seconds = data.get('duration')
+            if seconds is None:
+                seconds = time.monotonic() - task['started']
+            status = HOST_RESULT_EVENTS[name]
+            if status == 'ok' and (data.get('res') or {}).get('changed'):
+                status = 'changed'
+            elif status == 'failed' and data.get('ignore_errors'):
+                status = 'ignored'
+            task['hosts'][host] = {'status': status, 'seconds': round(seconds, 3)}
+            self.host_seconds[host] = self.host_seconds.get(host, 0.0) + seconds
+            counts = self.counts.setdefault(host, dict.fromkeys(RECAP_KEYS, 0))
+            counts[{'failed': 'failures'}.get(status, status)] += 1
+            if status == 'changed':
+                counts['ok'] += 1
+        elif name == 'playbook_on_stats':
+            self.recap = recap_from_runner_stats(data)
+        return True
+
+    def _task(self, task_uuid, name):
+        key = task_uuid or name
+        if key not in self.tasks:
+            self.tasks[key] = {'name': name, 'started': time.monotonic(), 'hosts': {}}
+            self.order.append(key)
+        return self.tasks[key]
+
+    def summary(self, slowest=5):
+        """
+        Return the timings and recap of the run.
+
+        Returns:
+            dict: 'tasks' in the order they ran with their duration per host and
+                  overall, the total 'hosts' seconds, the 'recap' per host (from
+                  the stats event, or counted from the events if there was none),
+                  the 'slowest_tasks' and the run's wall time in 'seconds'
+        """
+        tasks = []
+        for key in self.order:
+            task = self.tasks[key]
+            seconds = max((result['seconds'] for result in task['hosts'].values()), default=0.0)
+            tasks.append({'name': task['name'], 'seconds': round(seconds, 3), 'hosts': task['hosts']})
+        return {
+            'tasks': tasks,
+            'hosts': {host: round(seconds, 3) for host, seconds in sorted(self.host_seconds.items())},
+            'recap': self.recap if self.recap is not None else self.counts,
+            'slowest_tasks': sorted(tasks, key=lambda task: task['seconds'], reverse=True)[:slowest],
+            'seconds': round(time.monotonic() - self.started, 3)
+        }
+
+
+def describe_recap(recap):
+    """Format a recap as PLAY RECAP lines, one per host."""
+    return '\n'.join(
+        f"{host}: " + ' '.join(f"{key}={counts.get(key, 0)}" for key in RECAP_KEYS)
+        for host, counts in sorted(recap.items())
+    )
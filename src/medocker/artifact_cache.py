@@ -0,0 +1,349 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2024-2025 Iliya Yaroshevskiy
+"""
+Medocker Artifact Cache
+
+This module keeps a local cache of the client installers set up on workstations, so
+that each installer is downloaded once from the internet instead of once per
+workstation. The workstation playbook then copies the installer from the control
+node, or fetches it from the Medocker web app over HTTP.
+
+Installers are stored by content, under `<cache>/<sha256>/<filename>`, and looked up
+by name and version. A checksum given in the configuration is verified when the
+installer is downloaded; without one, the checksum of the first download is
+recorded and used by the playbook to verify the copy on each workstation.
+
+The cache is bounded in size; the least recently used installers are evicted first.
+Installers are configured in `user_setup.artifacts`, which extends CLIENT_ARTIFACTS:
+
+    user_setup:
+      artifacts:
+        vaultwarden:
+          version: 2024.6.4
+          url: https://github.com/bitwarden/clients/releases/download/desktop-v2024.6.4/Bitwarden-2024.6.4-amd64.deb
+          sha256: ...
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.request
+
+from .streaming import CHUNK_SIZE
+
+DEFAULT_CACHE_DIR = os.environ.get('MEDOCKER_ARTIFACT_CACHE',
+                                   os.path.join(os.path.expanduser('~'), '.medocker', 'artifacts'))
+DEFAULT_MAX_BYTES = int(float(os.environ.get('MEDOCKER_ARTIFACT_CACHE_GB', '2')) * 1024 ** 3)
+DOWNLOAD_TIMEOUT = 60
+
+# Uses of an installer only update the index on disk this often; the order of
+# use is kept in memory in between
+TOUCH_SAVE_INTERVAL = 60
+
+# Client installers not available from the distribution's repositories, by the
+# component whose client they install; {version} is filled in from the entry
+CLIENT_ARTIFACTS = {
+    'rustdesk': {
+        'version': '1.1.9',
+        'url': 'https://github.com/rustdesk/rustdesk/releases/download/{version}/rustdesk-{version}.deb'
+    }
+}
+
+
+def client_artifacts(config):
+    """
+    Return the installers of the clients enabled in a configuration.
+
+    Args:
+        config: The configuration dictionary
+
+    Returns:
+        dict: Component name to artifact with 'name', 'version', 'url',
+              'filename' and 'sha256' (None if not configured)
+    """
+    configured = (config.get('user_setup') or {}).get('artifacts') or {}
+    artifacts = {}
+    for name, component in (config.get('components') or {}).items():
+        if not (component or {}).get('client_enabled', False):
+            continue
+        artifact = dict(CLIENT_ARTIFACTS.get(name) or {})
+        artifact.update(configured.get(name) or {})
+        if not artifact.get('url'):
+            continue
+        artifact['name'] = name
+        artifact['version'] = str(artifact.get('version', 'latest'))
+        artifact['url'] = artifact['url'].format(version=artifact['version'])
+        artifact['filename'] = artifact.get('filename') or artifact['url'].rsplit('/', 1)[-1]
+        artifact['sha256'] = (artifact.get('sha256') or '').lower() or None
+        artifacts[name] = artifact
+    return artifacts
+
+
+def file_sha256(path, chunk_size=CHUNK_SIZE):
+    """Return the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ArtifactCache:
+    """Size-bounded, content-addressed store of downloaded installers."""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Args:
+            directory: Directory holding the installers and their index
+            max_bytes: Total size above which least recently used installers
+                       are evicted
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._downloads = {}
+        self._entries = None
+        self._saved = 0.0
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.directory, 'index.json')
+
+    def _load(self):
+        """Return the index (sha256 to entry), reading it on first use. Call with the lock held."""
+        if self._entries is None:
+            try:
+                with open(self._index_path) as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def _save(self):
+        """Write the index atomically. Call with the lock held."""
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.index-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._entries, f, indent=2, sort_keys=True)
+        os.replace(tmp, self._index_path)
+        self._saved = time.monotonic()
+
+    def path(self, sha256, filename=None):
+        """Return the local path of a cached installer, or None if it is not cached."""
+        with self._lock:
+            entry = self._load().get(sha256)
+        if entry is None or (filename is not None and entry['filename'] != filename):
+            return None
+        path = os.path.join(self.directory, sha256, entry['filename'])
+        return path if os.path.exists(path) else None
+
+    def lookup(self, name, version, sha256=None):
+        """
+        Return the cache entry of an installer without downloading it.
+
+        Returns:
+            dict or None: Entry with 'name', 'version', 'filename', 'sha256',
+                          'size', 'url' and the local 'path'
+        """
+        with self._lock:
+            for digest, entry in self._load().items():
+                if entry['name'] == name and entry['version'] == version and sha256 in (None, digest):
+                    path = os.path.join(self.directory, digest, entry['filename'])
+                    if os.path.exists(path) and os.path.getsize(path) == entry['size']:
+                        return dict(entry, sha256=digest, path=path)
+        return None
+
+    def touch(self, sha256):
+        """
+        Mark an installer as used now, for eviction.
+
+        Many workstations download the same installer at once, so the index is
+        written at most every TOUCH_SAVE_INTERVAL seconds.
+        """
+        with self._lock:
+            entry = self._load().get(sha256)
+            if entry is not None:
+                entry['last_used'] = time.time()
+                if time.monotonic() - self._saved >= TOUCH_SAVE_INTERVAL:
+                    self._save()
+
+    def fetch(self, artifact, log=print):
+        """
+        Return the cache entry of an installer, downloading it on a miss.
+
+        Concurrent fetches of the same installer share one download.
+
+        Args:
+            artifact: Artifact from client_artifacts
+            log: Callable receiving progress messages
+
+        Returns:
+            dict: The cache entry (see lookup)
+
+        Raises:
+            ValueError: If the download does not match the configured checksum
+            OSError: If the download failed
+        """
+        key = (artifact['name'], artifact['version'], artifact.get('sha256'))
+        with self._lock:
+            download_lock = self._downloads.setdefault(key, threading.Lock())
+        with download_lock:
+            entry = self.lookup(*key)
+            if entry is not None:
+                self.touch(entry['sha256'])
+                return entry
+            entry = self._download(artifact, log)
+        self.evict(keep=(entry['sha256'],))
+        return entry
+
+    def _download(self, artifact, log):
+        os.makedirs(self.directory, exist_ok=True)
+        log(f"Downloading {artifact['name']} {artifact['version']} from {artifact['url']}...")
+        start = time.monotonic()
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.download-')
+        try:
+            with os.fdopen(fd, 'wb') as target, urllib.request.urlopen(artifact['url'], timeout=DOWNLOAD_TIMEOUT) as source:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    target.write(chunk)
+                    size += len(chunk)
+            sha256 = digest.hexdigest()
+            if artifact.get('sha256') and sha256 != artifact['sha256']:
+                raise ValueError(f"Checksum mismatch for {artifact['filename']}: "
+                                 f"expected {artifact['sha256']}, got {sha256}")
+            os.makedirs(os.path.join(self.directory, sha256), exist_ok=True)
+            path = os.path.join(self.directory, sha256, artifact['filename'])
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        now = time.time()
+        entry = {
+            'name': artifact['name'],
+            'version': artifact['version'],
+            'filename': artifact['filename'],
+            'size': size,
+            'url': artifact['url'],
+            'fetched': now,
+            'last_used': now
+        }
+        with self._lock:
+            self._load()[sha256] = entry
+            self._save()
+        log(f"Cached {artifact['filename']} ({size / 1024 ** 2:.1f} MB, sha256 {sha256[:12]}) "
+            f"in {time.monotonic() - start:.1f}s")
+        return dict(entry, sha256=sha256, path=path)
+
+    def verify(self):
+        """
+        Check every cached installer against its checksum, dropping corrupted ones.
+
+        Returns:
+            dict: 'ok' and 'removed' lists of sha256 digests
+        """
+        with self._lock:
+            entries = dict(self._load())
+        result = {'ok': [], 'removed': []}
+        for sha256, entry in entries.items():
+            path = os.path.join(self.directory, sha256, entry['filename'])
+            if os.path.exists(path) and file_sha256(path) == sha256:
+                result['ok'].append(sha256)
+            else:
+                self._remove(sha256)
+                result['removed'].append(sha256)
+        return result
+
+    def evict(self, max_bytes=None, keep=()):
+        """
+        Remove least recently used installers until the cache fits its size bound.
+
+        Args:
+            max_bytes: Size bound (default: the cache's max_bytes)
+            keep: Digests never evicted, such as an installer just fetched
+
+        Returns:
+            list: The evicted digests
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        with self._lock:
+            entries = dict(self._load())
+        total = sum(entry['size'] for entry in entries.values())
+        evicted = []
+        for sha256, entry in sorted(entries.items(), key=lambda item: item[1]['last_used']):
+            if total <= max_bytes:
+                break
+            if sha256 in keep:
+                continue
+            self._remove(sha256)
+            total -= entry['size']
+            evicted.append(sha256)
+        return evicted
+
+    def _remove(self, sha256):
+        with self._lock:
+            entry = self._load().pop(sha256, None)
+            if entry is not None:
+                self._save()
+        if entry is not None:
+            path = os.path.join(self.directory, sha256, entry['filename'])
+            if os.path.exists(path):
+                os.remove(path)
+            try:
+                os.rmdir(os.path.join(self.directory, sha256))
+            except OSError:
+                pass
+
+    def entries(self):
+        """Return all cache entries, most recently used first."""
+        with self._lock:
+            entries = [dict(entry, sha256=sha256) for sha256, entry in self._load().items()]
+        return sorted(entries, key=lambda entry: entry['last_used'], reverse=True)
+
+    def stats(self):
+        """Return the cache size for diagnostics."""
+        entries = self.entries()
+        return {
+            'directory': self.directory,
+            'entries': len(entries),
+            'bytes': sum(entry['size'] for entry in entries),
+            'max_bytes': self.max_bytes
+        }
+
+
+def cached_client_artifacts(config, cache, fetch=True, log=print):
+    """
+    Return the cache entries of the client installers a configuration needs.
+
+    Args:
+        config: The configuration dictionary
+        cache: ArtifactCache to look up or fill
+        fetch: Download installers missing from the cache; otherwise only
+               installers already cached are returned
+        log: Callable receiving progress messages
+
+    Returns:
+        dict: Component name to cache entry; installers that could not be
+              cached are left out, and installed from their upstream URL
+    """
+    entries = {}
+    for name, artifact in client_artifacts(config).items():
+        try:
+            entry = (cache.fetch(artifact, log=log) if fetch
+                     else cache.lookup(name, artifact['version'], artifact['sha256']))
+        except (OSError, ValueError) as e:
+            log(f"Could not cache the {name} client installer, workstations will download it: {e}")
+            entry = None
+        if entry is not None:
+            entries[name] = entry
+    return entries
+
+
+# Shared by playbook generation and the web app in this process
+default_cache = ArtifactCache()
@@ -0,0 +1,153 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2024-2025 Iliya Yaroshevskiy
+"""
+Medocker Batch Generation
+
+This module generates stacks for many clinic configurations in one run of the
+configuration tool, spreading the work over a process pool so interpreter startup
+and imports are paid once per worker instead of once per clinic.
+
+Output is deterministic, so clinics whose generated files would not change are
+reported as unchanged and their files are left untouched.
+"""
+
+import contextlib
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .serialization import load_yaml_file
+
+CONFIG_SUFFIXES = ('.yml', '.yaml')
+
+
+def load_batch_jobs(source, output_dir='clinics', ansible=False):
+    """
+    Build the list of batch jobs from a directory of configs or a manifest file.
+
+    A directory yields one job per *.yml/*.yaml file, written to
+    <output_dir>/<name>/docker-compose.yml. A manifest is a YAML file of the form:
+
+        clinics:
+          - config: clinics/north.yml
+            output: build/north/docker-compose.yml
+            ansible: build/north/playbooks    # optional
+
+    Relative paths in a manifest are relative to the manifest's directory.
+
+    Args:
+        source: Path to a directory of configuration files or to a manifest
+        output_dir: Base directory for outputs when source is a directory
+        ansible: Also generate Ansible playbooks for directory jobs
+
+    Returns:
+        list: Job dictionaries with 'name', 'config', 'output' and 'ansible' keys
+    """
+    jobs = []
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            stem, suffix = os.path.splitext(name)
+            if suffix not in CONFIG_SUFFIXES:
+                continue
+            jobs.append({
+                'name': stem,
+                'config': os.path.join(source, name),
+                'output': os.path.join(output_dir, stem, 'docker-compose.yml'),
+                'ansible': os.path.join(output_dir, stem, 'playbooks') if ansible else None
+            })
+        return jobs
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    manifest = load_yaml_file(source) or {}
+    for entry in manifest.get('clinics', []):
+        config_path = os.path.join(base_dir, entry['config'])
+        name = entry.get('name') or os.path.splitext(os.path.basename(config_path))[0]
+        ansible_dir = entry.get('ansible')
+        jobs.append({
+            'name': name,
+            'config': config_path,
+            'output': os.path.join(base_dir, entry.get('output') or os.path.join(output_dir, name, 'docker-compose.yml')),
+            'ansible': os.path.join(base_dir, ansible_dir) if ansible_dir else None
+        })
+    return jobs
+
+
+def run_batch_job(job):
+    """
+    Generate the outputs of a single batch job. Runs inside a worker process.
+
+    Returns:
+        dict: The job's name, status ('generated', 'unchanged' or 'error'),
+              duration in seconds and a message
+    """
+    from .artifact_cache import cached_client_artifacts, default_cache as artifact_cache
+    from .compose_validator import ComposeValidationError
+    from .configure import (create_directories, iter_ansible_files, render_docker_compose,
+                            validate_docker_compose, write_if_changed)
+
+    start = time.perf_counter()
+    result = {'name': job['name'], 'config': job['config'], 'output': job['output']}
+    try:
+        # Keep per-service notices from interleaving in the batch report
+        with contextlib.redirect_stdout(io.StringIO()):
+            config = load_yaml_file(job['config'])
+            issues = validate_docker_compose(config)
+            if issues:
+                raise ComposeValidationError(issues)
+            changed = write_if_changed(job['output'], render_docker_compose(config).content)
+
+            if job.get('ansible'):
+                # Installers already in the artifact cache are delivered from it
+                cached = cached_client_artifacts(config, artifact_cache, fetch=False)
+                for name, write in iter_ansible_files(config, cached):
+                    buffer = io.StringIO()
+                    write(buffer)
+                    changed |= write_if_changed(os.path.join(job['ansible'], name), buffer.getvalue())
+
+            if changed:
+                create_directories(config)
+
+        result['status'] = 'generated' if changed else 'unchanged'
+        result['message'] = f"Wrote {job['output']}" if changed else 'No changes'
+    except Exception as e:
+        result['status'] = 'error'
+        result['message'] = str(e)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def run_batch(jobs, workers=None, report=print):
+    """
+    Run batch jobs on a process pool, reporting each result as it completes.
+
+    Args:
+        jobs: Job dictionaries as returned by load_batch_jobs
+        workers: Number of worker processes (default: one per CPU)
+        report: Callable receiving a line of progress output
+
+    Returns:
+        dict: 'results' (in job order), per-status 'counts', 'seconds' and
+              'throughput' in configs per second
+    """
+    start = time.perf_counter()
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_batch_job, job): index for index, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            report(f"[{result['status']:>9}] {result['name']}: {result['message']} ({result['seconds']:.2f}s)")
+
+    elapsed = time.perf_counter() - start
+    ordered = [results[index] for index in range(len(jobs))]
+    counts = {}
+    for result in ordered:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+
+    return {
+        'results': ordered,
+        'counts': counts,
+        'seconds': elapsed,
+        'throughput': len(jobs) / elapsed if elapsed else 0.0
+    }
@@ -0,0 +1,209 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2024-2025 Iliya Yaroshevskiy
+"""
+Medocker Remote Bootstrap
+
+This module prepares a remote host for a deployment with a single SSH command. A
+shell script is sent over the command's standard input; it creates the deployment
+directory, installs Docker and Compose if they are missing, and prints a JSON
+report describing the host:
+
+    {"os": {"id": "debian", "like": "", "version": "12"}, "arch": "x86_64",
+     "docker": {"installed": true, "running": true, "version": "24.0.7"},
+     "compose": {"command": "docker compose", "version": "2.21.0"},
+     "cpus": 4, "ram_total_gb": 15.6, "ram_available_gb": 11.2,
+     "disk_free_gb": 181.4, "installed": false,
+     "manifest": {"docker-compose.yml": "<sha256>"}}
+
+The manifest holds the digests of the deployment files already in place, so the
+same round trip also tells which files need uploading. The report is checked
+against the catalog requirements of the stack before anything is deployed.
+"""
+
+import json
+import shlex
+import time
+
+# MemTotal leaves out memory reserved by the firmware and the kernel, so a host
+# sold with 8 GB reports about 7.6-7.8 GB; RAM may fall short by this fraction
+RAM_TOLERANCE = 0.1
+
+BOOTSTRAP_SCRIPT = r'''
+set -u
+REMOTE_DIR="$1"; DEPLOY_USER="$2"; INSTALL="$3"; shift 3
+
+mkdir -p "$REMOTE_DIR" || { echo "Failed to create directory $REMOTE_DIR" >&2; exit 2; }
+cd "$REMOTE_DIR" || exit 2
+for f in "$@"; do mkdir -p "$(dirname "$f")"; done
+
+SUDO=""
+[ "$(id -u)" -ne 0 ] && SUDO="sudo"
+
+OS_ID=""; OS_LIKE=""; OS_VERSION=""
+if [ -r /etc/os-release ]; then
+    OS_ID=$(. /etc/os-release && echo "${ID:-}")
+    OS_LIKE=$(. /etc/os-release && echo "${ID_LIKE:-}")
+    OS_VERSION=$(. /etc/os-release && echo "${VERSION_ID:-}")
+fi
+
+probe() {
+    DOCKER=false; DOCKER_RUNNING=false; DOCKER_VERSION=""
+    if command -v docker >/dev/null 2>&1; then
+        DOCKER=true
+        if DOCKER_VERSION=$(docker version --format '{{.Server.Version}}' 2>/dev/null); then
+            DOCKER_RUNNING=true
+        else
+            DOCKER_VERSION=$(docker --version 2>/dev/null | sed 's/^Docker version \([^,]*\).*/\1/')
+        fi
+    fi
+    COMPOSE=""; COMPOSE_VERSION=""
+    if docker compose version >/dev/null 2>&1; then
+        COMPOSE="docker compose"; COMPOSE_VERSION=$(docker compose version --short 2>/dev/null)
+    elif command -v docker-compose >/dev/null 2>&1; then
+        COMPOSE="docker-compose"; COMPOSE_VERSION=$(docker-compose version --short 2>/dev/null)
+    fi
+}
+
+probe
+INSTALLED=false
+if [ "$INSTALL" = 1 ] && { [ "$DOCKER" = false ] || [ -z "$COMPOSE" ]; }; then
+    echo "Docker or docker-compose not found, attempting to install..." >&2
+    INSTALLED=true
+    {
+        case " $OS_ID $OS_LIKE " in
+            *" debian "*|*" ubuntu "*)
+                $SUDO apt-get update
+                $SUDO apt-get install -y docker.io docker-compose
+                ;;
+            *" centos "*|*" rhel "*|*" fedora "*)
+                $SUDO yum install -y yum-utils
+                $SUDO yum-config-manager --add-repo https://download.docker.com/linux/centos/docker-ce.repo
+                $SUDO yum install -y docker-ce docker-ce-cli containerd.io docker-compose-plugin
+                ;;
+            *)
+                echo "Unsupported Linux distribution. Please install Docker and docker-compose manually."
+                INSTALLED=false
+                ;;
+        esac
+        if [ "$INSTALLED" = true ]; then
+            $SUDO systemctl enable docker
+            $SUDO systemctl start docker
+            $SUDO usermod -aG docker "$DEPLOY_USER"
+        fi
+    } 1>&2
+    probe
+fi
+
+DISK_KB=$(df -Pk . | awk 'NR == 2 {print $4}')
+MEM_TOTAL_KB=$(awk '/^MemTotal:/ {print $2}' /proc/meminfo 2>/dev/null)
+MEM_AVAILABLE_KB=$(awk '/^MemAvailable:/ {print $2}' /proc/meminfo 2>/dev/null)
+CPUS=$(nproc 2>/dev/null || getconf _NPROCESSORS_ONLN 2>/dev/null)
+
+str() { printf '"%s"' "$(printf '%s' "$1" | sed 's/\\/\\\\/g; s/"/\\"/g')"; }
+gb() { awk -v kb="${1:-0}" 'BEGIN {printf "%.2f", kb / 1048576}'; }
+
+MANIFEST=""
+for f in "$@"; do
+    if [ -f "$f" ]; then
+        MANIFEST="$MANIFEST${MANIFEST:+, }$(str "$f"): $(str "$(sha256sum -- "$f" | cut -d' ' -f1)")"
+    fi
+done
+
+printf '{"os": {"id": %s, "like": %s, "version": %s}, "arch": %s, ' \
+    "$(str "$OS_ID")" "$(str "$OS_LIKE")" "$(str "$OS_VERSION")" "$(str "$(uname -m)")"
+printf '"docker": {"installed": %s, "running": %s, "version": %s}, ' "$DOCKER" "$DOCKER_RUNNING" "$(str "$DOCKER_VERSION")"
+printf '"compose": {"command": %s, "version": %s}, ' "$(str "$COMPOSE")" "$(str "$COMPOSE_VERSION")"
+printf '"cpus": %s, "ram_total_gb": %s, "ram_available_gb": %s, "disk_free_gb": %s, ' \
+    "${CPUS:-0}" "$(gb "$MEM_TOTAL_KB")" "$(gb "$MEM_AVAILABLE_KB")" "$(gb "$DISK_KB")"
+printf '"installed": %s, "manifest": {%s}}\n' "$INSTALLED" "$MANIFEST"
+'''
+
+
+def bootstrap_command(remote_dir, username, paths=(), install=True):
+    """Build the command running the bootstrap script read from standard input."""
+    args = [remote_dir, username, '1' if install else '0'] + list(paths)
+    return 'sh -s -- ' + ' '.join(shlex.quote(arg) for arg in args)
+
+
+def run_bootstrap(ssh_client, remote_dir, username, paths=(), install=True, log=print):
+    """
+    Probe and prepare a remote host in one round trip.
+
+    Args:
+        ssh_client: Connected paramiko.SSHClient
+        remote_dir: Directory the stack is deployed to; created if missing
+        username: User added to the docker group when Docker is installed
+        paths: Deployment files (relative to remote_dir) to report digests for
+        install: Install Docker and Compose if they are missing
+        log: Callable receiving the installation output line by line
+
+    Returns:
+        dict: The host report (see the module documentation), with the
+              'seconds' the bootstrap took
+
+    Raises:
+        Exception: If the script failed or printed no report
+    """
+    start = time.monotonic()
+    stdin, stdout, stderr = ssh_client.exec_command(bootstrap_command(remote_dir, username, paths, install))
+    stdin.write(BOOTSTRAP_SCRIPT)
+    stdin.flush()
+    stdin.channel.shutdown_write()
+
+    # Installation output arrives on stderr; the report is the last line of stdout
+    errors = []
+    for line in stderr:
+        line = line.rstrip('\r\n')
+        errors.append(line)
+        log(line)
+    output = stdout.read().decode()
+    exit_status = stdout.channel.recv_exit_status()
+
+    lines = [line for line in output.splitlines() if line.startswith('{')]
+    if exit_status != 0 or not lines:
+        raise Exception(f"Host bootstrap failed: {' '.join(errors[-3:]) or f'exit status {exit_status}'}")
+    report = json.loads(lines[-1])
+    report['seconds'] = time.monotonic() - start
+    return report
+
+
+def check_requirements(report, footprint, deployed=False, resources=True):
+    """
+    Compare a host report with the resources a stack needs.
+
+    Args:
+        report: Host report from run_bootstrap
+        footprint: Stack footprint with 'cpu', 'ram' and 'storage' (see
+                   ServiceRegistry.footprint)
+        deployed: Whether the stack already runs on the host; its data then
+                  already takes up disk space, so free disk is not checked
+        resources: Check CPU cores, RAM and disk; otherwise only check that
+                   Docker and Compose are available
+
+    Returns:
+        list: Problems preventing the deployment; empty if the host is suitable
+    """
+    problems = []
+    if not report['docker']['installed']:
+        problems.append("Docker is not installed")
+    if not report['compose']['command']:
+        problems.append("Neither 'docker compose' nor docker-compose is installed")
+    if not resources:
+        return problems
+    if report['cpus'] and footprint['cpu'] > report['cpus']:
+        problems.append(f"The stack reserves {footprint['cpu']:g} CPU cores but the host has {report['cpus']}")
+    if report['ram_total_gb'] and footprint['ram'] * (1 - RAM_TOLERANCE) > report['ram_total_gb']:
+        problems.append(f"The stack reserves {footprint['ram']:g} GB of RAM but the host has {report['ram_total_gb']:g} GB")
+    if not deployed and footprint['storage'] > report['disk_free_gb']:
+        problems.append(f"The stack needs {footprint['storage']:g} GB of disk but only {report['disk_free_gb']:g} GB are free")
+    return problems
+
+
+def describe_host(report):
+    """Format a host report as a one-line summary."""
+    os_name = ' '.join(filter(None, (report['os']['id'], report['os']['version']))) or 'unknown OS'
+    docker = f"Docker {report['docker']['version']}" if report['docker']['installed'] else 'no Docker'
+    compose = (f"{report['compose']['command']} {report['compose']['version']}".strip()
+               if report['compose']['command'] else 'no Compose')
+    return (f"{os_name} ({report['arch']}), {docker}, {compose}, {report['cpus']} CPUs, "
+            f"{report['ram_total_gb']:g} GB RAM, {report['disk_free_gb']:g} GB free disk")
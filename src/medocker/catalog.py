@@ -0,0 +1,225 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2024-2025 Iliya Yaroshevskiy
+"""
+Medocker Service Catalog
+
+This module locates and loads data/service_catalog.json, which lists the services
+offered in the cart together with their versions, tags and resource requirements.
+
+The web interface reads the catalog through a CatalogStore, which parses the file
+once, indexes its services by id, tag and type, and keeps the JSON served to the
+cart as bytes. The file is parsed again only when its mtime, size or inode changes.
+"""
+
+import json
+import os
+import sys
+import threading
+
+from .config_store import _file_signature, freeze
+from .render_cache import content_etag
+
+CATALOG_NAME = os.path.join('data', 'service_catalog.json')
+
+# Catalog section holding each type of service, by the type used in cart items
+SERVICE_TYPES = {
+    'docker': 'docker_services',
+    'ai': 'ai_services',
+    'app': 'app_services',
+    'stack': 'specialty_stacks'
+}
+
+
+def catalog_search_paths():
+    """Return the locations searched for the service catalog, in order."""
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    return [
+        # Source checkout: <repo>/src/medocker -> <repo>/data
+        os.path.join(os.path.dirname(os.path.dirname(package_dir)), CATALOG_NAME),
+        os.path.join(os.path.dirname(package_dir), CATALOG_NAME),
+
+        # Alternative paths relative to the working directory
+        os.path.join(os.getcwd(), CATALOG_NAME),
+        os.path.join(os.path.dirname(os.getcwd()), CATALOG_NAME),
+
+        # Check in the directory where the executable is located (for packaged versions)
+        os.path.join(os.path.dirname(sys.executable), CATALOG_NAME)
+    ]
+
+
+def find_catalog_file():
+    """
+    Find the service catalog file in various possible locations.
+
+    Returns:
+        tuple: (path or None, list of {'path', 'exists'} for every location checked)
+    """
+    results = []
+    for path in catalog_search_paths():
+        exists = os.path.exists(path)
+        results.append({"path": path, "exists": exists})
+        if exists:
+            return path, results
+    return None, results
+
+
+def load_catalog(catalog_file=None):
+    """
+    Load the service catalog.
+
+    Args:
+        catalog_file: Path of the catalog (default: the first one found)
+
+    Returns:
+        dict: The catalog, or an empty dictionary if no catalog file was found
+    """
+    if catalog_file is None:
+        catalog_file, _ = find_catalog_file()
+        if catalog_file is None:
+            return {}
+    with open(catalog_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def docker_requirements(catalog):
+    """Return the requirements of every docker service in a catalog, keyed by id."""
+    return {
+        service['id']: service['requirements']
+        for service in catalog.get('docker_services', [])
+        if service.get('requirements')
+    }
+
+
+class CatalogNotFound(FileNotFoundError):
+    """Raised when no service catalog file exists in any of the search paths."""
+
+    def __init__(self, search_results):
+        super().__init__('Service catalog file not found')
+        self.search_results = search_results
+
+
+class CatalogSnapshot:
+    """One parsed version of the catalog with its indexes; read-only."""
+
+    def __init__(self, path, signature, content):
+        """
+        Args:
+            path: Path the catalog was read from
+            signature: File signature the content was read at
+            content: The raw bytes of the catalog file
+
+        Raises:
+            ValueError: If the catalog is empty or not valid JSON
+        """
+        if not content.strip():
+            raise ValueError('Service catalog file is empty')
+        try:
+            catalog = json.loads(content)
+        except json.JSONDecodeError as e:
+            raise ValueError(f'Invalid JSON in service catalog: {e}') from e
+
+        self.path = path
+        self.signature = signature
+        self.catalog = freeze(catalog)
+        # Served as is to the cart, without serializing on every request
+        self.json = json.dumps(catalog, separators=(',', ':')).encode('utf-8')
+        self.etag = content_etag(self.json)
+
+        self.by_type = {}
+        self.by_id = {}
+        self.by_tag = {}
+        for service_type, section in SERVICE_TYPES.items():
+            services = self.catalog.get(section) or ()
+            self.by_type[service_type] = {service['id']: service for service in services}
+            for service in services:
+                self.by_id.setdefault(service['id'], service)
+                for tag in service.get('tags') or ():
+                    self.by_tag.setdefault(tag, []).append(service)
+
+    def service(self, service_id, service_type=None):
+        """Return a service by id, optionally of a given type, or None."""
+        if service_type is None:
+            return self.by_id.get(service_id)
+        return self.by_type.get(service_type, {}).get(service_id)
+
+    def tagged(self, tag):
+        """Return the services carrying a tag."""
+        return list(self.by_tag.get(tag, ()))
+
+
+class CatalogStore:
+    """Thread-safe cache of the parsed service catalog, reloaded when the file changes."""
+
+    def __init__(self, catalog_file=None):
+        """
+        Args:
+            catalog_file: Path of the catalog (default: the first one found by
+                          find_catalog_file)
+        """
+        self.catalog_file = catalog_file
+        self._configured_file = catalog_file
+        self._lock = threading.Lock()
+        self._snapshot = None
+        # Counters are updated without locking and are therefore best-effort
+        self.hits = 0
+        self.reloads = 0
+
+    def _path(self):
+        # The search is repeated only until a catalog has been found
+        if self.catalog_file is None:
+            path, results = find_catalog_file()
+            if path is None:
+                raise CatalogNotFound(results)
+            self.catalog_file = path
+        return self.catalog_file
+
+    def get(self):
+        """
+        Return the current catalog snapshot, reloading it if the file changed.
+
+        Returns:
+            CatalogSnapshot: The parsed catalog and its indexes
+
+        Raises:
+            CatalogNotFound: If there is no catalog file
+            ValueError: If the catalog is empty or not valid JSON
+        """
+        path = self._path()
+        try:
+            signature = _file_signature(path)
+        except FileNotFoundError:
+            # Search again next time, unless the path was given explicitly
+            self.catalog_file = self._configured_file
+            raise CatalogNotFound([{'path': path, 'exists': False}])
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.path == path and snapshot.signature == signature:
+            self.hits += 1
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.path == path and snapshot.signature == signature:
+                self.hits += 1
+                return snapshot
+            with open(path, 'rb') as f:
+                content = f.read()
+            snapshot = CatalogSnapshot(path, signature, content)
+            self._snapshot = snapshot
+            self.reloads += 1
+            return snapshot
+
+    def stats(self):
+        """Return cache counters for diagnostics."""
+        snapshot = self._snapshot
+        return {
+            'hits': self.hits,
+            'reloads': self.reloads,
+            'path': self.catalog_file,
+            'bytes': len(snapshot.json) if snapshot else 0,
+            'services': {service_type: len(services) for service_type, services in snapshot.by_type.items()}
+                        if snapshot else {}
+        }
+
+
+# Shared by the web interface in this process
+default_store = CatalogStore()
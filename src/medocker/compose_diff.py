@@ -0,0 +1,91 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2024-2025 Iliya Yaroshevskiy
+"""
+Medocker Compose Diff
+
+This module compares two compose documents service by service, so a redeploy can
+recreate only the containers whose definition changed instead of running a blind
+`up -d` over the whole stack.
+
+A service counts as modified when its own definition differs, or when a named
+volume or network it uses is defined differently at the top level of the document.
+"""
+
+from .compose_validator import named_volume, service_dependencies
+
+
+def _references(fragment):
+    """Return the ('volumes', name) and ('networks', name) pairs a service uses."""
+    references = set()
+    for volume in fragment.get('volumes') or []:
+        name = named_volume(volume)
+        if name:
+            references.add(('volumes', name))
+    for network in fragment.get('networks') or []:
+        references.add(('networks', network))
+    return references
+
+
+def diff_compose(old, new):
+    """
+    Compare the services of two compose documents.
+
+    Args:
+        old: The compose document currently deployed
+        new: The compose document about to be deployed
+
+    Returns:
+        dict: 'added', 'removed', 'modified' and 'unchanged' service names and a
+              'changed' flag, in the format of IncrementalComposer.render
+    """
+    old_services = old.get('services') or {}
+    new_services = new.get('services') or {}
+    changed_sections = {
+        (section, name)
+        for section in ('volumes', 'networks')
+        for name in set(old.get(section) or {}) | set(new.get(section) or {})
+        if (old.get(section) or {}).get(name) != (new.get(section) or {}).get(name)
+    }
+
+    diff = {'added': [], 'removed': [], 'modified': [], 'unchanged': []}
+    for name, fragment in new_services.items():
+        if name not in old_services:
+            diff['added'].append(name)
+        elif fragment != old_services[name] or _references(fragment) & changed_sections:
+            diff['modified'].append(name)
+        else:
+            diff['unchanged'].append(name)
+    diff['removed'] = sorted(name for name in old_services if name not in new_services)
+    diff['changed'] = bool(diff['added'] or diff['removed'] or diff['modified'])
+    return diff
+
+
+def dependency_order(compose, names):
+    """
+    Order services so that each one comes after the services it depends on.
+
+    Args:
+        compose: The compose document holding the depends_on relations
+        names: Services to order; dependencies outside this set are respected
+               for ordering but not included
+
+    Returns:
+        list: The services of names, dependencies first
+    """
+    services = compose.get('services') or {}
+    wanted = set(names)
+    order = []
+    visited = set()
+
+    def visit(name):
+        if name in visited or name not in services:
+            return
+        visited.add(name)
+        for dependency in service_dependencies(services[name]):
+            visit(dependency)
+        if name in wanted:
+            order.append(name)
+
+    for name in sorted(wanted):
+        visit(name)
+    return order
@@ -0,0 +1,186 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2024-2025 Iliya Yaroshevskiy
+"""
+Medocker Compose Validator
+
+This module checks a generated docker compose document for problems that would
+otherwise only surface when `docker-compose up` fails on the target host: host
+ports bound twice, duplicate container names, undeclared named volumes, and
+dependencies on missing services or in a loop.
+
+Every check works from indexes built in a single pass over the services, so
+validation is cheap enough to run before every write or deploy.
+"""
+
+WILDCARD_ADDRESSES = ('', '0.0.0.0', '::')
+
+
+class ComposeValidationError(ValueError):
+    """Raised when a compose document fails validation."""
+
+    def __init__(self, issues):
+        self.issues = issues
+        super().__init__(format_issues(issues))
+
+
+def _issue(kind, services, message):
+    return {'kind': kind, 'services': list(services), 'message': message}
+
+
+def _port_range(text):
+    """Return the ports in "8000" or "8000-8010", or None if text is not numeric."""
+    start, _, end = str(text).partition('-')
+    if not start.isdigit() or (end and not end.isdigit()):
+        return None
+    return range(int(start), int(end or start) + 1)
+
+
+def parse_port(spec):
+    """
+    Parse a compose port mapping into the host bindings it creates.
+
+    Args:
+        spec: Short syntax ("[ip:][host:]container[/protocol]") or long syntax dict
+
+    Returns:
+        tuple: (host_ip, protocol, host ports); host ports is empty for mappings
+               without a fixed host port, and None if the mapping is malformed
+    """
+    if isinstance(spec, dict):
+        published = spec.get('published')
+        ports = _port_range(published) if published not in (None, '') else range(0)
+        return spec.get('host_ip', ''), spec.get('protocol', 'tcp'), ports
+
+    text, _, protocol = str(spec).partition('/')
+    host_ip = ''
+    if text.startswith('['):
+        host_ip, _, text = text[1:].partition(']')
+        text = text.lstrip(':')
+    parts = text.split(':')
+    if len(parts) == 1:
+        return host_ip, protocol or 'tcp', range(0) if _port_range(parts[0]) else None
+    if len(parts) == 3:
+        host_ip = parts[0]
+    host = parts[-2]
+    ports = _port_range(host) if host else range(0)
+    if ports is None or _port_range(parts[-1]) is None:
+        return host_ip, protocol or 'tcp', None
+    return host_ip, protocol or 'tcp', ports
+
+
+def named_volume(spec):
+    """Return the named volume a service volume entry refers to, or None for bind mounts."""
+    if isinstance(spec, dict):
+        return spec.get('source') if spec.get('type', 'volume') == 'volume' else None
+    source, separator, _ = str(spec).partition(':')
+    if not separator or source.startswith(('.', '/', '~', '$')) or '/' in source or '\\' in source:
+        return None
+    return source
+
+
+def service_dependencies(service):
+    """Return the names of the services a compose service depends on."""
+    depends_on = service.get('depends_on') or []
+    return list(depends_on.keys()) if isinstance(depends_on, dict) else list(depends_on)
+
+
+def validate_compose(compose):
+    """
+    Check a compose document for conflicts and broken references.
+
+    Args:
+        compose: The compose document as a dictionary
+
+    Returns:
+        list: Issue dictionaries with 'kind', 'services' and 'message' keys,
+              in a stable order; empty if the document is valid
+    """
+    services = compose.get('services') or {}
+    declared_volumes = set(compose.get('volumes') or {})
+    issues = []
+
+    host_ports = {}          # (port, protocol) -> [(service, host_ip, spec)]
+    container_names = {}     # container_name -> service
+    edges = {}               # service -> dependencies
+
+    for name, service in services.items():
+        for spec in service.get('ports') or []:
+            host_ip, protocol, ports = parse_port(spec)
+            if ports is None:
+                issues.append(_issue('port', [name], f"Service '{name}' has an invalid port mapping '{spec}'"))
+                continue
+            for port in ports:
+                bindings = host_ports.setdefault((port, protocol), [])
+                for other, other_ip, other_spec in bindings:
+                    if host_ip == other_ip or host_ip in WILDCARD_ADDRESSES or other_ip in WILDCARD_ADDRESSES:
+                        owners = f"'{name}'" if other == name else f"'{other}' and '{name}'"
+                        issues.append(_issue(
+                            'port', sorted({name, other}),
+                            f"Host port {port}/{protocol} is bound more than once by {owners} ('{other_spec}', '{spec}')"
+                        ))
+                        break
+                bindings.append((name, host_ip, spec))
+
+        container_name = service.get('container_name')
+        if container_name:
+            if container_name in container_names:
+                other = container_names[container_name]
+                issues.append(_issue('container_name', [other, name],
+                                     f"Container name '{container_name}' is used by both '{other}' and '{name}'"))
+            else:
+                container_names[container_name] = name
+
+        for spec in service.get('volumes') or []:
+            volume = named_volume(spec)
+            if volume and volume not in declared_volumes:
+                issues.append(_issue('volume', [name],
+                                     f"Service '{name}' uses volume '{volume}' which is not declared"))
+
+        edges[name] = service_dependencies(service)
+        for dependency in edges[name]:
+            if dependency not in services:
+                issues.append(_issue('depends_on', [name],
+                                     f"Service '{name}' depends on '{dependency}' which is not defined"))
+
+    issues.extend(_dependency_cycles(edges))
+    return issues
+
+
+def _dependency_cycles(edges):
+    """Return an issue for each distinct depends_on cycle."""
+    issues = []
+    seen = set()
+    state = {}
+    for root in edges:
+        if root in state:
+            continue
+        # Iterative depth-first search keeping the current path on a stack
+        stack = [(root, iter(edges[root]))]
+        path = [root]
+        state[root] = 'active'
+        while stack:
+            node, dependencies = stack[-1]
+            dependency = next(dependencies, None)
+            if dependency is None:
+                stack.pop()
+                path.pop()
+                state[node] = 'done'
+            elif dependency not in edges or state.get(dependency) == 'done':
+                continue
+            elif state.get(dependency) == 'active':
+                cycle = path[path.index(dependency):]
+                key = frozenset(cycle)
+                if key not in seen:
+                    seen.add(key)
+                    issues.append(_issue('cycle', cycle,
+                                         "Circular depends_on: " + ' -> '.join(cycle + [dependency])))
+            else:
+                state[dependency] = 'active'
+                stack.append((dependency, iter(edges[dependency])))
+                path.append(dependency)
+    return issues
+
+
+def format_issues(issues):
+    """Format issues as one line each for console output or flash messages."""
+    return '\n'.join(issue['message'] for issue in issues)
@@ -44,6 +44,13 @@ class Config:
     
     # Waitress settings
     THREADS = int(os.environ.get('THREADS', '10'))
+    
+    # Background deployments; kept well below THREADS so the UI stays responsive
+    DEPLOY_WORKERS = int(os.environ.get('DEPLOY_WORKERS', '2'))
+    MAX_QUEUED_DEPLOYS = int(os.environ.get('MAX_QUEUED_DEPLOYS', '20'))
+    
+    # Number of Ansible playbook bundles (zip files) kept on disk for download
+    ANSIBLE_BUNDLE_CACHE_SIZE = int(os.environ.get('ANSIBLE_BUNDLE_CACHE_SIZE', '8'))
 
 
 # Development configuration
@@ -0,0 +1,258 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2024-2025 Iliya Yaroshevskiy
+"""
+Medocker Configuration Store
+
+This module keeps parsed configuration files in memory so that the web interface
+does not have to re-read and re-parse YAML on every request. Cached entries are
+invalidated when the file's mtime, size or inode changes, or explicitly when the
+configuration is saved through save_config.
+
+Snapshots are immutable, so readers never take a lock. All writes go through
+ConfigStore.commit (or ConfigStore.update for read-modify-write), which holds a
+per-file lock, writes to a temporary file and atomically replaces the target.
+"""
+
+import os
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from .serialization import dump_yaml, load_yaml_file
+
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
+
+class ReadOnlyDict(dict):
+    """A dict that refuses modification, used for shared configuration snapshots."""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Configuration snapshots are read-only; use ConfigStore.load() for a mutable copy")
+
+    __setitem__ = _readonly
+    __delitem__ = _readonly
+    clear = _readonly
+    pop = _readonly
+    popitem = _readonly
+    setdefault = _readonly
+    update = _readonly
+    __ior__ = _readonly
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def freeze(value):
+    """Return a read-only copy of a parsed configuration value."""
+    if isinstance(value, dict):
+        return ReadOnlyDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    """Return a mutable copy of a (possibly frozen) configuration value."""
+    if isinstance(value, dict):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(item) for item in value]
+    return value
+
+
+def _file_signature(path):
+    """Return the values that identify a particular version of a file on disk."""
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+@contextmanager
+def _file_lock(path):
+    """Hold an exclusive advisory lock on path + '.lock' for cross-process writers."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.lock', 'a+b') as lock_file:
+        if sys.platform == "win32":
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class ConfigStore:
+    """Thread-safe cache of parsed configuration files with serialized writes."""
+
+    def __init__(self, sidecar=False):
+        """
+        Args:
+            sidecar: Use the binary sidecar cache from the serialization module
+                     when a file has to be (re)parsed
+        """
+        self.sidecar = sidecar
+        self._lock = threading.Lock()
+        self._write_locks = {}
+        self._entries = {}
+        self._versions = {}
+        # Counters are updated without locking and are therefore best-effort
+        self.hits = 0
+        self.misses = 0
+
+    def _install(self, path, signature, snapshot):
+        """Publish a new snapshot for path and return its version number."""
+        with self._lock:
+            version = self._versions.get(path, 0) + 1
+            self._versions[path] = version
+            self._entries[path] = (signature, snapshot, version)
+        return version
+
+    def _write_lock(self, path):
+        with self._lock:
+            return self._write_locks.setdefault(path, threading.Lock())
+
+    def get_versioned(self, config_file, fallback=None):
+        """
+        Return a read-only snapshot of a configuration file and its version.
+
+        Args:
+            config_file: Path to the YAML configuration file
+            fallback: Path to use instead if config_file does not exist (optional)
+
+        Returns:
+            tuple: (version, ReadOnlyDict) where the snapshot is shared between callers
+        """
+        path = os.path.abspath(config_file)
+        try:
+            signature = _file_signature(path)
+        except FileNotFoundError:
+            if fallback is None:
+                raise
+            return self.get_versioned(fallback)
+
+        # Fast path: a dict lookup is atomic, so readers never block on writers
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == signature:
+            self.hits += 1
+            return entry[2], entry[1]
+        self.misses += 1
+
+        snapshot = freeze(load_yaml_file(path, sidecar=self.sidecar))
+        return self._install(path, signature, snapshot), snapshot
+
+    def get(self, config_file, fallback=None):
+        """Return a read-only snapshot of a configuration file (see get_versioned)."""
+        return self.get_versioned(config_file, fallback)[1]
+
+    def load(self, config_file, fallback=None):
+        """Return a mutable copy of a configuration file, suitable for editing."""
+        return thaw(self.get(config_file, fallback))
+
+    def version(self, config_file):
+        """Return the version of the last snapshot published for config_file."""
+        return self._versions.get(os.path.abspath(config_file), 0)
+
+    def _write(self, path, config):
+        """Atomically replace path with the YAML serialization of config."""
+        directory = os.path.dirname(path)
+        fd, temp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                dump_yaml(config, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+        return _file_signature(path)
+
+    def commit(self, config, config_file):
+        """
+        Write a configuration to disk and publish it as the new snapshot.
+
+        The write happens under a per-file thread lock and an advisory file lock,
+        and goes through a temporary file and os.replace, so concurrent readers
+        only ever see a complete file.
+
+        Args:
+            config: The configuration dictionary to save
+            config_file: Path to the YAML configuration file
+
+        Returns:
+            tuple: (version, ReadOnlyDict) for the committed configuration
+        """
+        path = os.path.abspath(config_file)
+        with self._write_lock(path):
+            with _file_lock(path):
+                return self._commit_locked(path, config)
+
+    def _commit_locked(self, path, config):
+        snapshot = freeze(config)
+        signature = self._write(path, snapshot)
+        return self._install(path, signature, snapshot), snapshot
+
+    def update(self, config_file, mutator, fallback=None):
+        """
+        Apply mutator to the latest configuration and commit the result.
+
+        The read, the mutation and the write all happen while holding the write
+        locks, so two concurrent updates can never overwrite each other's changes.
+
+        Args:
+            config_file: Path to the YAML configuration file that is written
+            mutator: Callable receiving a mutable copy of the configuration; it may
+                     edit it in place or return a replacement
+            fallback: Path to read from if config_file does not exist yet (optional)
+
+        Returns:
+            tuple: (version, ReadOnlyDict) for the committed configuration
+        """
+        path = os.path.abspath(config_file)
+        with self._write_lock(path):
+            with _file_lock(path):
+                config = self.load(path, fallback)
+                result = mutator(config)
+                if result is not None:
+                    config = result
+                return self._commit_locked(path, config)
+
+    def invalidate(self, config_file=None):
+        """Drop the cached entry for config_file, or every entry if none is given."""
+        with self._lock:
+            if config_file is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(config_file), None)
+
+    def stats(self):
+        """Return cache counters for diagnostics."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0,
+                'entries': sorted(self._entries),
+                'versions': dict(self._versions)
+            }
+
+
+# Process-wide store shared by the web interface and save_config
+default_store = ConfigStore(sidecar=os.environ.get('MEDOCKER_YAML_SIDECAR', 'false').lower() == 'true')
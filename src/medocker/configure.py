@@ -10,20 +10,37 @@ user's selections in the config directory.
 
 import os
 import sys
-import yaml
 import shutil
+import shlex
 import argparse
 import secrets
 import string
 from pathlib import Path
 import paramiko
 import socket
-import tempfile
+import time
 import jinja2
 import json
 from io import StringIO
 import subprocess
 import platform
+import threading
+
+from .ansible_config import build_ansible_cfg, build_inventory
+from .ansible_events import JSONL_CALLBACK, PlaybookRecorder, describe_recap, events_from_jsonl, recap_from_runner_stats
+from .artifact_cache import cached_client_artifacts, client_artifacts, default_cache as artifact_cache
+from .bootstrap import check_requirements, describe_host, run_bootstrap
+from .compose_diff import dependency_order, diff_compose
+from .compose_validator import ComposeValidationError, format_issues, validate_compose
+from .config_store import default_store as config_store
+from .image_pull import DEFAULT_PULL_WORKERS, compose_images, prepull_images
+from .placement import build_host_composes, describe_placement, plan_placement
+from .references import ReferenceGraph
+from .remote_sync import deployed_manifest, deployed_path, local_manifest, record_deployed, sync_artifacts
+from .render_cache import RenderCache, content_etag, stable_digest
+from .serialization import dump_yaml, load_yaml
+from .service_registry import default_composer, default_registry as default_service_registry
+from .ssh_pool import default_pool as ssh_pool
 
 # Platform-specific imports
 is_windows = platform.system() == "Windows" or sys.platform == "win32"
@@ -39,16 +56,48 @@ except ImportError:
     class WindowsAnsibleRunner:
         """Windows-compatible implementation of ansible-runner functionality."""
         
+        # Whether the JSON lines stdout callback is installed; None until checked
+        jsonl_callback = None
+        
+        @classmethod
+        def has_jsonl_callback(cls, env=None):
+            """
+            Return whether the JSON lines stdout callback can be used.
+            
+            The callback ships with the ansible.posix collection, which ansible-core
+            alone does not include; ansible-doc is asked once per process.
+            """
+            if cls.jsonl_callback is None:
+                try:
+                    result = subprocess.run(['ansible-doc', '-t', 'callback', JSONL_CALLBACK],
+                                            capture_output=True, text=True, env=env, timeout=60)
+                except (OSError, subprocess.TimeoutExpired):
+                    # Checked again once Ansible is installed
+                    return False
+                cls.jsonl_callback = result.returncode == 0
+                if not cls.jsonl_callback:
+                    print(f"The {JSONL_CALLBACK} callback is not installed, so playbook output is passed on as plain text.")
+                    print("Install it with: ansible-galaxy collection install ansible.posix")
+            return cls.jsonl_callback
+        
         @staticmethod
-        def run(playbook, inventory=None, quiet=False, extravars=None):
-            """Run an Ansible playbook using subprocess."""
+        def run(playbook, inventory=None, quiet=False, extravars=None, event_handler=None, envvars=None):
+            """
+            Run an Ansible playbook using subprocess.
+            
+            The playbook's output is requested from the JSON lines stdout callback and
+            read as it is produced; each line is converted to ansible-runner events
+            and passed to event_handler, and the recap of the final stats event is
+            returned as the result's stats. Without the callback, the default output
+            is passed on as verbose events and no stats are returned.
+            """
             # Create a result object that mimics ansible_runner.run() result
             class RunResult:
-                def __init__(self, rc, stdout, stderr):
+                def __init__(self, rc, stdout, stderr, stats=None):
                     self.rc = rc
                     self.stdout = stdout
                     self.stderr = stderr
-                    self.stats = {}  # Would contain stats from Ansible run
+                    self.stats = stats or {}
             
             # Build the ansible-playbook command
             cmd = ['ansible-playbook', playbook]
@@ -57,39 +106,61 @@ except ImportError:
             if extravars:
                 extra_vars_str = json.dumps(extravars)
                 cmd.extend(['--extra-vars', extra_vars_str])
+            env = dict(os.environ, **(envvars or {}))
             
-            # Run the command
-            try:
+            def execute():
+                jsonl = WindowsAnsibleRunner.has_jsonl_callback(env)
+                run_env = dict(env)
+                if jsonl:
+                    run_env.update(ANSIBLE_STDOUT_CALLBACK=JSONL_CALLBACK, ANSIBLE_LOAD_CALLBACK_PLUGINS='1')
                 process = subprocess.Popen(
                     cmd,
                     stdout=subprocess.PIPE,
                     stderr=subprocess.PIPE,
-                    text=True
+                    text=True,
+                    bufsize=1,
+                    env=run_env
                 )
-                stdout, stderr = process.communicate()
-                rc = process.returncode
-                
-                if not quiet:
-                    print(stdout)
+                # Drain stderr concurrently so a chatty run cannot block on a full pipe
+                stderr_lines = []
+                reader = threading.Thread(target=lambda: stderr_lines.extend(process.stderr), daemon=True)
+                reader.start()
                 
-                # Parse output to extract stats if available
+                stdout_lines = []
                 stats = {}
-                # A more robust implementation would parse Ansible output here
-                
-                return RunResult(rc, stdout, stderr)
+                for line in process.stdout:
+                    stdout_lines.append(line)
+                    try:
+                        record = json.loads(line) if jsonl else None
+                    except ValueError:
+                        record = None
+                    if not isinstance(record, dict):
+                        # Warnings and other plain text output, passed on like
+                        # ansible-runner's verbose events
+                        if event_handler is not None:
+                            event_handler({'event': 'verbose', 'stdout': line.rstrip()})
+                        elif not quiet and line.strip():
+                            print(line.rstrip())
+                        continue
+                    for event in events_from_jsonl(record):
+                        if event['event'] == 'playbook_on_stats':
+                            stats = event['event_data']
+                        if event_handler is not None:
+                            event_handler(event)
+                        elif not quiet and event.get('stdout'):
+                            print(event['stdout'])
+                rc = process.wait()
+                reader.join()
+                return RunResult(rc, ''.join(stdout_lines), ''.join(stderr_lines), stats)
+            
+            # Run the command
+            try:
+                return execute()
             except FileNotFoundError:
                 # Ansible not installed - try to install it
                 if try_install_ansible_on_windows():
                     # Try again after installation
-                    process = subprocess.Popen(
-                        cmd,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        text=True
-                    )
-                    stdout, stderr = process.communicate()
-                    rc = process.returncode
-                    return RunResult(rc, stdout, stderr)
+                    return execute()
                 else:
                     # Still couldn't install/run ansible
                     return RunResult(1, "", "ansible-playbook command not found and automatic installation failed")
@@ -110,7 +181,7 @@ def load_config(config_file='config/default.yml'):
     """Load the configuration from the specified YAML file."""
     try:
         with open(config_file, 'r') as f:
-            return yaml.safe_load(f)
+            return load_yaml(f)
     except Exception as e:
         print(f"Error loading configuration file {config_file}: {e}")
         sys.exit(1)
@@ -118,10 +189,9 @@ def load_config(config_file='config/default.yml'):
 
 def save_config(config, config_file='config/custom.yml'):
     """Save the configuration to a YAML file."""
-    os.makedirs(os.path.dirname(config_file), exist_ok=True)
     try:
-        with open(config_file, 'w') as f:
-            yaml.dump(config, f, default_flow_style=False)
+        # Serialized, atomic write that also refreshes cached readers
+        config_store.commit(config, config_file)
         print(f"Configuration saved to {config_file}")
     except Exception as e:
         print(f"Error saving configuration file {config_file}: {e}")
@@ -134,40 +204,25 @@ def generate_password(length=20):
     return ''.join(secrets.choice(alphabet) for _ in range(length))
 
 
-def resolve_variable_references(config):
-    """Resolve variable references in the configuration like ${system.admin_email}."""
-    def _resolve_ref(value, config):
-        if not isinstance(value, str):
-            return value
-        
-        if value.startswith('${') and value.endswith('}'):
-            ref_path = value[2:-1].split('.')
-            ref_value = config
-            for key in ref_path:
-                if key in ref_value:
-                    ref_value = ref_value[key]
-                else:
-                    # Reference not found, return original value
-                    return value
-            return ref_value
-        return value
-    
-    # Process the entire config recursively
-    def _process_dict(d, config):
-        for key, value in d.items():
-            if isinstance(value, dict):
-                _process_dict(value, config)
-            elif isinstance(value, list):
-                for i, item in enumerate(value):
-                    if isinstance(item, dict):
-                        _process_dict(item, config)
-                    else:
-                        value[i] = _resolve_ref(item, config)
-            else:
-                d[key] = _resolve_ref(value, config)
-        return d
+def resolve_variable_references(config, graph=None, previous=None):
+    """
+    Resolve variable references in the configuration like ${system.admin_email}.
+    
+    References may make up a whole value or be embedded in a string, such as
+    "vaultwarden.${system.domain}". Circular references raise ReferenceCycleError.
     
-    return _process_dict(config, config)
+    Args:
+        config: The configuration dictionary, updated in place
+        graph: A compiled ReferenceGraph to reuse (optional, compiled from config if omitted)
+        previous: Values captured with graph.capture() before editing (optional);
+                  when given, only values depending on changed keys are re-evaluated
+        
+    Returns:
+        dict: The configuration with references resolved
+    """
+    if graph is None:
+        graph = ReferenceGraph.compile(config)
+    return graph.resolve(config, previous)
 
 
 def interactive_configuration(config):
@@ -175,6 +230,10 @@ def interactive_configuration(config):
     print("Medocker Interactive Configuration")
     print("=================================")
     
+    # Remember referenced values so only what the user edits is re-resolved
+    graph = ReferenceGraph.compile(config)
+    previous = graph.capture(config)
+    
     # System Configuration
     print("\nSystem Configuration:")
     config['system']['domain'] = input(f"Domain name [{config['system']['domain']}]: ") or config['system']['domain']
@@ -300,471 +359,158 @@ def interactive_configuration(config):
             config['additional_services'][category]['enabled'] = service_enabled.lower() == 'true'
     
     # Resolve any variable references
-    config = resolve_variable_references(config)
+    config = resolve_variable_references(config, graph, previous)
     
     return config
 
 
-def generate_docker_compose(config, output_file='docker-compose.yml'):
-    """Generate a docker-compose.yml file based on the configuration."""
-    compose = {
-        'version': '3.8',
-        'services': {},
-        'networks': {
-            'medocker_network': {
-                'driver': 'bridge'
-            }
-        },
-        'volumes': {}
-    }
+# Rendered compose documents keyed by a hash of the effective configuration
+compose_cache = RenderCache(maxsize=32)
+
+
+def render_docker_compose(config):
+    """
+    Render the docker compose document for a configuration, memoized by content.
     
-    # Add Traefik if enabled
-    if config['infrastructure']['traefik']['enabled']:
-        traefik_labels = [
-            'traefik.enable=true',
-            'traefik.http.routers.traefik.rule=Host(`traefik.' + config['system']['domain'] + '`)',
-            'traefik.http.routers.traefik.service=api@internal',
-            'traefik.http.routers.traefik.entrypoints=websecure',
-            'traefik.http.routers.traefik.tls=true',
-            'traefik.http.routers.traefik.middlewares=traefik-auth'
-        ]
-        
-        # Add basic auth middleware if Keycloak is not enabled
-        if not config['infrastructure']['keycloak']['enabled']:
-            # Using a default admin/password for demo purposes - should be changed in production
-            traefik_labels.extend([
-                'traefik.http.middlewares.traefik-auth.basicauth.users=admin:$$apr1$$JY5M3OsG$$vKDvGPGAM8TO9el64HSVl1' # admin:password
-            ])
+    Args:
+        config: The configuration dictionary
         
-        compose['services']['traefik'] = {
-            'image': f"traefik:{config['infrastructure']['traefik']['version']}",
-            'restart': 'unless-stopped',
-            'ports': [
-                f"{config['infrastructure']['traefik']['http_port']}:80",
-                f"{config['infrastructure']['traefik']['https_port']}:443",
-                f"{config['infrastructure']['traefik']['dashboard_port']}:8080"
-            ],
-            'volumes': [
-                '/var/run/docker.sock:/var/run/docker.sock:ro',
-                './data/traefik/acme.json:/acme.json',
-                './data/traefik/config:/etc/traefik/config'
-            ],
-            'command': [
-                '--api.dashboard=true',
-                '--providers.docker=true',
-                '--providers.docker.exposedByDefault=false',
-                '--entrypoints.web.address=:80',
-                '--entrypoints.websecure.address=:443',
-                '--certificatesresolvers.myresolver.acme.email=' + config['system']['admin_email'],
-                '--certificatesresolvers.myresolver.acme.storage=/acme.json',
-                '--certificatesresolvers.myresolver.acme.tlschallenge=true',
-                # Redirect HTTP to HTTPS if SSL is enabled
-                '--entrypoints.web.http.redirections.entrypoint.to=websecure' if config['system']['ssl_enabled'] else ''
-            ],
-            'labels': traefik_labels,
-            'networks': [
-                'medocker_network'
-            ]
-        }
-        compose['volumes']['traefik_data'] = {'driver': 'local'}
-    
-    # Add PostgreSQL if enabled (needed for Keycloak and Vaultwarden)
-    if config['databases']['postgres']['enabled']:
-        compose['services']['postgres'] = {
-            'image': f"postgres:{config['databases']['postgres']['version']}",
-            'restart': 'unless-stopped',
-            'environment': {
-                'POSTGRES_PASSWORD': config['databases']['postgres']['root_password'],
-            },
-            'volumes': [
-                './data/postgres:/var/lib/postgresql/data'
-            ],
-            'networks': [
-                'medocker_network'
-            ]
-        }
-        compose['volumes']['postgres_data'] = {'driver': 'local'}
+    Returns:
+        Rendered: (content, etag) where content is the YAML text
+    """
+    # Services are described in service_registry; only enabled ones are rendered
+    return compose_cache.get_or_render(
+        stable_digest(config),
+        lambda: dump_yaml(default_service_registry.build_compose(config))
+    )
+
+
+def validate_docker_compose(config):
+    """
+    Check the compose document for a configuration without writing anything.
     
-    # Add Keycloak if enabled
-    if config['infrastructure']['keycloak']['enabled']:
-        keycloak_service = {
-            'image': f"quay.io/keycloak/keycloak:{config['infrastructure']['keycloak']['version']}",
-            'restart': 'unless-stopped',
-            'command': [
-                'start-dev', 
-                '--import-realm'
-            ],
-            'environment': {
-                'KC_DB': 'postgres',
-                'KC_DB_URL': f"jdbc:postgresql://{config['infrastructure']['keycloak']['db_host']}:5432/{config['infrastructure']['keycloak']['db_name']}",
-                'KC_DB_USERNAME': config['infrastructure']['keycloak']['db_user'],
-                'KC_DB_PASSWORD': config['infrastructure']['keycloak']['db_password'],
-                'KEYCLOAK_ADMIN': config['infrastructure']['keycloak']['admin_user'],
-                'KEYCLOAK_ADMIN_PASSWORD': config['infrastructure']['keycloak']['admin_password'],
-                'KC_HOSTNAME': f"keycloak.{config['system']['domain']}",
-                'KC_PROXY': 'edge'
-            },
-            'volumes': [
-                './data/keycloak/realms:/opt/keycloak/data/import'
-            ],
-            'depends_on': [
-                'postgres'
-            ],
-            'networks': [
-                'medocker_network'
-            ]
-        }
-        
-        # If Traefik is enabled, add labels for Traefik routing
-        if config['infrastructure']['traefik']['enabled']:
-            keycloak_service['labels'] = [
-                'traefik.enable=true',
-                'traefik.http.routers.keycloak.rule=Host(`keycloak.' + config['system']['domain'] + '`)',
-                'traefik.http.routers.keycloak.entrypoints=websecure',
-                'traefik.http.routers.keycloak.tls=true',
-                'traefik.http.services.keycloak.loadbalancer.server.port=8080'
-            ]
-        else:
-            # If Traefik is not enabled, expose port directly
-            keycloak_service['ports'] = [
-                f"{config['infrastructure']['keycloak']['port']}:8080"
-            ]
+    Args:
+        config: The configuration dictionary
         
-        compose['services']['keycloak'] = keycloak_service
-        compose['volumes']['keycloak_data'] = {'driver': 'local'}
+    Returns:
+        list: Validation issues (port and container name conflicts, undeclared
+              volumes, broken or circular dependencies); empty if valid
+    """
+    return validate_compose(default_service_registry.build_compose(config))
+
+
+def _stat_signature(path):
+    """Return (mtime, size, inode) of path, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+# Signature of each compose file as we last wrote it, to detect outside edits
+_written_compose_files = {}
+
+
+def write_docker_compose(config, stream, target='stream'):
+    """
+    Write the docker compose document for a configuration to a writable stream.
     
-    # Add MariaDB if enabled
-    if config['databases']['mariadb']['enabled']:
-        compose['services']['mariadb'] = {
-            'image': f"mariadb:{config['databases']['mariadb']['version']}",
-            'restart': 'unless-stopped',
-            'environment': {
-                'MYSQL_ROOT_PASSWORD': config['databases']['mariadb']['root_password'],
-            },
-            'volumes': [
-                './data/mariadb:/var/lib/mysql'
-            ],
-            'networks': [
-                'medocker_network'
-            ]
-        }
-        compose['volumes']['mariadb_data'] = {'driver': 'local'}
+    The YAML is emitted directly into the stream (a local file, an SFTP file
+    handle, a zip entry, ...) without an intermediate file.
     
-    # Add Vaultwarden if enabled
-    if config['components']['vaultwarden']['enabled']:
-        vaultwarden_service = {
-            'image': f"vaultwarden/server:{config['components']['vaultwarden']['version']}",
-            'restart': 'unless-stopped',
-            'environment': {
-                'DATABASE_URL': f"postgresql://{config['components']['vaultwarden']['db_user']}:{config['components']['vaultwarden']['db_pass']}@{config['components']['vaultwarden']['db_host']}:5432/{config['components']['vaultwarden']['db_name']}",
-                'ADMIN_TOKEN': config['components']['vaultwarden']['admin_token'],
-                'DOMAIN': f"https://{config['components']['vaultwarden']['domain']}",
-                'WEBSOCKET_ENABLED': 'true',
-                'SIGNUPS_ALLOWED': 'false',  # Disable public signups by default
-                'WEB_VAULT_ENABLED': 'true',
-            },
-            'volumes': [
-                './data/vaultwarden:/data'
-            ],
-            'networks': [
-                'medocker_network'
-            ],
-            'depends_on': [
-                'postgres'
-            ]
-        }
-        
-        # Configure SMTP if settings provided
-        if config['components']['vaultwarden']['smtp_host']:
-            vaultwarden_service['environment'].update({
-                'SMTP_HOST': config['components']['vaultwarden']['smtp_host'],
-                'SMTP_PORT': str(config['components']['vaultwarden']['smtp_port']),
-                'SMTP_SSL': str(config['components']['vaultwarden']['smtp_ssl']).lower(),
-                'SMTP_USERNAME': config['components']['vaultwarden']['smtp_username'],
-                'SMTP_PASSWORD': config['components']['vaultwarden']['smtp_password'],
-                'SMTP_FROM': config['system']['admin_email']
-            })
-            
-        # Configure SSO with Keycloak if both are enabled
-        if config['infrastructure']['keycloak']['enabled'] and config['components']['vaultwarden']['sso_enabled']:
-            keycloak_url = f"https://keycloak.{config['system']['domain']}"
-            vaultwarden_service['environment'].update({
-                'OIDC_ENABLED': 'true',
-                'OIDC_CLIENT_ID': 'vaultwarden',
-                'OIDC_CLIENT_SECRET': 'vaultwarden-secret',  # This should be configured in Keycloak
-                'OIDC_ISSUER_URL': f"{keycloak_url}/realms/{config['infrastructure']['keycloak']['realm_name']}",
-                'OIDC_AUTHORIZATION_ENDPOINT': f"{keycloak_url}/realms/{config['infrastructure']['keycloak']['realm_name']}/protocol/openid-connect/auth",
-                'OIDC_TOKEN_ENDPOINT': f"{keycloak_url}/realms/{config['infrastructure']['keycloak']['realm_name']}/protocol/openid-connect/token",
-                'OIDC_USERINFO_ENDPOINT': f"{keycloak_url}/realms/{config['infrastructure']['keycloak']['realm_name']}/protocol/openid-connect/userinfo",
-                'OIDC_DISPLAY_NAME': 'Keycloak',
-                'OIDC_ALLOW_SIGNUP': 'true'
-            })
-        
-        # If Traefik is enabled, add labels for Traefik routing
-        if config['infrastructure']['traefik']['enabled']:
-            vaultwarden_service['labels'] = [
-                'traefik.enable=true',
-                'traefik.http.routers.vaultwarden.rule=Host(`vaultwarden.' + config['system']['domain'] + '`)',
-                'traefik.http.routers.vaultwarden.entrypoints=websecure',
-                'traefik.http.routers.vaultwarden.tls=true',
-                'traefik.http.services.vaultwarden.loadbalancer.server.port=80',
-                # WebSocket support for real-time notifications
-                'traefik.http.routers.vaultwarden-ws.rule=Host(`vaultwarden.' + config['system']['domain'] + '`) && Path(`/notifications/hub`)',
-                'traefik.http.routers.vaultwarden-ws.entrypoints=websecure',
-                'traefik.http.routers.vaultwarden-ws.tls=true',
-                'traefik.http.services.vaultwarden-ws.loadbalancer.server.port=3012'
-            ]
-        else:
-            # If Traefik is not enabled, expose port directly
-            vaultwarden_service['ports'] = [
-                f"{config['components']['vaultwarden']['port']}:80",
-                '3012:3012'  # WebSocket port
-            ]
+    Args:
+        config: The configuration dictionary
+        stream: A writable text stream
+        target: Name under which the previous render is remembered for diffing
         
-        compose['services']['vaultwarden'] = vaultwarden_service
-        compose['volumes']['vaultwarden_data'] = {'driver': 'local'}
+    Returns:
+        dict: Per-service diff against the previous render for the same target
+    """
+    compose, diff = default_composer.render(config, target)
+    dump_yaml(compose, stream)
+    return diff
+
+
+def generate_docker_compose(config, output_file='docker-compose.yml'):
+    """
+    Generate a docker-compose.yml file based on the configuration.
     
-    # Add OpenEMR if enabled
-    if config['components']['openemr']['enabled']:
-        openemr_service = {
-            'image': f"openemr/openemr:{config['components']['openemr']['version']}",
-            'restart': 'unless-stopped',
-            'volumes': [
-                './data/openemr/sites:/var/www/localhost/htdocs/openemr/sites',
-                './data/openemr/logs:/var/log/apache2'
-            ],
-            'environment': {
-                'MYSQL_HOST': config['components']['openemr']['db_host'],
-                'MYSQL_ROOT_PASS': config['databases']['mariadb']['root_password'],
-                'MYSQL_USER': config['components']['openemr']['db_user'],
-                'MYSQL_PASS': config['components']['openemr']['db_pass'],
-                'MYSQL_DATABASE': config['components']['openemr']['db_name'],
-                'OE_USER': 'admin',
-                'OE_PASS': 'pass'
-            },
-            'networks': [
-                'medocker_network'
-            ],
-            'depends_on': [
-                'mariadb'
-            ]
-        }
-        
-        # If Traefik is enabled, add labels for Traefik routing
-        if config['infrastructure']['traefik']['enabled']:
-            openemr_service['labels'] = [
-                'traefik.enable=true',
-                'traefik.http.routers.openemr.rule=Host(`openemr.' + config['system']['domain'] + '`)',
-                'traefik.http.routers.openemr.entrypoints=websecure',
-                'traefik.http.routers.openemr.tls=true',
-                'traefik.http.services.openemr.loadbalancer.server.port=80'
-            ]
-            
-            # Add OIDC configuration if Keycloak is enabled
-            if config['infrastructure']['keycloak']['enabled']:
-                # Note: OpenEMR OIDC configuration needs to be done through the admin interface
-                print("OpenEMR and Keycloak detected. You'll need to configure OIDC in OpenEMR manually after startup.")
-        else:
-            # If Traefik is not enabled, expose port directly
-            openemr_service['ports'] = [
-                f"{config['components']['openemr']['port']}:80"
-            ]
-        
-        compose['services']['openemr'] = openemr_service
-        compose['volumes']['openemr_sites'] = {'driver': 'local'}
-        compose['volumes']['openemr_logs'] = {'driver': 'local'}
+    Only services whose configuration changed since the last generation of the
+    same file are re-rendered, and the file is not rewritten if nothing changed.
     
-    # Add Nextcloud if enabled
-    if config['components']['nextcloud']['enabled']:
-        nextcloud_service = {
-            'image': f"nextcloud:{config['components']['nextcloud']['version']}",
-            'restart': 'unless-stopped',
-            'volumes': [
-                './data/nextcloud:/var/www/html'
-            ],
-            'environment': {
-                'MYSQL_HOST': config['components']['nextcloud']['db_host'],
-                'MYSQL_DATABASE': config['components']['nextcloud']['db_name'],
-                'MYSQL_USER': config['components']['nextcloud']['db_user'],
-                'MYSQL_PASSWORD': config['components']['nextcloud']['db_pass'],
-                'NEXTCLOUD_ADMIN_USER': 'admin',
-                'NEXTCLOUD_ADMIN_PASSWORD': 'admin',
-                'NEXTCLOUD_TRUSTED_DOMAINS': config['system']['domain'] + ' nextcloud.' + config['system']['domain']
-            },
-            'networks': [
-                'medocker_network'
-            ],
-            'depends_on': [
-                'mariadb'
-            ]
-        }
+    Args:
+        config: The configuration dictionary
+        output_file: Path of the compose file to write
         
-        # If Traefik is enabled, add labels for Traefik routing
-        if config['infrastructure']['traefik']['enabled']:
-            nextcloud_service['labels'] = [
-                'traefik.enable=true',
-                'traefik.http.routers.nextcloud.rule=Host(`nextcloud.' + config['system']['domain'] + '`)',
-                'traefik.http.routers.nextcloud.entrypoints=websecure',
-                'traefik.http.routers.nextcloud.tls=true',
-                'traefik.http.services.nextcloud.loadbalancer.server.port=80'
-            ]
-            
-            # Add OIDC configuration if Keycloak is enabled
-            if config['infrastructure']['keycloak']['enabled']:
-                # Note: Nextcloud OIDC configuration can be done through env vars or apps
-                print("Nextcloud and Keycloak detected. You'll need to install the SSO & SAML app in Nextcloud.")
-        else:
-            # If Traefik is not enabled, expose port directly
-            nextcloud_service['ports'] = [
-                f"{config['components']['nextcloud']['port']}:80"
-            ]
+    Returns:
+        dict: Services 'added', 'removed', 'modified' and 'unchanged' since the
+              previous generation, and a 'changed' flag
         
-        compose['services']['nextcloud'] = nextcloud_service
-        compose['volumes']['nextcloud_data'] = {'driver': 'local'}
+    Raises:
+        ComposeValidationError: If the generated document has conflicts; the
+                                file is not written in that case
+    """
+    target = os.path.abspath(output_file)
+    compose, diff = default_composer.render(config, target)
     
-    # Add Portainer if enabled
-    if config['additional_services']['portainer']['enabled']:
-        portainer_service = {
-            'image': f"portainer/portainer-ce:{config['additional_services']['portainer']['version']}",
-            'restart': 'unless-stopped',
-            'volumes': [
-                './data/portainer:/data',
-                '/var/run/docker.sock:/var/run/docker.sock'
-            ],
-            'networks': [
-                'medocker_network'
-            ]
-        }
-        
-        # If Traefik is enabled, add labels for Traefik routing
-        if config['infrastructure']['traefik']['enabled']:
-            portainer_service['labels'] = [
-                'traefik.enable=true',
-                'traefik.http.routers.portainer.rule=Host(`portainer.' + config['system']['domain'] + '`)',
-                'traefik.http.routers.portainer.entrypoints=websecure',
-                'traefik.http.routers.portainer.tls=true',
-                'traefik.http.services.portainer.loadbalancer.server.port=9000'
-            ]
-        else:
-            # If Traefik is not enabled, expose port directly
-            portainer_service['ports'] = [
-                f"{config['additional_services']['portainer']['port']}:9443"
-            ]
-        
-        compose['services']['portainer'] = portainer_service
-        compose['volumes']['portainer_data'] = {'driver': 'local'}
-    
-    # Add Rustdesk if enabled
-    if config['additional_services']['rustdesk']['enabled']:
-        # Create server and relay configuration
-        rustdesk_hbbs_service = {
-            'image': f"rustdesk/rustdesk-server:{config['additional_services']['rustdesk']['version']}",
-            'restart': 'unless-stopped',
-            'container_name': 'rustdesk-hbbs',
-            'ports': [
-                f"{config['additional_services']['rustdesk']['hbbs_port']}:21115/tcp",
-                f"{config['additional_services']['rustdesk']['hbbs_port']}:21115/udp",
-                f"{config['additional_services']['rustdesk']['hbbs_port']}:21116/tcp",
-                f"{config['additional_services']['rustdesk']['hbbs_port']}:21116/udp",
-                f"{config['additional_services']['rustdesk']['web_port']}:8080"
-            ],
-            'volumes': [
-                './data/rustdesk:/root',
-            ],
-            'command': 'hbbs -r rustdesk-hbbr:21117',
-            'environment': {
-                'RUSTDESK_RELAY_SERVER': 'rustdesk-hbbr:21117',
-                'RUSTDESK_KEY': config['additional_services']['rustdesk']['key_base']
-            },
-            'networks': [
-                'medocker_network'
-            ],
-            'depends_on': [
-                'rustdesk-hbbr'
-            ]
-        }
-        
-        rustdesk_hbbr_service = {
-            'image': f"rustdesk/rustdesk-server:{config['additional_services']['rustdesk']['version']}",
-            'restart': 'unless-stopped',
-            'container_name': 'rustdesk-hbbr',
-            'ports': [
-                f"{config['additional_services']['rustdesk']['relay_port']}:21117/tcp",
-                f"{config['additional_services']['rustdesk']['relay_port']}:21117/udp"
-            ],
-            'command': 'hbbr',
-            'volumes': [
-                './data/rustdesk:/root',
-            ],
-            'networks': [
-                'medocker_network'
-            ]
-        }
-        
-        # Add Traefik routing if enabled
-        if config['infrastructure']['traefik']['enabled']:
-            rustdesk_hbbs_service['labels'] = [
-                'traefik.enable=true',
-                'traefik.http.routers.rustdesk.rule=Host(`rustdesk.' + config['system']['domain'] + '`)',
-                'traefik.http.routers.rustdesk.entrypoints=websecure',
-                'traefik.http.routers.rustdesk.tls=true',
-                'traefik.http.services.rustdesk.loadbalancer.server.port=8080'
-            ]
-        
-        compose['services']['rustdesk-hbbs'] = rustdesk_hbbs_service
-        compose['services']['rustdesk-hbbr'] = rustdesk_hbbr_service
-        compose['volumes']['rustdesk_data'] = {'driver': 'local'}
-    
-    # Add Fasten Health if enabled
-    if config['additional_services']['fasten_health']['enabled']:
-        fasten_health_service = {
-            'image': f"fastenhealth/fasten-onprem:{config['additional_services']['fasten_health']['version']}",
-            'restart': 'unless-stopped',
-            'container_name': 'fasten-health',
-            'environment': {
-                'FASTEN_HOST': config['additional_services']['fasten_health']['host'],
-                'FASTEN_PORT': config['additional_services']['fasten_health']['port'],
-                'FASTEN_USER_EMAIL': 'admin@example.com',
-                'FASTEN_USER_PASSWORD': 'changeme',
-                'FASTEN_ALLOW_SIGNUP': 'true'
-            },
-            'volumes': [
-                './data/fasten-health:/app/backend/storage',
-            ],
-            'networks': [
-                'medocker_network'
-            ]
-        }
-        
-        # Add Traefik routing if enabled
-        if config['infrastructure']['traefik']['enabled']:
-            fasten_health_service['labels'] = [
-                'traefik.enable=true',
-                'traefik.http.routers.fastenhealth.rule=Host(`fastenhealth.' + config['system']['domain'] + '`)',
-                'traefik.http.routers.fastenhealth.entrypoints=websecure',
-                'traefik.http.routers.fastenhealth.tls=true',
-                'traefik.http.services.fastenhealth.loadbalancer.server.port=' + str(config['additional_services']['fasten_health']['port'])
-            ]
-        else:
-            # If Traefik is not enabled, expose port directly
-            fasten_health_service['ports'] = [
-                f"{config['additional_services']['fasten_health']['port']}:{config['additional_services']['fasten_health']['port']}"
-            ]
-        
-        compose['services']['fasten-health'] = fasten_health_service
-        compose['volumes']['fasten_health_data'] = {'driver': 'local'}
+    issues = validate_compose(compose)
+    if issues:
+        raise ComposeValidationError(issues)
     
-    # Add additional services as needed
-    # This is just a starting point - you would add more service definitions
-    # based on which are enabled in the configuration
+    if not diff['changed'] and target in _written_compose_files \
+            and _written_compose_files[target] == _stat_signature(target):
+        print(f"Docker Compose file unchanged: {output_file}")
+        return diff
     
     try:
         with open(output_file, 'w') as f:
-            yaml.dump(compose, f, default_flow_style=False)
+            dump_yaml(compose, f)
+        _written_compose_files[target] = _stat_signature(target)
         print(f"Docker Compose file generated: {output_file}")
     except Exception as e:
         print(f"Error generating Docker Compose file: {e}")
         sys.exit(1)
+    
+    return diff
+
+
+def generate_placement(config, output_dir='hosts', placement=None):
+    """
+    Spread the enabled services over the hosts of a placement inventory and write
+    one docker-compose.yml per host, to <output_dir>/<host>/docker-compose.yml.
+    
+    Args:
+        config: The configuration dictionary
+        output_dir: Directory receiving one subdirectory per host
+        placement: Placement settings (default: config['placement'])
+        
+    Returns:
+        tuple: (plan, {host name: compose file path})
+        
+    Raises:
+        PlacementError: If the services do not fit on the hosts
+        ComposeValidationError: If a host's compose document has conflicts
+    """
+    plan = plan_placement(config, default_service_registry, placement)
+    composes = build_host_composes(config, default_service_registry, plan)
+    
+    # Validate every host before writing any of them
+    for name, compose in composes.items():
+        issues = validate_compose(compose)
+        if issues:
+            raise ComposeValidationError([dict(issue, message=f"{name}: {issue['message']}") for issue in issues])
+    
+    files = {}
+    for name, compose in composes.items():
+        host_dir = os.path.join(output_dir, name)
+        os.makedirs(host_dir, exist_ok=True)
+        files[name] = os.path.join(host_dir, 'docker-compose.yml')
+        with open(files[name], 'w') as f:
+            dump_yaml(compose, f)
+    
+    print(describe_placement(plan))
+    return plan, files
 
 
 def create_directories(config):
@@ -826,7 +572,7 @@ def create_directories(config):
                     ]
                 }
                 with open(realm_file, 'w') as f:
-                    yaml.dump(realm_config, f, default_flow_style=False)
+                    dump_yaml(realm_config, f)
                 print(f"Created default Keycloak realm configuration: {realm_file}")
             except Exception as e:
                 print(f"Warning: Could not create default realm configuration: {e}")
@@ -861,7 +607,194 @@ def create_directories(config):
     print(f"Created directories in {base_dir}")
 
 
-def deploy_docker_compose_ssh(config, host, username, password=None, key_path=None, port=22):
+# Container states that count as started; containers with a healthcheck must be healthy
+READY_STATES = ('healthy', 'running')
+FAILED_STATES = ('exited', 'dead')
+
+
+def wait_for_healthy(ssh_client, remote_dir, timeout=300, interval=2, compose_command='docker-compose', services=None):
+    """
+    Poll the containers of a deployed stack until all of them are ready.
+    
+    Containers with a healthcheck are ready once healthy, others once running.
+    
+    Args:
+        ssh_client: Connected paramiko.SSHClient
+        remote_dir: Directory holding the stack's docker-compose.yml
+        timeout: Seconds to wait before giving up
+        interval: Seconds between polls
+        compose_command: 'docker compose' or 'docker-compose'
+        services: Only wait for the containers of these services (default: all)
+        
+    Returns:
+        dict: 'healthy' flag, 'seconds' waited and the last 'containers' states
+    """
+    command = (f"cd {remote_dir} && docker inspect --format "
+               "'{{.Name}} {{if .State.Health}}{{.State.Health.Status}}{{else}}{{.State.Status}}{{end}}' "
+               f"$({compose_command} ps -q {' '.join(services or [])})")
+    start = time.monotonic()
+    containers = {}
+    while True:
+        stdin, stdout, stderr = ssh_client.exec_command(command)
+        output = stdout.read().decode()
+        if stdout.channel.recv_exit_status() == 0:
+            containers = dict(line.lstrip('/').split(' ', 1) for line in output.splitlines() if ' ' in line)
+        
+        elapsed = time.monotonic() - start
+        states = set(containers.values())
+        if containers and states <= set(READY_STATES):
+            return {'healthy': True, 'seconds': elapsed, 'containers': containers}
+        if states & set(FAILED_STATES) or elapsed >= timeout:
+            return {'healthy': False, 'seconds': elapsed, 'containers': containers}
+        time.sleep(interval)
+
+
+# Seconds kept in reserve around a deployment deadline: waits for healthy
+# containers end this long before it, remote commands are stopped this long after
+DEADLINE_MARGIN = 5
+
+
+def bounded_command(command, deadline=None):
+    """
+    Wrap a remote shell command so that the host itself stops it at a deadline.
+    
+    Args:
+        command: The shell command
+        deadline: time.monotonic() value by which the command must end (optional)
+        
+    Returns:
+        str: The command, run under timeout(1) if a deadline is given
+    """
+    if deadline is None:
+        return command
+    # The deployment notices its deadline first and closes the connection
+    seconds = max(int(deadline - time.monotonic()), 0) + DEADLINE_MARGIN
+    return f"timeout {seconds} sh -c {shlex.quote(command)}"
+
+
+def remaining(deadline):
+    """Return the seconds left to wait for containers before a deadline."""
+    return max(deadline - time.monotonic() - DEADLINE_MARGIN, 0)
+
+
+def recreate_services(ssh_client, remote_dir, compose, diff, compose_command='docker-compose', health_timeout=300,
+                      log=print, deadline=None):
+    """
+    Recreate only the services that changed, one at a time in dependency order.
+    
+    Each service is started with `up -d --no-deps`, so containers of unchanged
+    services, including those depending on it, are left running. Containers of
+    removed services are removed.
+    
+    Args:
+        ssh_client: Connected paramiko.SSHClient
+        remote_dir: Directory holding the new docker-compose.yml
+        compose: The new compose document
+        diff: Result of diff_compose between the deployed and the new document
+        compose_command: 'docker compose' or 'docker-compose'
+        health_timeout: Seconds to wait for each service to become ready (0 to not wait)
+        log: Callable receiving progress messages and remote command output
+        deadline: time.monotonic() value by which every command must end (optional)
+        
+    Returns:
+        dict: 'recreated' services in the order they were started, the
+              'unavailable' seconds of each (from its recreation until it was
+              ready again), the 'removed' services and the combined 'output'
+        
+    Raises:
+        Exception: If docker-compose fails for a service
+    """
+    order = dependency_order(compose, diff['added'] + diff['modified'])
+    outputs = []
+    unavailable = {}
+    
+    if diff['removed']:
+        log(f"Removing containers of {', '.join(diff['removed'])}")
+    if diff['removed'] and not order:
+        # Nothing else changed, so a plain up only removes the orphans
+        exit_status, output = run_remote_command(
+            ssh_client, bounded_command(f"cd {remote_dir} && {compose_command} up -d --remove-orphans", deadline), log)
+        if exit_status != 0:
+            raise Exception(f"Failed to remove services: {output}")
+        outputs.append(output)
+    
+    for index, name in enumerate(order):
+        orphans = ' --remove-orphans' if index == 0 and diff['removed'] else ''
+        log(f"$ {compose_command} up -d --no-deps{orphans} {name}")
+        started = time.monotonic()
+        exit_status, output = run_remote_command(
+            ssh_client, bounded_command(f"cd {remote_dir} && {compose_command} up -d --no-deps{orphans} {name}", deadline), log)
+        if exit_status != 0:
+            raise Exception(f"Failed to recreate {name}: {output}")
+        outputs.append(output)
+        if health_timeout:
+            timeout = health_timeout if deadline is None else min(health_timeout, remaining(deadline))
+            health = wait_for_healthy(ssh_client, remote_dir, timeout=timeout,
+                                      compose_command=compose_command, services=[name])
+            if not health['healthy']:
+                log(f"{name} is not ready after {health['seconds']:.1f}s")
+        unavailable[name] = time.monotonic() - started
+        log(f"{name} recreated, back after {unavailable[name]:.1f}s")
+    
+    return {
+        'recreated': order,
+        'unavailable': unavailable,
+        'removed': diff['removed'],
+        'output': '\n'.join(outputs)
+    }
+
+
+def run_remote_command(ssh_client, command, log=print):
+    """
+    Run a command on a remote server, passing its output on line by line as it arrives.
+    
+    Standard error is merged into standard output, so progress messages that tools
+    like docker-compose write to stderr are shown in order.
+    
+    Args:
+        ssh_client: Connected paramiko.SSHClient
+        command: Shell command to run
+        log: Callable receiving each line of output
+        
+    Returns:
+        tuple: (exit status, combined output)
+    """
+    channel = ssh_client.get_transport().open_session()
+    channel.set_combine_stderr(True)
+    channel.exec_command(command)
+    lines = []
+    with channel.makefile('r') as output:
+        for line in output:
+            line = line.rstrip('\r\n')
+            lines.append(line)
+            log(line)
+    return channel.recv_exit_status(), '\n'.join(lines)
+
+
+def deployment_artifacts(config, compose=None, target='stream'):
+    """
+    Collect the files deployed to the remote directory of a stack.
+    
+    Args:
+        config: The configuration dictionary
+        compose: Compose document to deploy instead of the one generated from config
+        target: Name under which the compose render is remembered for diffing
+        
+    Returns:
+        dict: File content keyed by path relative to the remote directory
+    """
+    if compose is not None:
+        compose_text = dump_yaml(compose)
+    else:
+        stream = StringIO()
+        write_docker_compose(config, stream, target=target)
+        compose_text = stream.getvalue()
+    return {'docker-compose.yml': compose_text}
+
+
+def deploy_docker_compose_ssh(config, host, username, password=None, key_path=None, port=22, compose=None,
+                              health_timeout=300, log=print, force=False, enforce_requirements=True,
+                              pull_workers=DEFAULT_PULL_WORKERS, refresh_images=False, deadline=None):
     """
     Deploy docker-compose.yml to a remote server via SSH.
     
@@ -872,120 +805,227 @@ def deploy_docker_compose_ssh(config, host, username, password=None, key_path=No
         password: SSH password (optional if using key-based auth)
         key_path: Path to SSH private key (optional if using password auth)
         port: SSH port (default: 22)
+        compose: Compose document to deploy instead of the one generated from
+                 config, such as one host's share of a placement (optional)
+        health_timeout: Seconds to wait for all containers to become healthy
+                        after starting them (0 to not wait)
+        log: Callable receiving progress messages and remote command output
+        force: Run docker-compose up for the whole stack, even if no file
+               changed since the last successful deployment
+        enforce_requirements: Refuse hosts with fewer CPU cores, less RAM or
+                              (for a first deployment) less free disk than the
+                              catalog requirements of the stack
+        pull_workers: Number of images pulled in parallel before starting the stack
+        refresh_images: Also pull tagged images already on the host, to pick up
+                        new versions of their tags
+        deadline: time.monotonic() value by which the deployment must end
+                  (optional). When it passes, the connection is closed, which
+                  aborts whatever the deployment was waiting for, and remote
+                  docker-compose commands are stopped by the host; the
+                  deployment is then reported with status 'timeout'
         
     Returns:
-        dict: Result of the deployment with status and message
+        dict: Result of the deployment with status and message, the bootstrap
+              report of the 'host', the files 'uploaded' and whether anything
+              'changed' since the last successful deployment, the 'pull'
+              results with the 'pull_seconds' and the 'recreate_seconds'
+              taken by docker-compose up, the services
+              'recreated' and 'removed' with the seconds each one was
+              'unavailable' (only known for a targeted redeploy; 'diff' is None
+              when the whole stack was brought up), and the
+              'time_to_healthy' in seconds (None if not all became healthy)
     """
+    # Catch conflicts locally instead of waiting for docker-compose to fail remotely
+    issues = validate_compose(compose) if compose is not None else validate_docker_compose(config)
+    if issues:
+        return {
+            "status": "error",
+            "message": "The configuration has conflicts:\n" + format_issues(issues),
+            "issues": issues
+        }
+    
+    connection = None
+    discard = False
+    watchdog = None
+    expired = threading.Event()
+    
+    def timed_out():
+        if expired.is_set():
+            return {
+                'status': 'timeout',
+                'message': f"Deployment to {host} aborted when its deadline passed"
+            }
+        return None
+    
     try:
-        # Generate docker-compose file to a temporary location
-        with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:
-            # Generate docker-compose content to the temp file
-            temp_compose_path = temp_file.name
-            generate_docker_compose(config, temp_compose_path)
-        
-        # Connect to the remote server
-        ssh_client = paramiko.SSHClient()
-        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        # Connect to the remote server, reusing a pooled connection when possible
+        connection = ssh_pool.checkout(host, username, password, key_path, port)
+        ssh_client = connection.client
         
-        # Connect with either password or key
-        if key_path:
-            private_key = paramiko.RSAKey.from_private_key_file(key_path)
-            ssh_client.connect(hostname=host, port=port, username=username, pkey=private_key, timeout=10)
-        else:
-            ssh_client.connect(hostname=host, port=port, username=username, password=password, timeout=10)
+        # Closing the connection at the deadline unblocks every pending read
+        if deadline is not None:
+            def expire():
+                expired.set()
+                log(f"Deadline reached, closing the connection to {host}")
+                connection.close()
+            watchdog = threading.Timer(max(deadline - time.monotonic(), 0), expire)
+            watchdog.daemon = True
+            watchdog.start()
         
-        print(f"Successfully connected to {host}")
+        log(f"Successfully connected to {host}" + (" (reused connection)" if connection.uses > 1 else ""))
         
-        # Create the destination directory if it doesn't exist
+        # Probe the host, install Docker if needed and hash the files already in
+        # place, all in one round trip
         remote_dir = config.get('system', {}).get('remote_directory', '/opt/medocker')
-        stdin, stdout, stderr = ssh_client.exec_command(f"mkdir -p {remote_dir}")
-        exit_status = stdout.channel.recv_exit_status()
-        if exit_status != 0:
-            error = stderr.read().decode()
-            raise Exception(f"Failed to create directory: {error}")
-        
-        # Open SFTP connection for file transfer
-        sftp = ssh_client.open_sftp()
+        artifacts = deployment_artifacts(config, compose, target=f"ssh://{username}@{host}:{port}{remote_dir}/docker-compose.yml")
+        report = run_bootstrap(ssh_client, remote_dir, username,
+                               list(artifacts) + [deployed_path(path) for path in artifacts], log=log)
+        log(f"{host}: {describe_host(report)}")
         
-        # Upload the docker-compose.yml file
-        remote_file_path = f"{remote_dir}/docker-compose.yml"
-        sftp.put(temp_compose_path, remote_file_path)
-        print(f"Uploaded docker-compose.yml to {remote_file_path}")
+        # Refuse hosts that cannot run the stack before changing anything on them
+        if compose is not None:
+            footprint = default_service_registry.footprint(config, [
+                default_service_registry.by_name[name].catalog_id
+                for name in compose['services'] if name in default_service_registry.by_name
+            ])
+        else:
+            footprint = default_service_registry.footprint(config)
+        problems = check_requirements(report, footprint, deployed='docker-compose.yml' in report['manifest'],
+                                      resources=enforce_requirements)
+        if problems:
+            return {
+                'status': 'error',
+                'message': f"{host} does not meet the requirements of the stack:\n" + '\n'.join(f"- {p}" for p in problems),
+                'host': report,
+                'problems': problems
+            }
         
-        # Also upload any required .env or config files based on the configuration
-        # (For example, if using custom configs or environment files)
-        # ... additional file uploads would go here ...
+        # Whether the running stack is up to date is told by the record of the
+        # last successful deployment, not by the files in place: a failed
+        # deployment leaves new files behind that never ran
+        deployed = deployed_manifest(report['manifest'], artifacts)
+        changed = deployed != local_manifest(artifacts)
+        if not changed and not force:
+            # Restore files edited on the host since, without touching the stack
+            sync = sync_artifacts(ssh_client, remote_dir, artifacts, open_sftp=connection.sftp, log=log,
+                                  remote=report['manifest'])
+            return {
+                'status': 'success',
+                'message': f"No changes to deploy to {host}; the running stack was left as is",
+                'host': report,
+                'changed': False,
+                'uploaded': sync['uploaded']
+            }
         
-        # Make sure Docker and docker-compose are installed
-        stdin, stdout, stderr = ssh_client.exec_command("which docker docker-compose || which docker-compose")
-        if stdout.channel.recv_exit_status() != 0:
-            # Docker or docker-compose not installed, attempt to install
-            print("Docker or docker-compose not found, attempting to install...")
-            
-            # Check the distribution
-            stdin, stdout, stderr = ssh_client.exec_command("cat /etc/os-release")
-            os_release = stdout.read().decode()
-            
-            if "ubuntu" in os_release.lower() or "debian" in os_release.lower():
-                # Ubuntu/Debian installation commands
-                installation_commands = [
-                    "sudo apt-get update",
-                    "sudo apt-get install -y docker.io docker-compose",
-                    "sudo systemctl enable docker",
-                    "sudo systemctl start docker",
-                    f"sudo usermod -aG docker {username}"
-                ]
-                
-                for cmd in installation_commands:
-                    stdin, stdout, stderr = ssh_client.exec_command(cmd)
-                    if stdout.channel.recv_exit_status() != 0:
-                        error = stderr.read().decode()
-                        print(f"Warning during installation: {error}")
-            
-            elif "centos" in os_release.lower() or "rhel" in os_release.lower() or "fedora" in os_release.lower():
-                # CentOS/RHEL/Fedora installation commands
-                installation_commands = [
-                    "sudo yum install -y yum-utils",
-                    "sudo yum-config-manager --add-repo https://download.docker.com/linux/centos/docker-ce.repo",
-                    "sudo yum install -y docker-ce docker-ce-cli containerd.io docker-compose-plugin",
-                    "sudo systemctl enable docker",
-                    "sudo systemctl start docker",
-                    f"sudo usermod -aG docker {username}"
-                ]
-                
-                for cmd in installation_commands:
-                    stdin, stdout, stderr = ssh_client.exec_command(cmd)
-                    if stdout.channel.recv_exit_status() != 0:
-                        error = stderr.read().decode()
-                        print(f"Warning during installation: {error}")
-            else:
-                print("Unsupported Linux distribution. Please install Docker and docker-compose manually.")
+        # Diff against the compose file the stack was last started from, to
+        # recreate only the services that change. A failed deployment is not
+        # recorded, so its services are recreated again on the next attempt.
+        # Hosts deployed before the record existed fall back to the file in place.
+        new_compose = load_yaml(artifacts['docker-compose.yml'])
+        if 'docker-compose.yml' in deployed:
+            deployed_digest, deployed_file = deployed['docker-compose.yml'], deployed_path('docker-compose.yml')
+        else:
+            deployed_digest, deployed_file = report['manifest'].get('docker-compose.yml'), 'docker-compose.yml'
+        previous_compose = None
+        if deployed_digest and deployed_digest != content_etag(artifacts['docker-compose.yml']) and not force:
+            try:
+                with connection.sftp().open(f"{remote_dir}/{deployed_file}") as remote_file:
+                    previous_compose = load_yaml(remote_file.read().decode())
+            except Exception as e:
+                log(f"Could not read the deployed docker-compose.yml, recreating the whole stack: {e}")
         
-        # Deploy the stack
-        stdin, stdout, stderr = ssh_client.exec_command(f"cd {remote_dir} && docker-compose up -d")
-        exit_status = stdout.channel.recv_exit_status()
+        # Diff the services against the deployed compose file; without one (first
+        # deployment, force, or only other files changed) the whole stack is brought up
+        diff = None
+        if isinstance(previous_compose, dict):
+            diff = diff_compose(previous_compose, new_compose)
+            log(f"Services added: {', '.join(diff['added']) or 'none'}; modified: {', '.join(diff['modified']) or 'none'}; "
+                f"removed: {', '.join(diff['removed']) or 'none'}")
         
-        if exit_status != 0:
-            error = stderr.read().decode()
-            raise Exception(f"Failed to deploy Docker stack: {error}")
+        # Download the images of the rendered compose file while the old
+        # containers keep running, so that up only has to recreate them. Nothing
+        # has been uploaded yet, so a failed pull leaves the host as it was.
+        if diff is not None:
+            images = compose_images({'services': {name: new_compose['services'][name]
+                                                  for name in diff['added'] + diff['modified']}})
+        else:
+            images = compose_images(new_compose)
+        pull = prepull_images(ssh_client, images, workers=pull_workers, refresh=refresh_images, log=log)
+        if pull['status'] != 'success':
+            return {
+                'status': 'error',
+                'message': f"{pull['message']} on {host}; the running stack was left as is",
+                'host': report,
+                'pull': pull['images'],
+                'changed': changed,
+                'uploaded': []
+            }
         
-        deployment_output = stdout.read().decode()
+        # Upload only the files that differ from the remote copies. The SFTP
+        # session is kept open with the pooled connection.
+        sync = sync_artifacts(ssh_client, remote_dir, artifacts, open_sftp=connection.sftp, log=log,
+                              remote=report['manifest'])
         
-        # Close connections
-        sftp.close()
-        ssh_client.close()
+        # Deploy the stack, recreating only the changed services if the previous
+        # compose file is known
+        compose_command = report['compose']['command']
+        started = time.monotonic()
+        if diff is not None:
+            recreated = recreate_services(ssh_client, remote_dir, new_compose, diff, compose_command,
+                                          health_timeout=health_timeout, log=log, deadline=deadline)
+            deployment_output = recreated['output']
+        else:
+            log(f"$ {compose_command} up -d")
+            exit_status, deployment_output = run_remote_command(
+                ssh_client, bounded_command(f"cd {remote_dir} && {compose_command} up -d", deadline), log)
+            if exit_status != 0:
+                raise Exception(f"Failed to deploy Docker stack: {deployment_output}")
+            recreated = {'recreated': list(new_compose.get('services') or {}), 'unavailable': {}, 'removed': []}
+        recreate_seconds = time.monotonic() - started
         
-        # Clean up temp file
-        os.unlink(temp_compose_path)
+        # The stack now runs from the uploaded files
+        record_deployed(ssh_client, remote_dir, artifacts, open_sftp=connection.sftp, log=log, remote=deployed)
         
-        return {
+        result = {
             'status': 'success',
-            'message': f"Successfully deployed to {host}",
-            'output': deployment_output
+            'message': (f"Successfully deployed to {host} (images {pull['seconds']:.1f}s, "
+                        f"recreate {recreate_seconds:.1f}s)"),
+            'output': deployment_output,
+            'host': report,
+            'changed': changed,
+            'uploaded': sync['uploaded'],
+            'pull': pull['images'],
+            'pull_seconds': pull['seconds'],
+            'recreate_seconds': recreate_seconds,
+            'diff': diff,
+            'recreated': recreated['recreated'],
+            'removed': recreated['removed'],
+            'unavailable': recreated['unavailable']
         }
+        if diff is not None:
+            result['message'] += f"; recreated {', '.join(recreated['recreated']) or 'no services'}"
+        
+        # Report how long the stack took to become usable
+        if health_timeout:
+            if deadline is not None:
+                health_timeout = min(health_timeout, remaining(deadline))
+            health = wait_for_healthy(ssh_client, remote_dir, timeout=health_timeout, compose_command=compose_command)
+            seconds = time.monotonic() - started
+            result['health'] = health['containers']
+            result['time_to_healthy'] = seconds if health['healthy'] else None
+            if health['healthy']:
+                result['message'] += f"; all {len(health['containers'])} containers healthy after {seconds:.1f}s"
+            else:
+                pending = ', '.join(f"{name} ({state})" for name, state in sorted(health['containers'].items())
+                                    if state not in READY_STATES)
+                result['message'] += f"; not healthy after {seconds:.1f}s: {pending or 'no containers found'}"
+            log(result['message'])
+        
+        return result
     
     except socket.timeout:
-        return {
+        discard = True
+        return timed_out() or {
             'status': 'error',
             'message': f"Connection timed out while connecting to {host}"
         }
@@ -995,122 +1035,251 @@ def deploy_docker_compose_ssh(config, host, username, password=None, key_path=No
             'message': f"Authentication failed when connecting to {host}"
         }
     except paramiko.SSHException as e:
-        return {
+        discard = True
+        return timed_out() or {
             'status': 'error',
             'message': f"SSH error: {str(e)}"
         }
     except Exception as e:
-        return {
+        return timed_out() or {
             'status': 'error',
             'message': f"Error during deployment: {str(e)}"
         }
+    finally:
+        if watchdog is not None:
+            watchdog.cancel()
+        # Keep the connection for the next deployment unless it failed
+        if connection is not None:
+            ssh_pool.release(connection, discard=discard or expired.is_set())
 
 
-def generate_ansible_playbook(config, output_dir='playbooks'):
+def deploy_placement_ssh(config, placement=None, password=None, log=print):
     """
-    Generate Ansible playbook for user device setup based on configuration.
+    Deploy a stack spread over several hosts, each host receiving its own compose file.
+    
+    SSH settings are taken from each host's 'ssh' entry in the inventory
+    ('username', 'port', 'key_path'); the host's 'address' is connected to.
     
     Args:
         config: The configuration dictionary
-        output_dir: Directory to save the generated playbook
+        placement: Placement settings (default: config['placement'])
+        password: SSH password for hosts without a key_path (optional)
+        log: Callable receiving progress messages
         
     Returns:
-        str: Path to the generated playbook file
+        dict: Overall status and message, the services placed on each host and
+              the deployment result of each host
     """
-    os.makedirs(output_dir, exist_ok=True)
+    try:
+        plan = plan_placement(config, default_service_registry, placement)
+    except ValueError as e:
+        return {'status': 'error', 'message': str(e)}
+    composes = build_host_composes(config, default_service_registry, plan)
+    
+    results = {}
+    for name, compose in composes.items():
+        host = plan['hosts'][name]
+        ssh = host.get('ssh') or {}
+        log(f"Deploying {', '.join(plan['services'][name])} to {name}...")
+        results[name] = deploy_docker_compose_ssh(
+            config,
+            host.get('address', name),
+            ssh.get('username', 'root'),
+            password,
+            ssh.get('key_path'),
+            ssh.get('port', 22),
+            compose=compose,
+            log=log
+        )
+    
+    failed = [name for name, result in results.items() if result['status'] != 'success']
+    return {
+        'status': 'error' if failed else 'success',
+        'message': f"Failed to deploy to {', '.join(failed)}" if failed else f"Successfully deployed to {len(results)} hosts",
+        'placement': plan['services'],
+        'hosts': results
+    }
+
+
+# Where client installers are placed on the workstations
+ARTIFACT_DEST_DIR = '/opt/medocker-user/installers'
+
+ANSIBLE_README = """# Medocker User Setup Playbook
+
+This directory contains Ansible playbooks for setting up user workstations.
+
+## Usage
+
+1. Ensure Ansible is installed on your control machine:
+   ```
+   pip install ansible
+   ```
+
+2. List your workstations under `user_setup.workstations` in the Medocker
+   configuration and regenerate this directory, or edit inventory.yml
+3. Run the playbook from this directory, so that ansible.cfg is used:
+   ```
+   ansible-playbook medocker-user-setup.yml
+   ```
+
+ansible.cfg runs one fork per workstation (up to 50), uses SSH pipelining and
+persistent connections, and caches facts for a day in ~/.ansible/medocker_facts.
+Pipelining needs sudo without `requiretty` on the workstations.
+
+Client installers are copied from Medocker's artifact cache on the control
+node. To run the playbook from another machine, set
+`user_setup.artifact_delivery: http` and `user_setup.artifact_url` to the
+Medocker web app, so workstations download them from there instead.
+
+For more information, see the Medocker documentation.
+"""
+
+
+def build_ansible_playbook(config, cached=None):
+    """
+    Return the user setup playbook for a configuration as a list of plays.
     
-    # Create a basic playbook structure
-    playbook = {
-        'name': 'Medocker User Setup',
+    Every package a workstation needs, including the enabled clients, is
+    installed by a single task, so each host runs one package transaction. All
+    tasks only touch their own host, so the plays use the free strategy and fast
+    hosts do not wait for slow ones between tasks.
+    
+    Client installers (see artifact_cache) are delivered from the local
+    artifact cache when they are in cached: copied from the control node, or
+    with `user_setup.artifact_delivery: http` downloaded from the Medocker web
+    app at `user_setup.artifact_url`. Other installers are downloaded from
+    their upstream URL by each workstation.
+    
+    Args:
+        config: The configuration dictionary
+        cached: Component name to artifact cache entry (optional)
+    """
+    components = config.get('components', {})
+    user_setup = config.get('user_setup') or {}
+    artifacts = client_artifacts(config)
+    cached = cached or {}
+    
+    # System packages and clients available from the distribution's repositories
+    packages = ['docker.io', 'docker-compose', 'python3-pip']
+    if components.get('nextcloud', {}).get('client_enabled', False) and 'nextcloud' not in artifacts:
+        packages.append('nextcloud-desktop')
+    if components.get('vaultwarden', {}).get('client_enabled', False) and 'vaultwarden' not in artifacts:
+        packages.append('bitwarden-desktop')
+    
+    packages_play = {
+        'name': 'Medocker User Setup - packages',
         'hosts': 'all',
         'become': True,
-        'tasks': []
+        'strategy': 'free',
+        'tasks': [
+            {
+                'name': 'Update package cache',
+                'apt': {
+                    'update_cache': True,
+                    'cache_valid_time': 3600
+                },
+                'when': "ansible_facts['os_family'] == 'Debian'"
+            },
+            {
+                'name': 'Install required packages and clients',
+                'package': {
+                    'name': packages,
+                    'state': 'present'
+                }
+            },
+            {
+                'name': 'Install required Python packages',
+                'pip': {
+                    'name': [
+                        'docker',
+                        'docker-compose'
+                    ],
+                    'state': 'present'
+                }
+            }
+        ]
     }
     
-    # Add common setup tasks
-    playbook['tasks'].extend([
-        {
-            'name': 'Update package cache',
-            'package': {
-                'update_cache': True
-            }
-        },
-        {
-            'name': 'Install required packages',
-            'package': {
-                'name': [
-                    'docker.io',
-                    'docker-compose',
-                    'python3-pip'
-                ],
-                'state': 'present'
-            }
-        },
-        {
-            'name': 'Install required Python packages',
-            'pip': {
-                'name': [
-                    'docker',
-                    'docker-compose'
-                ],
-                'state': 'present'
-            }
-        },
-        {
-            'name': 'Add user to docker group',
-            'user': {
-                'name': '{{ ansible_user }}',
-                'groups': 'docker',
-                'append': True
-            }
-        },
-        {
-            'name': 'Create Medocker directories',
+    # Clients distributed as package files, delivered from the artifact cache
+    if artifacts:
+        packages_play['tasks'].append({
+            'name': 'Create installer directory',
             'file': {
-                'path': '/opt/medocker-user',
+                'path': ARTIFACT_DEST_DIR,
                 'state': 'directory',
                 'mode': '0755'
             }
-        }
-    ])
-    
-    # Add tasks for client applications based on config
-    if config.get('components', {}).get('nextcloud', {}).get('client_enabled', False):
-        playbook['tasks'].append({
-            'name': 'Install Nextcloud client',
-            'package': {
-                'name': 'nextcloud-desktop',
-                'state': 'present'
-            }
         })
-    
-    if config.get('components', {}).get('vaultwarden', {}).get('client_enabled', False):
-        playbook['tasks'].append({
-            'name': 'Install Bitwarden client',
-            'package': {
-                'name': 'bitwarden-desktop',
-                'state': 'present'
+    for name, artifact in artifacts.items():
+        dest = f"{ARTIFACT_DEST_DIR}/{artifact['filename']}"
+        entry = cached.get(name)
+        if entry is not None and user_setup.get('artifact_delivery') == 'http' and user_setup.get('artifact_url'):
+            task = {
+                'name': f"Download {name} client installer from Medocker",
+                'get_url': {
+                    'url': f"{user_setup['artifact_url'].rstrip('/')}/artifacts/{entry['sha256']}/{entry['filename']}",
+                    'dest': dest,
+                    'checksum': f"sha256:{entry['sha256']}",
+                    'mode': '0644'
+                }
             }
-        })
-    
-    if config.get('components', {}).get('rustdesk', {}).get('client_enabled', False):
-        playbook['tasks'].append({
-            'name': 'Download and install RustDesk client',
-            'get_url': {
-                'url': 'https://github.com/rustdesk/rustdesk/releases/latest/download/rustdesk-1.1.9.deb',
-                'dest': '/tmp/rustdesk.deb'
+        elif entry is not None:
+            # copy skips the transfer when the workstation already has the file
+            task = {
+                'name': f"Copy {name} client installer from the artifact cache",
+                'copy': {
+                    'src': os.path.abspath(entry['path']),
+                    'dest': dest,
+                    'mode': '0644'
+                }
             }
-        })
-        playbook['tasks'].append({
-            'name': 'Install RustDesk client',
+        else:
+            task = {
+                'name': f"Download {name} client installer",
+                'get_url': {
+                    'url': artifact['url'],
+                    'dest': dest,
+                    'mode': '0644'
+                }
+            }
+            if artifact['sha256']:
+                task['get_url']['checksum'] = f"sha256:{artifact['sha256']}"
+        packages_play['tasks'].append(task)
+        packages_play['tasks'].append({
+            'name': f"Install {name} client",
             'apt': {
-                'deb': '/tmp/rustdesk.deb'
+                'deb': dest
             }
         })
     
+    configuration_play = {
+        'name': 'Medocker User Setup - configuration',
+        'hosts': 'all',
+        'become': True,
+        'strategy': 'free',
+        'tasks': [
+            {
+                'name': 'Add user to docker group',
+                'user': {
+                    'name': '{{ ansible_user }}',
+                    'groups': 'docker',
+                    'append': True
+                }
+            },
+            {
+                'name': 'Create Medocker directories',
+                'file': {
+                    'path': '/opt/medocker-user',
+                    'state': 'directory',
+                    'mode': '0755'
+                }
+            }
+        ]
+    }
+    
     # Configure browser settings if needed
     if config.get('user_setup', {}).get('configure_browser', False):
-        playbook['tasks'].append({
+        configuration_play['tasks'].append({
             'name': 'Configure Firefox settings',
             'template': {
                 'src': 'firefox_prefs.js.j2',
@@ -1118,66 +1287,125 @@ def generate_ansible_playbook(config, output_dir='playbooks'):
             }
         })
     
-    # Generate the playbook YAML file
-    playbook_path = os.path.join(output_dir, 'medocker-user-setup.yml')
-    with open(playbook_path, 'w') as f:
-        yaml.dump(playbook, f, default_flow_style=False)
-    
-    # Also create an inventory file template
-    inventory_path = os.path.join(output_dir, 'inventory.yml')
-    inventory = {
-        'all': {
-            'hosts': {
-                'localhost': {
-                    'ansible_connection': 'local'
-                }
-            },
-            'vars': {
-                'ansible_python_interpreter': '/usr/bin/python3'
-            }
-        }
-    }
-    
-    with open(inventory_path, 'w') as f:
-        yaml.dump(inventory, f, default_flow_style=False)
+    return [packages_play, configuration_play]
+
+
+def build_ansible_inventory(config):
+    """Return the inventory for the user setup playbook (see ansible_config)."""
+    return build_inventory(config)
+
+
+def iter_ansible_files(config, cached=None):
+    """
+    Yield the files making up the Ansible bundle without touching the disk.
     
-    # Create README with instructions
-    readme_path = os.path.join(output_dir, 'README.md')
-    with open(readme_path, 'w') as f:
-        f.write("""# Medocker User Setup Playbook
+    Args:
+        config: The configuration dictionary
+        cached: Component name to artifact cache entry of the client
+                installers to deliver from the cache (optional)
+        
+    Yields:
+        tuple: (relative file name, writer) where writer(stream) writes the
+               file's content to a writable text stream
+    """
+    inventory = build_ansible_inventory(config)
+    forks = (config.get('user_setup') or {}).get('forks')
+    yield 'medocker-user-setup.yml', lambda stream: dump_yaml(build_ansible_playbook(config, cached), stream, sort_keys=False)
+    yield 'inventory.yml', lambda stream: dump_yaml(inventory, stream)
+    yield 'ansible.cfg', lambda stream: stream.write(build_ansible_cfg(inventory, forks))
+    yield 'README.md', lambda stream: stream.write(ANSIBLE_README)
 
-This directory contains Ansible playbooks for setting up user workstations.
 
-## Usage
+def write_if_changed(path, content):
+    """
+    Write content to path unless the file already holds exactly that content.
+    
+    Returns:
+        bool: Whether the file was written
+    """
+    data = content.encode('utf-8')
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return True
 
-1. Ensure Ansible is installed on your control machine:
-   ```
-   pip install ansible
-   ```
 
-2. Edit the inventory.yml file to include your target hosts
-3. Run the playbook:
-   ```
-   ansible-playbook -i inventory.yml medocker-user-setup.yml
-   ```
+def generate_ansible_playbook(config, output_dir='playbooks', fetch_artifacts=True, log=print):
+    """
+    Generate Ansible playbook for user device setup based on configuration.
+    
+    Args:
+        config: The configuration dictionary
+        output_dir: Directory to save the generated playbook
+        fetch_artifacts: Download client installers missing from the artifact
+                         cache, so workstations get them from the cache
+        log: Callable receiving progress messages
+        
+    Returns:
+        str: Path to the generated playbook file
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    cached = cached_client_artifacts(config, artifact_cache, fetch=fetch_artifacts, log=log)
+    
+    # Playbook, inventory file template and README with instructions; unchanged
+    # files keep their modification time, so the bundle served for them is reused
+    for name, write in iter_ansible_files(config, cached):
+        buffer = StringIO()
+        write(buffer)
+        write_if_changed(os.path.join(output_dir, name), buffer.getvalue())
+    
+    return os.path.join(output_dir, 'medocker-user-setup.yml')
 
-For more information, see the Medocker documentation.
-""")
+
+def cache_ansible_artifacts(config, output_dir='playbooks', log=print):
+    """
+    Download the client installers missing from the artifact cache and
+    regenerate the playbook so that workstations get them from the cache.
     
-    return playbook_path
+    Meant to run in the background after generate_ansible_playbook was called
+    with fetch_artifacts=False.
+    
+    Args:
+        config: The configuration dictionary
+        output_dir: Directory holding the generated playbook
+        log: Callable receiving progress messages
+        
+    Returns:
+        dict: 'status' and 'message', with the 'cached' installers by component
+    """
+    playbook_path = generate_ansible_playbook(config, output_dir, fetch_artifacts=True, log=log)
+    cached = cached_client_artifacts(config, artifact_cache, fetch=False)
+    missing = sorted(set(client_artifacts(config)) - set(cached))
+    return {
+        'status': 'error' if missing else 'success',
+        'message': (f"Workstations will download the {', '.join(missing)} installers themselves" if missing
+                    else f"Client installers cached, {playbook_path} delivers them from the cache"),
+        'cached': {name: entry['sha256'] for name, entry in cached.items()}
+    }
 
 
-def run_ansible_playbook(playbook_path, inventory_path=None, extra_vars=None):
+def run_ansible_playbook(playbook_path, inventory_path=None, extra_vars=None, log=print):
     """
     Run an Ansible playbook using ansible-runner.
     
+    The run is followed event by event: the output is passed to log as it is
+    produced, and every task is timed on every host.
+    
     Args:
         playbook_path: Path to the Ansible playbook
         inventory_path: Path to inventory file (optional)
         extra_vars: Dictionary of extra variables (optional)
+        log: Callable receiving the playbook output line by line
         
     Returns:
-        dict: Result of the Ansible run
+        dict: Result of the Ansible run, with the recap 'stats' per host and the
+              'timing' of tasks and hosts (see PlaybookRecorder.summary)
     """
     # Check if ansible_runner is available or if we're using our Windows implementation
     if ansible_runner is None:
@@ -1187,10 +1415,13 @@ def run_ansible_playbook(playbook_path, inventory_path=None, extra_vars=None):
         }
         
     try:
+        recorder = PlaybookRecorder(log=log)
+        
         # Prepare runner parameters
         runner_params = {
             'playbook': playbook_path,
-            'quiet': False,
+            'quiet': True,
+            'event_handler': recorder.handle
         }
         
         if inventory_path:
@@ -1199,22 +1430,43 @@ def run_ansible_playbook(playbook_path, inventory_path=None, extra_vars=None):
         if extra_vars:
             runner_params['extravars'] = extra_vars
         
+        # Use the ansible.cfg generated next to the playbook (forks, pipelining,
+        # fact caching) regardless of the working directory
+        ansible_cfg = os.path.join(os.path.dirname(os.path.abspath(playbook_path)), 'ansible.cfg')
+        if os.path.exists(ansible_cfg):
+            runner_params['envvars'] = {'ANSIBLE_CONFIG': ansible_cfg}
+        
         # Run the playbook
         result = ansible_runner.run(**runner_params)
         
+        # Prefer the recap reported by Ansible over the one counted from events
+        timing = recorder.summary()
+        stats = getattr(result, 'stats', None)
+        recap = recap_from_runner_stats(stats) if stats else timing['recap']
+        timing['recap'] = recap
+        if recap:
+            log(describe_recap(recap))
+        slowest = timing['slowest_tasks'][0] if timing['slowest_tasks'] else None
+        summary = f" in {timing['seconds']:.1f}s" + (f"; slowest task: {slowest['name']} ({slowest['seconds']:.1f}s)"
+                                                       if slowest else '')
+        
         # Process the result
+        stderr = getattr(result, 'stderr', None) or ''
         if result.rc == 0:
             return {
                 'status': 'success',
-                'message': 'Ansible playbook executed successfully',
-                'stats': getattr(result, 'stats', {})
+                'message': 'Ansible playbook executed successfully' + summary,
+                'stats': recap,
+                'timing': timing
             }
         else:
             return {
                 'status': 'error',
-                'message': f'Ansible playbook execution failed with code {result.rc}',
-                'stats': getattr(result, 'stats', {}),
-                'stderr': getattr(result, 'stderr', '')
+                'message': f'Ansible playbook execution failed with code {result.rc}' + summary,
+                'stats': recap,
+                'timing': timing,
+                # ansible-runner exposes stderr as a file, the subprocess runner as text
+                'stderr': stderr if isinstance(stderr, str) else stderr.read()
             }
     
     except Exception as e:
@@ -1224,8 +1476,71 @@ def run_ansible_playbook(playbook_path, inventory_path=None, extra_vars=None):
         }
 
 
+def load_placement(hosts_file):
+    """
+    Load a host inventory for placement.
+    
+    The file holds either a 'placement' section as in the configuration, or its
+    contents ('hosts' and optionally 'colocate' and 'pin') at the top level.
+    """
+    with open(hosts_file, 'r') as f:
+        data = load_yaml(f) or {}
+    return data.get('placement', data)
+
+
+def run_batch_configuration(args):
+    """Generate the stacks for every clinic configuration in args.batch."""
+    from .batch import load_batch_jobs, run_batch
+
+    jobs = load_batch_jobs(args.batch, args.batch_output, args.ansible)
+    if not jobs:
+        print(f"No configuration files found in {args.batch}")
+        return 1
+
+    print(f"Generating {len(jobs)} clinic configurations...")
+    summary = run_batch(jobs, workers=args.workers)
+
+    counts = ', '.join(f"{count} {status}" for status, count in sorted(summary['counts'].items()))
+    print(f"\nBatch completed in {summary['seconds']:.2f}s ({summary['throughput']:.1f} configs/s): {counts}")
+    return 1 if summary['counts'].get('error') else 0
+
+
+def run_fleet_deployment(args):
+    """Deploy to every host of the fleet inventory in args.fleet."""
+    import getpass
+    from .fleet import DEFAULT_WORKERS, deploy_fleet, load_fleet
+
+    try:
+        hosts = load_fleet(args.fleet)
+    except (OSError, ValueError) as e:
+        print(f"Could not load fleet inventory: {e}")
+        return 1
+    if not hosts:
+        print(f"No hosts found in {args.fleet}")
+        return 1
+
+    password = None
+    if any(not (host.get('ssh') or {}).get('key_path') for host in hosts):
+        password = getpass.getpass("SSH password for hosts without a key: ")
+
+    config = load_config(args.config)
+    print(f"Deploying to {len(hosts)} hosts ({args.workers or DEFAULT_WORKERS} at a time)...")
+    summary = deploy_fleet(hosts, config, password=password, workers=args.workers or DEFAULT_WORKERS,
+                           host_timeout=args.host_timeout, enforce_requirements=not args.skip_requirements)
+
+    print(f"\n{summary['message']}")
+    if summary['slowest']:
+        print(f"Slowest host: {summary['slowest']} ({summary['hosts'][summary['slowest']]['seconds']:.1f}s)")
+    return 0 if summary['status'] == 'success' else 1
+
+
 def run_configuration(args):
     """Run the configuration tool with the specified arguments."""
+    if getattr(args, 'batch', None):
+        return run_batch_configuration(args)
+    if getattr(args, 'fleet', None):
+        return run_fleet_deployment(args)
+
     # Load configuration
     config = load_config(args.config)
     
@@ -1247,13 +1562,39 @@ def run_configuration(args):
             config['components']['vaultwarden']['admin_token'] = generate_password(40)
         print("Secure passwords generated!")
     
+    # Scale catalog resource requirements to the target host
+    if getattr(args, 'resource_scale', None):
+        config['system'].setdefault('resources', {})['scale'] = args.resource_scale
+    
     # Run interactive configuration if requested
     if args.interactive:
         config = interactive_configuration(config)
         save_config(config, args.save)
     
+    # Spread the stack over several hosts if an inventory is given
+    if getattr(args, 'hosts', None):
+        config['placement'] = load_placement(args.hosts)
+    if (config.get('placement') or {}).get('hosts'):
+        try:
+            generate_placement(config, args.placement_output)
+        except ComposeValidationError as e:
+            print("Docker Compose files not generated, the configuration has conflicts:")
+            print(e)
+            return 1
+        except ValueError as e:
+            print(f"Could not place services: {e}")
+            return 1
+        print("\nMedocker configuration completed!")
+        print(f"Run 'docker-compose up -d' in each host's directory under {args.placement_output}.")
+        return 0
+    
     # Generate docker-compose file
-    generate_docker_compose(config, args.output)
+    try:
+        generate_docker_compose(config, args.output)
+    except ComposeValidationError as e:
+        print("Docker Compose file not generated, the configuration has conflicts:")
+        print(e)
+        return 1
     
     # Create directories
     create_directories(config)
@@ -1272,6 +1613,17 @@ def main():
     parser.add_argument('--interactive', '-i', action='store_true', help='Run in interactive mode')
     parser.add_argument('--save', '-s', help='Save configuration to file', default='config/custom.yml')
     parser.add_argument('--secure', '-S', action='store_true', help='Generate secure random passwords for all services')
+    parser.add_argument('--resource-scale', type=float, help='Multiply catalog cpu/ram requirements for the target host size')
+    parser.add_argument('--hosts', help='Host inventory to spread the stack over several hosts')
+    parser.add_argument('--placement-output', help='Output directory for per-host compose files', default='hosts')
+    parser.add_argument('--batch', '-b', help='Directory of clinic configuration files, or a batch manifest')
+    parser.add_argument('--batch-output', help='Base output directory for batch mode', default='clinics')
+    parser.add_argument('--ansible', action='store_true', help='Also generate Ansible playbooks in batch mode')
+    parser.add_argument('--workers', '-w', type=int, help='Number of parallel workers for batch and fleet modes')
+    parser.add_argument('--fleet', help='Host inventory to deploy to concurrently over SSH')
+    parser.add_argument('--host-timeout', type=int, help='Seconds after which the deployment to a fleet host is aborted', default=900)
+    parser.add_argument('--skip-requirements', action='store_true',
+                        help='Deploy to fleet hosts with fewer CPU cores, less RAM or disk than the stack reserves')
     
     args = parser.parse_args()
     
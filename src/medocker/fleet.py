@@ -0,0 +1,143 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2024-2025 Iliya Yaroshevskiy
+"""
+Medocker Fleet Deployment
+
+This module deploys stacks to many clinic servers at once. Hosts are deployed
+concurrently by a bounded pool of worker threads, so the total time approaches
+that of the slowest host rather than the sum over all hosts, and each host's
+result is reported as soon as it finishes. A host that does not finish within its
+time limit is aborted: its connection is closed and its docker-compose commands are
+stopped on the host.
+
+A fleet inventory lists the hosts in the same format as a placement inventory,
+optionally with a per-site configuration file:
+
+    hosts:
+      - name: clinic-north
+        address: 10.1.0.5
+        config: clinics/north.yml     # optional, relative to the inventory
+        ssh:
+          username: deploy
+          key_path: ~/.ssh/id_ed25519
+          port: 22
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .configure import deploy_docker_compose_ssh
+from .serialization import load_yaml_file
+
+DEFAULT_WORKERS = 8
+DEFAULT_HOST_TIMEOUT = 900
+
+
+def load_fleet(inventory_file):
+    """
+    Load the hosts of a fleet inventory.
+
+    Per-site configuration paths are made relative to the inventory's directory.
+
+    Returns:
+        list: Host dictionaries with at least 'name' and 'address'
+
+    Raises:
+        ValueError: If the file does not hold a list of hosts, either at the
+                    top level or under 'hosts', or a host has no name
+    """
+    data = load_yaml_file(inventory_file) or {}
+    hosts = data.get('hosts') if isinstance(data, dict) else data
+    if not isinstance(hosts, list):
+        raise ValueError(f"{inventory_file} must hold a list of hosts under 'hosts'")
+    base_dir = os.path.dirname(os.path.abspath(inventory_file))
+    fleet = []
+    for index, host in enumerate(hosts):
+        if not isinstance(host, dict) or not host.get('name'):
+            raise ValueError(f"Host {index + 1} in {inventory_file} must be a mapping with a 'name'")
+        host = dict(host)
+        host.setdefault('address', host['name'])
+        if host.get('config'):
+            host['config'] = os.path.join(base_dir, host['config'])
+        fleet.append(host)
+    return fleet
+
+
+def _deploy_host(host, config, password, timeout, enforce_requirements, report):
+    # A host's clock starts when a worker picks it up, not when it is queued
+    start = time.monotonic()
+    ssh = host.get('ssh') or {}
+    result = deploy_docker_compose_ssh(
+        config,
+        host['address'],
+        ssh.get('username', 'root'),
+        password,
+        ssh.get('key_path'),
+        ssh.get('port', 22),
+        # Output of concurrent hosts is interleaved, so prefix it with the host
+        log=lambda line: report(f"{host['name']}: {line}"),
+        enforce_requirements=enforce_requirements,
+        deadline=start + timeout if timeout else None
+    )
+    result['seconds'] = time.monotonic() - start
+    return result
+
+
+def deploy_fleet(hosts, config, password=None, workers=DEFAULT_WORKERS, host_timeout=DEFAULT_HOST_TIMEOUT,
+                 enforce_requirements=True, report=print):
+    """
+    Deploy to many hosts concurrently.
+
+    Args:
+        hosts: Host dictionaries as returned by load_fleet
+        config: Configuration used for hosts without their own 'config'
+        password: SSH password for hosts without a key_path (optional)
+        workers: Maximum number of hosts deployed at the same time
+        host_timeout: Seconds after which the deployment to a host is aborted
+                      and reported with status 'timeout' (0 for no limit)
+        enforce_requirements: Refuse hosts with fewer resources than the stack
+                              reserves (see deploy_docker_compose_ssh)
+        report: Callable receiving the deployment output of every host and a
+                progress line as each host finishes
+
+    Returns:
+        dict: Overall 'status' and 'message', the result of each host under
+              'hosts', the wall time in 'seconds' and the 'slowest' host
+    """
+    start = time.monotonic()
+    results = {}
+    # Every deployment ends by its host's deadline, so waiting for them is bounded
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fleet-deploy') as executor:
+        futures = {}
+        for host in hosts:
+            try:
+                host_config = load_yaml_file(host['config']) if host.get('config') else config
+            except Exception as e:
+                results[host['name']] = {'status': 'error', 'message': f"Could not load configuration: {e}", 'seconds': 0.0}
+                report(f"[error] {host['name']}: {results[host['name']]['message']}")
+                continue
+            future = executor.submit(_deploy_host, host, host_config, password, host_timeout,
+                                     enforce_requirements, report)
+            futures[future] = host['name']
+
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = {'status': 'error', 'message': str(e), 'seconds': time.monotonic() - start}
+            report(f"[{results[name]['status']}] {name} ({results[name]['seconds']:.1f}s): {results[name]['message']}")
+
+    elapsed = time.monotonic() - start
+    ordered = {host['name']: results[host['name']] for host in hosts if host['name'] in results}
+    failed = [name for name, result in ordered.items() if result['status'] != 'success']
+    slowest = max(ordered, key=lambda name: ordered[name]['seconds'], default=None)
+    return {
+        'status': 'error' if failed else 'success',
+        'message': (f"{len(ordered) - len(failed)} of {len(ordered)} hosts deployed in {elapsed:.1f}s"
+                    + (f"; failed: {', '.join(failed)}" if failed else '')),
+        'hosts': ordered,
+        'seconds': elapsed,
+        'slowest': slowest
+    }
@@ -0,0 +1,121 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2024-2025 Iliya Yaroshevskiy
+"""
+Medocker Image Pre-pull
+
+This module downloads the images of a stack onto a remote host before the stack is
+started, so that `docker compose up` only has to recreate containers. Without it,
+images are pulled one after the other by `up` itself, which stretches the time the
+services are unavailable.
+
+Images are pulled in parallel, each over its own channel of the existing SSH
+connection, and their progress is reported per image. Images already on the host
+are not pulled again: an image pinned by digest (name@sha256:...) never changes,
+and a tagged image is only refreshed on request.
+"""
+
+import shlex
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_PULL_WORKERS = 4
+
+
+def compose_images(compose):
+    """Return the distinct images used by the services of a compose document."""
+    return sorted({service['image'] for service in compose.get('services', {}).values() if service.get('image')})
+
+
+def is_digest_reference(image):
+    """Return whether an image reference is pinned to a content digest."""
+    return '@sha256:' in image
+
+
+def present_images(ssh_client, images):
+    """
+    Return which images already exist on the remote host, in one command.
+
+    Args:
+        ssh_client: Connected paramiko.SSHClient
+        images: Image references to look for
+
+    Returns:
+        set: The references that resolve to a local image
+    """
+    if not images:
+        return set()
+    command = (f"for image in {' '.join(shlex.quote(image) for image in images)}; do "
+               "docker image inspect \"$image\" >/dev/null 2>&1 && echo \"$image\"; done; true")
+    stdin, stdout, stderr = ssh_client.exec_command(command)
+    output = stdout.read().decode()
+    stdout.channel.recv_exit_status()
+    return set(output.split())
+
+
+def _pull(ssh_client, image, log):
+    start = time.monotonic()
+    channel = ssh_client.get_transport().open_session()
+    channel.set_combine_stderr(True)
+    channel.exec_command(f"docker pull {shlex.quote(image)}")
+    digest, last = None, ''
+    with channel.makefile('r') as output:
+        for line in output:
+            line = line.rstrip('\r\n')
+            if line.startswith('Digest: '):
+                digest = line[len('Digest: '):]
+            last = line or last
+            log(f"{image}: {line}")
+    status = channel.recv_exit_status()
+    return {
+        'status': 'pulled' if status == 0 else 'error',
+        'seconds': time.monotonic() - start,
+        'digest': digest,
+        'message': last
+    }
+
+
+def prepull_images(ssh_client, images, workers=DEFAULT_PULL_WORKERS, refresh=False, log=print):
+    """
+    Make sure all images are present on the remote host, pulling missing ones in parallel.
+
+    Args:
+        ssh_client: Connected paramiko.SSHClient
+        images: Image references to pull
+        workers: Maximum number of simultaneous pulls
+        refresh: Also pull tagged images that are already present, to pick up
+                 new versions of their tag
+        log: Callable receiving the progress of each pull, prefixed by the image
+
+    Returns:
+        dict: 'status' ('success' if every image is now local), a per-image
+              result under 'images' ('present', 'pulled' or 'error', with the
+              seconds taken), and the wall time of the pull phase in 'seconds'
+    """
+    start = time.monotonic()
+    present = present_images(ssh_client, images)
+    results = {}
+    to_pull = []
+    for image in images:
+        if image in present and (is_digest_reference(image) or not refresh):
+            results[image] = {'status': 'present', 'seconds': 0.0}
+        else:
+            to_pull.append(image)
+
+    if to_pull:
+        log(f"Pulling {len(to_pull)} images ({len(present)} already present)...")
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(to_pull))), thread_name_prefix='image-pull') as executor:
+            futures = {image: executor.submit(_pull, ssh_client, image, log) for image in to_pull}
+            for image, future in futures.items():
+                try:
+                    results[image] = future.result()
+                except Exception as e:
+                    results[image] = {'status': 'error', 'seconds': 0.0, 'message': str(e)}
+                log(f"{image}: {results[image]['status']} in {results[image]['seconds']:.1f}s")
+
+    failed = [image for image in images if results[image]['status'] == 'error']
+    return {
+        'status': 'error' if failed else 'success',
+        'message': f"Failed to pull {', '.join(failed)}" if failed else f"{len(to_pull)} of {len(images)} images pulled",
+        'images': {image: results[image] for image in images},
+        'seconds': time.monotonic() - start
+    }
@@ -0,0 +1,173 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2024-2025 Iliya Yaroshevskiy
+"""
+Medocker Background Jobs
+
+This module runs long operations such as remote deployments in the background, so
+they do not hold a web server thread (and the browser request) for minutes. Each
+job gets an id that can be polled for its status, and its log can be followed line
+by line while it runs.
+
+A queue runs a bounded number of jobs at a time; further jobs wait their turn, and
+submissions are refused once too many are waiting, so deployments cannot take over
+the threads serving the UI.
+"""
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobQueueFull(RuntimeError):
+    """Raised when a job is submitted while too many jobs are already waiting."""
+
+
+class Job:
+    """A unit of background work with a status, a growing log and a result."""
+
+    def __init__(self, kind, description):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.description = description
+        self.status = 'queued'
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.lines = []
+        self._changed = threading.Condition()
+
+    @property
+    def done(self):
+        return self.status in ('success', 'error')
+
+    def log(self, message):
+        """Append a message to the job's log, one entry per line."""
+        with self._changed:
+            self.lines.extend(str(message).splitlines() or [''])
+            self._changed.notify_all()
+
+    def _set_status(self, status, result=None):
+        with self._changed:
+            self.status = status
+            if status == 'running':
+                self.started = time.time()
+            elif status in ('success', 'error'):
+                self.finished = time.time()
+                self.result = result
+            self._changed.notify_all()
+
+    def follow(self, start=0, heartbeat=15):
+        """
+        Yield the job's log lines as they are written, until the job is done.
+
+        Args:
+            start: Index of the first line to yield, to resume an interrupted stream
+            heartbeat: Seconds after which None is yielded if no line arrived, so
+                       callers can keep idle connections open
+
+        Yields:
+            tuple: (index, line) pairs, or None as a heartbeat
+        """
+        index = start
+        while True:
+            with self._changed:
+                if index >= len(self.lines) and not self.done:
+                    self._changed.wait(heartbeat)
+                lines = self.lines[index:]
+                done = self.done
+            if lines:
+                for line in lines:
+                    yield index, line
+                    index += 1
+            elif done:
+                return
+            else:
+                yield None
+
+    def to_dict(self, include_log=False):
+        """Return the job's state as a JSON-serializable dictionary."""
+        end = self.finished or time.time()
+        data = {
+            'id': self.id,
+            'kind': self.kind,
+            'description': self.description,
+            'status': self.status,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'seconds': round(end - self.started, 2) if self.started else None,
+            'lines': len(self.lines),
+            'result': self.result
+        }
+        if include_log:
+            data['log'] = list(self.lines)
+        return data
+
+
+class JobQueue:
+    """Runs jobs on a bounded pool of worker threads and keeps recent jobs for lookup."""
+
+    def __init__(self, workers=2, max_queued=20, history=50):
+        """
+        Args:
+            workers: Number of jobs run at the same time
+            max_queued: Number of jobs allowed to wait for a worker
+            history: Number of finished jobs kept for status lookups
+        """
+        self.workers = workers
+        self.max_queued = max_queued
+        self.history = history
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='medocker-job')
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def submit(self, kind, description, func, *args, **kwargs):
+        """
+        Queue func(*args, log=job.log, **kwargs) to run in the background.
+
+        The function reports progress through the log callback and returns a
+        result dictionary; a 'status' of 'error' in the result marks the job as
+        failed, as does an exception.
+
+        Returns:
+            Job: The queued job
+
+        Raises:
+            JobQueueFull: If max_queued jobs are already waiting
+        """
+        job = Job(kind, description)
+        with self._lock:
+            if sum(1 for queued in self._jobs.values() if queued.status == 'queued') >= self.max_queued:
+                raise JobQueueFull("Too many jobs are waiting; try again once some have finished")
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def _run(self, job, func, args, kwargs):
+        job._set_status('running')
+        try:
+            result = func(*args, log=job.log, **kwargs)
+        except Exception as e:
+            job.log(f"Error: {e}")
+            job._set_status('error', {'status': 'error', 'message': str(e)})
+            return
+        failed = isinstance(result, dict) and result.get('status') == 'error'
+        job._set_status('error' if failed else 'success', result)
+
+    def _prune(self):
+        finished = [job for job in self._jobs.values() if job.done]
+        for job in sorted(finished, key=lambda job: job.finished)[:max(len(finished) - self.history, 0)]:
+            del self._jobs[job.id]
+
+    def get(self, job_id):
+        """Return the job with the given id, or None if it is unknown or was pruned."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        """Return all known jobs, newest first."""
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.created, reverse=True)
@@ -0,0 +1,246 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2024-2025 Iliya Yaroshevskiy
+"""
+Medocker Placement
+
+This module spreads a stack that is too large for one machine over several hosts.
+Given a host inventory (cpu cores, ram and disk in GB per host) and the catalog
+requirements of the enabled services, it bin-packs the services onto the hosts and
+builds one compose document per host.
+
+Services that depend on each other (a database and its applications) are always
+placed together, as are services listed together under `placement.colocate`.
+Groups can be pinned to a host with `placement.pin`. Traefik is run on every host
+that has routed services, since it only discovers containers on its own host.
+
+Services on other hosts are reachable through `extra_hosts` entries that resolve
+their names to the IP address of the host they run on; this only works for services
+that publish their ports on that host. Host addresses given as names are resolved
+when the compose documents are built.
+"""
+
+import ipaddress
+import socket
+
+from .resources import resource_settings
+
+PLACEMENT_RESOURCES = ('cpu', 'ram', 'disk')
+
+# Services replicated on every host that needs them rather than placed once
+PER_HOST_SERVICES = ('traefik',)
+
+
+class PlacementError(ValueError):
+    """Raised when the selected services cannot be placed on the available hosts."""
+
+
+def _demand(service, settings):
+    """Return the (cpu, ram, disk) a service reserves, from its catalog requirements."""
+    requirements = service.requirements or {}
+    return {
+        'cpu': requirements.get('cpu', 0) * settings['scale'],
+        'ram': requirements.get('ram', 0) * settings['scale'],
+        'disk': requirements.get('storage', 0)
+    }
+
+
+def _colocation_groups(services, colocate):
+    """Merge services connected by depends_on or an explicit colocate list into groups."""
+    parent = {service.name: service.name for service in services}
+
+    def find(name):
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    def union(a, b):
+        if a in parent and b in parent:
+            parent[find(a)] = find(b)
+
+    for service in services:
+        for dependency in service.depends_on:
+            union(service.name, dependency)
+    for names in colocate:
+        for name in names[1:]:
+            union(names[0], name)
+
+    groups = {}
+    for service in services:
+        groups.setdefault(find(service.name), []).append(service.name)
+    return list(groups.values())
+
+
+def plan_placement(config, registry, placement=None):
+    """
+    Assign the enabled services of a configuration to hosts.
+
+    Groups are placed largest first, each on the host it fits most tightly
+    (best-fit decreasing), which keeps hosts free for the remaining large groups.
+
+    Args:
+        config: The configuration dictionary
+        registry: ServiceRegistry describing the services
+        placement: Placement settings with 'hosts', and optionally 'colocate' and
+                   'pin' (default: config['placement'])
+
+    Returns:
+        dict: 'hosts' mapping host name to its inventory entry, 'services' (names
+              per host), 'used' and 'free' resources per host, and 'assignments'
+              mapping every service to its host
+
+    Raises:
+        PlacementError: If the inventory is empty or a group does not fit anywhere
+    """
+    placement = placement if placement is not None else config.get('placement') or {}
+    hosts = {host['name']: host for host in placement.get('hosts') or []}
+    if not hosts:
+        raise PlacementError("The placement inventory lists no hosts")
+
+    settings = resource_settings(config)
+    enabled = registry.enabled_services(config)
+    per_host = [service for service in enabled if service.name in PER_HOST_SERVICES]
+    placed = [service for service in enabled if service.name not in PER_HOST_SERVICES]
+    demands = {service.name: _demand(service, settings) for service in enabled}
+
+    # Replicated services are reserved on every host up front
+    free = {}
+    for name, host in hosts.items():
+        free[name] = {key: float(host.get(key, 0)) for key in PLACEMENT_RESOURCES}
+        for service in per_host:
+            for key in PLACEMENT_RESOURCES:
+                free[name][key] -= demands[service.name][key]
+    capacity = {key: sum(float(host.get(key, 0)) for host in hosts.values()) or 1.0
+                for key in PLACEMENT_RESOURCES}
+
+    groups = []
+    pins = placement.get('pin') or {}
+    for names in _colocation_groups(placed, placement.get('colocate') or []):
+        demand = {key: sum(demands[name][key] for name in names) for key in PLACEMENT_RESOURCES}
+        pinned = {pins[name] for name in names if name in pins}
+        if len(pinned) > 1:
+            raise PlacementError(f"Services {', '.join(names)} must share a host but are pinned to {', '.join(sorted(pinned))}")
+        if pinned and not pinned <= hosts.keys():
+            raise PlacementError(f"Services {', '.join(names)} are pinned to unknown host {pinned.pop()}")
+        # Size of a group relative to the whole inventory, by its scarcest resource
+        size = max(demand[key] / capacity[key] for key in PLACEMENT_RESOURCES)
+        groups.append((0 if pinned else 1, -size, names, demand, pinned))
+    groups.sort(key=lambda group: group[:2])
+
+    assignments = {}
+    for _, _, names, demand, pinned in groups:
+        best, best_slack = None, None
+        for name in (pinned or hosts):
+            remaining = [free[name][key] - demand[key] for key in PLACEMENT_RESOURCES]
+            if min(remaining) < 0:
+                continue
+            slack = sum(remaining[i] / capacity[key] for i, key in enumerate(PLACEMENT_RESOURCES))
+            if best is None or slack < best_slack:
+                best, best_slack = name, slack
+        if best is None:
+            needs = ', '.join(f"{demand[key]:g} {key}" for key in PLACEMENT_RESOURCES)
+            raise PlacementError(f"No host has room for {', '.join(names)} (needs {needs})")
+        for key in PLACEMENT_RESOURCES:
+            free[best][key] -= demand[key]
+        for name in names:
+            assignments[name] = best
+
+    services = {name: [] for name in hosts}
+    for service in placed:
+        services[assignments[service.name]].append(service.name)
+
+    # Run replicated services where they are needed (Traefik next to routed services),
+    # or on the first host if no host needs them
+    for name in hosts:
+        if any(registry.by_name[service].route_labels is not None for service in services[name]):
+            for service in per_host:
+                services[name].insert(0, service.name)
+                assignments.setdefault(service.name, name)
+    first = next(iter(hosts))
+    for service in per_host:
+        if service.name not in assignments:
+            services[first].insert(0, service.name)
+            assignments[service.name] = first
+
+    used = {
+        name: {key: round(sum(demands[service][key] for service in services[name]), 2) for key in PLACEMENT_RESOURCES}
+        for name in hosts
+    }
+    return {
+        'hosts': hosts,
+        'services': services,
+        'used': used,
+        'free': {
+            name: {key: round(float(hosts[name].get(key, 0)) - used[name][key], 2) for key in PLACEMENT_RESOURCES}
+            for name in hosts
+        },
+        'assignments': assignments
+    }
+
+
+def host_ip(address):
+    """
+    Return the IP address of a host, resolving its name if needed.
+
+    extra_hosts entries only accept IP addresses.
+
+    Raises:
+        PlacementError: If the name cannot be resolved
+    """
+    try:
+        return str(ipaddress.ip_address(address))
+    except ValueError:
+        pass
+    try:
+        return socket.getaddrinfo(address, None)[0][4][0]
+    except (socket.gaierror, UnicodeError) as e:
+        raise PlacementError(f"Cannot resolve host address {address}: {e}") from e
+
+
+def build_host_composes(config, registry, plan):
+    """
+    Build the compose document of every host in a placement plan.
+
+    Args:
+        config: The configuration dictionary
+        registry: ServiceRegistry describing the services
+        plan: Result of plan_placement
+
+    Returns:
+        dict: Compose document per host name; hosts without services are omitted
+
+    Raises:
+        PlacementError: If the address of a host running services cannot be resolved
+    """
+    addresses = {
+        name: host_ip(host.get('address', name))
+        for name, host in plan['hosts'].items() if plan['services'].get(name)
+    }
+    composes = {}
+    for name, service_names in plan['services'].items():
+        if not service_names:
+            continue
+        compose = registry.build_compose(config, service_names)
+
+        # Resolve services running elsewhere to the address of their host
+        remote = sorted(
+            f"{service}:{addresses[host]}"
+            for service, host in plan['assignments'].items()
+            if host != name and service not in service_names and service not in PER_HOST_SERVICES
+        )
+        if remote:
+            for fragment in compose['services'].values():
+                fragment['extra_hosts'] = list(remote)
+        composes[name] = compose
+    return composes
+
+
+def describe_placement(plan):
+    """Format a placement plan as a table of hosts, their services and resource use."""
+    lines = []
+    for name, host in plan['hosts'].items():
+        used = plan['used'][name]
+        usage = ', '.join(f"{key} {used[key]:g}/{float(host.get(key, 0)):g}" for key in PLACEMENT_RESOURCES)
+        services = ', '.join(plan['services'][name]) or '(no services)'
+        lines.append(f"{name} ({host.get('address', name)}): {services} [{usage}]")
+    return '\n'.join(lines)
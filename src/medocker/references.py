@@ -0,0 +1,220 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2024-2025 Iliya Yaroshevskiy
+"""
+Medocker Variable References
+
+This module compiles ${section.key} references found in a configuration into a
+dependency graph. References may make up a whole value (the referenced value is
+copied as-is) or be embedded in a string such as "vaultwarden.${system.domain}".
+
+Once compiled, the graph can re-evaluate only the values that depend on keys that
+actually changed, instead of walking the whole configuration tree.
+"""
+
+import re
+
+_REFERENCE = re.compile(r'\$\{([^}]+)\}')
+_MISSING = object()
+
+
+class ReferenceCycleError(ValueError):
+    """Raised when configuration references depend on each other in a loop."""
+
+
+def _lookup(config, path):
+    """Return the value at path (a tuple of keys) or _MISSING."""
+    value = config
+    for key in path:
+        if isinstance(value, dict) and key in value:
+            value = value[key]
+        elif isinstance(value, (list, tuple)) and isinstance(key, int) and key < len(value):
+            value = value[key]
+        else:
+            return _MISSING
+    return value
+
+
+def get_value(config, path, default=None):
+    """Return the value at a dotted path (or tuple of keys) in config, or default."""
+    if isinstance(path, str):
+        path = _parse_path(path)
+    value = _lookup(config, path)
+    return default if value is _MISSING else value
+
+
+def _assign(config, path, value):
+    target = config
+    for key in path[:-1]:
+        target = target[key]
+    target[path[-1]] = value
+
+
+def _parse_path(text):
+    return tuple(int(key) if key.isdigit() else key for key in text.strip().split('.'))
+
+
+def _format_path(path):
+    return '.'.join(str(key) for key in path)
+
+
+class Template:
+    """A configuration value containing one or more ${...} references."""
+
+    def __init__(self, path, text):
+        self.path = path
+        self.text = text
+        self.parts = []
+        position = 0
+        for match in _REFERENCE.finditer(text):
+            if match.start() > position:
+                self.parts.append(text[position:match.start()])
+            self.parts.append((_parse_path(match.group(1)), match.group(0)))
+            position = match.end()
+        if position < len(text):
+            self.parts.append(text[position:])
+        self.refs = tuple(part[0] for part in self.parts if isinstance(part, tuple))
+        # A value that is exactly one reference keeps the referenced value's type
+        self.exact = len(self.parts) == 1 and isinstance(self.parts[0], tuple)
+
+    def render(self, lookup):
+        """Evaluate the template; unknown references are left untouched."""
+        if self.exact:
+            value = lookup(self.refs[0])
+            return self.text if value is _MISSING else value
+
+        chunks = []
+        for part in self.parts:
+            if isinstance(part, tuple):
+                value = lookup(part[0])
+                chunks.append(part[1] if value is _MISSING else str(value))
+            else:
+                chunks.append(part)
+        return ''.join(chunks)
+
+    def evaluate(self, config):
+        """Evaluate the template against a configuration dictionary."""
+        return self.render(lambda path: _lookup(config, path))
+
+
+class ReferenceGraph:
+    """Dependency graph of the ${...} references in a configuration."""
+
+    def __init__(self, templates):
+        self.templates = {template.path: template for template in templates}
+
+        # Index each reference under every prefix of its path, so that a changed
+        # key finds both references to itself and references to keys below it
+        self._by_prefix = {}
+        self._by_ref = {}
+        for template in self.templates.values():
+            for ref in template.refs:
+                self._by_ref.setdefault(ref, set()).add(template.path)
+                for i in range(1, len(ref) + 1):
+                    self._by_prefix.setdefault(ref[:i], set()).add(template.path)
+
+        self.sources = frozenset(self._by_ref)
+        self.order = self._topological_order()
+
+    @classmethod
+    def compile(cls, config):
+        """Collect every string containing a reference into a new graph."""
+        templates = []
+
+        def walk(value, path):
+            if isinstance(value, dict):
+                for key, item in value.items():
+                    walk(item, path + (key,))
+            elif isinstance(value, (list, tuple)):
+                for index, item in enumerate(value):
+                    walk(item, path + (index,))
+            elif isinstance(value, str) and '${' in value and _REFERENCE.search(value):
+                templates.append(Template(path, value))
+
+        walk(config, ())
+        return cls(templates)
+
+    def dependents(self, path):
+        """Return the template paths whose references overlap path."""
+        found = set(self._by_prefix.get(path, ()))
+        for i in range(1, len(path)):
+            found.update(self._by_ref.get(path[:i], ()))
+        return found
+
+    def _topological_order(self):
+        """Order templates so that referenced templates are evaluated first."""
+        order = []
+        state = {}
+
+        def visit(path, stack):
+            if state.get(path) == 'done':
+                return
+            if state.get(path) == 'active':
+                cycle = stack[stack.index(path):] + [path]
+                raise ReferenceCycleError(
+                    "Circular configuration reference: " + ' -> '.join(_format_path(p) for p in cycle))
+            state[path] = 'active'
+            stack.append(path)
+            for ref in self.templates[path].refs:
+                for dependency in self._templates_under(ref):
+                    visit(dependency, stack)
+            stack.pop()
+            state[path] = 'done'
+            order.append(path)
+
+        for path in self.templates:
+            visit(path, [])
+        return order
+
+    def _templates_under(self, ref):
+        """Return templates located at, above or below the referenced path."""
+        found = [path for path in self.templates if path[:len(ref)] == ref]
+        found.extend(ref[:i] for i in range(1, len(ref)) if ref[:i] in self.templates)
+        return found
+
+    def capture(self, config):
+        """Record the current values of all referenced keys, for a later resolve()."""
+        return {ref: _lookup(config, ref) for ref in self.sources}
+
+    def affected(self, changed):
+        """Return the templates that transitively depend on any of the changed paths."""
+        affected = set()
+        pending = list(changed)
+        while pending:
+            for path in self.dependents(pending.pop()):
+                if path not in affected:
+                    affected.add(path)
+                    pending.append(path)
+        return affected
+
+    def resolve(self, config, previous=None):
+        """
+        Evaluate references in config in place.
+
+        Args:
+            config: The configuration dictionary to update
+            previous: Values returned by capture() before the configuration was
+                      edited (optional). When given, only templates depending on
+                      keys whose value changed are re-evaluated, plus any that are
+                      still unresolved. Values the user overrode are left alone.
+
+        Returns:
+            dict: The updated configuration
+        """
+        lookup = lambda path: _lookup(config, path)
+
+        if previous is None:
+            dirty = self.templates.keys()
+        else:
+            changed = [ref for ref, value in previous.items() if _lookup(config, ref) != value]
+            old_lookup = lambda path: previous[path] if path in previous else _lookup(config, path)
+            dirty = {
+                path for path in self.affected(changed)
+                if _lookup(config, path) in (self.templates[path].text, self.templates[path].render(old_lookup))
+            }
+            dirty.update(path for path, template in self.templates.items()
+                         if _lookup(config, path) == template.text)
+
+        for path in self.order:
+            if path in dirty and _lookup(config, path[:-1]) is not _MISSING:
+                _assign(config, path, self.templates[path].render(lookup))
+        return config
@@ -0,0 +1,179 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2024-2025 Iliya Yaroshevskiy
+"""
+Medocker Remote Sync
+
+This module copies deployment artifacts (the compose file, and any environment or
+configuration files deployed next to it) to a remote host, uploading only the files
+whose content differs from what is already there.
+
+The remote side is inspected with a single command that creates the target
+directories and hashes the files currently in place, so a redeploy without changes
+costs one round trip and no uploads. Changed files are written to a temporary name
+and renamed over the old file, so a running stack never sees a partial file.
+
+The files in place are not necessarily the ones running: a deployment can fail
+after uploading them. A copy of each file is therefore recorded under DEPLOYED_DIR
+only once the stack was started from it, and the record, not the uploaded files,
+tells whether a host is up to date.
+"""
+
+import posixpath
+import shlex
+import time
+
+from .render_cache import content_etag
+
+TEMP_SUFFIX = '.medocker-upload'
+
+# Copies of the files the running stack was started from, relative to the remote directory
+DEPLOYED_DIR = '.medocker-deployed'
+
+
+def deployed_path(path):
+    """Return the path of the deployed record of an artifact, relative to the remote directory."""
+    return posixpath.join(DEPLOYED_DIR, path)
+
+
+def deployed_manifest(manifest, paths):
+    """
+    Extract the digests of the deployed records from a remote manifest.
+
+    Args:
+        manifest: Remote digests of both the artifacts and their deployed
+                  records (see deployed_path)
+        paths: Artifact paths relative to the remote directory
+
+    Returns:
+        dict: SHA-256 hex digest per artifact path with a deployed record
+    """
+    return {path: manifest[deployed_path(path)] for path in paths if deployed_path(path) in manifest}
+
+
+def record_deployed(ssh_client, remote_dir, artifacts, open_sftp=None, log=print, remote=None):
+    """
+    Record artifacts as deployed, once the stack was started from them.
+
+    Args:
+        ssh_client: Connected paramiko.SSHClient
+        remote_dir: Directory the artifacts are deployed to
+        artifacts: Mapping of path (relative to remote_dir) to content as str or bytes
+        open_sftp: Callable returning an SFTP session (default: ssh_client.open_sftp)
+        log: Callable receiving progress messages
+        remote: Digests of the current records if already known (see
+                deployed_manifest); the record directories must then exist
+
+    Returns:
+        dict: Result of sync_artifacts for the records
+    """
+    result = sync_artifacts(ssh_client, posixpath.join(remote_dir, DEPLOYED_DIR), artifacts, open_sftp=open_sftp,
+                            log=lambda message: None, remote=remote)
+    if result['uploaded']:
+        log(f"Recorded {', '.join(result['uploaded'])} as deployed")
+    return result
+
+
+def local_manifest(artifacts):
+    """
+    Hash the content of local artifacts.
+
+    Args:
+        artifacts: Mapping of path (relative to the remote directory) to content
+                   as str or bytes
+
+    Returns:
+        dict: SHA-256 hex digest per path
+    """
+    return {path: content_etag(content) for path, content in artifacts.items()}
+
+
+def remote_manifest_command(remote_dir, paths):
+    """Build the shell command creating the target directories and hashing the existing files."""
+    directories = {remote_dir}
+    directories.update(posixpath.join(remote_dir, posixpath.dirname(path)) for path in paths if posixpath.dirname(path))
+    files = ' '.join(shlex.quote(path) for path in sorted(paths))
+    # Missing files are simply absent from the output, so never fail on them
+    return (f"mkdir -p {' '.join(shlex.quote(d) for d in sorted(directories))} && "
+            f"cd {shlex.quote(remote_dir)} && {{ sha256sum -- {files} 2>/dev/null; true; }}")
+
+
+def parse_manifest(output):
+    """Parse sha256sum output into a digest per path."""
+    manifest = {}
+    for line in output.splitlines():
+        digest, _, path = line.partition('  ')
+        if path and len(digest) == 64:
+            manifest[path] = digest
+    return manifest
+
+
+def fetch_remote_manifest(ssh_client, remote_dir, paths):
+    """
+    Hash the artifacts currently on the remote host, in one command.
+
+    Args:
+        ssh_client: Connected paramiko.SSHClient
+        remote_dir: Directory the artifacts are deployed to
+        paths: Artifact paths relative to remote_dir
+
+    Returns:
+        dict: SHA-256 hex digest per path that exists remotely
+
+    Raises:
+        Exception: If the remote directory could not be created
+    """
+    stdin, stdout, stderr = ssh_client.exec_command(remote_manifest_command(remote_dir, paths))
+    output = stdout.read().decode()
+    if stdout.channel.recv_exit_status() != 0:
+        raise Exception(f"Failed to create directory: {stderr.read().decode()}")
+    return parse_manifest(output)
+
+
+def sync_artifacts(ssh_client, remote_dir, artifacts, open_sftp=None, log=print, remote=None):
+    """
+    Upload the artifacts whose content differs from the copies on the remote host.
+
+    Args:
+        ssh_client: Connected paramiko.SSHClient
+        remote_dir: Directory the artifacts are deployed to
+        artifacts: Mapping of path (relative to remote_dir) to content as str or bytes
+        open_sftp: Callable returning an SFTP session, only called if something
+                   needs uploading (default: ssh_client.open_sftp)
+        log: Callable receiving progress messages
+        remote: Digests of the remote copies if already known, for example from
+                the bootstrap report; the target directories must then exist
+
+    Returns:
+        dict: 'uploaded' and 'unchanged' paths, a 'changed' flag, the number of
+              'bytes' uploaded and the 'seconds' taken
+    """
+    start = time.monotonic()
+    artifacts = {path: content.encode('utf-8') if isinstance(content, str) else content
+                 for path, content in artifacts.items()}
+    local = local_manifest(artifacts)
+    if remote is None:
+        remote = fetch_remote_manifest(ssh_client, remote_dir, list(artifacts))
+
+    changed = [path for path in artifacts if remote.get(path) != local[path]]
+    unchanged = [path for path in artifacts if path not in changed]
+    uploaded_bytes = 0
+    if changed:
+        sftp = (open_sftp or ssh_client.open_sftp)()
+        for path in changed:
+            remote_path = posixpath.join(remote_dir, path)
+            with sftp.open(remote_path + TEMP_SUFFIX, 'wb') as remote_file:
+                remote_file.set_pipelined(True)
+                remote_file.write(artifacts[path])
+            sftp.posix_rename(remote_path + TEMP_SUFFIX, remote_path)
+            uploaded_bytes += len(artifacts[path])
+            log(f"Uploaded {path} to {remote_path}")
+    if unchanged:
+        log(f"Unchanged on {remote_dir}: {', '.join(unchanged)}")
+
+    return {
+        'uploaded': changed,
+        'unchanged': unchanged,
+        'changed': bool(changed),
+        'bytes': uploaded_bytes,
+        'seconds': time.monotonic() - start
+    }
@@ -0,0 +1,83 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2024-2025 Iliya Yaroshevskiy
+"""
+Medocker Render Cache
+
+This module memoizes generated documents (such as the docker compose file) by a
+stable hash of their inputs. Each cached document carries a strong ETag derived
+from its content, so HTTP clients can revalidate with If-None-Match.
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict, namedtuple
+
+Rendered = namedtuple('Rendered', ['content', 'etag'])
+
+
+def stable_digest(value):
+    """Return a SHA-256 hex digest of a JSON-compatible value, independent of key order."""
+    encoded = json.dumps(value, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def content_etag(content):
+    """Return a strong ETag value for a str or bytes document."""
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.sha256(content).hexdigest()
+
+
+class RenderCache:
+    """Bounded LRU cache of rendered documents keyed by input digest."""
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key, render):
+        """
+        Return the cached document for key, rendering it on a miss.
+
+        Args:
+            key: Digest of everything the document depends on
+            render: Callable returning the document content (str or bytes)
+
+        Returns:
+            Rendered: (content, etag)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        content = render()
+        entry = Rendered(content, content_etag(content))
+
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return cache counters for diagnostics."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'maxsize': self.maxsize
+            }
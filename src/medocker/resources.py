@@ -0,0 +1,120 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2024-2025 Iliya Yaroshevskiy
+"""
+Medocker Resource Limits
+
+This module turns the requirements declared in the service catalog (cpu cores, ram
+and storage in GB) into container resource settings, so that one runaway container
+cannot starve the rest of the stack.
+
+Requirements are multiplied by the `system.resources.scale` factor to fit the host
+size. The scaled requirement is reserved for the container, and the container is
+limited to that amount times `system.resources.headroom`.
+"""
+
+RESOURCES_PATH = ('system', 'resources')
+
+DEFAULT_SETTINGS = {
+    'enabled': True,
+    'scale': 1.0,
+    'headroom': 1.5
+}
+
+
+def resource_settings(config):
+    """
+    Return the effective resource settings of a configuration.
+
+    Configurations without a system.resources section get the defaults.
+
+    Raises:
+        ValueError: If scale or headroom is not a positive number
+    """
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update((config.get('system') or {}).get('resources') or {})
+    for key in ('scale', 'headroom'):
+        settings[key] = float(settings[key])
+        if settings[key] <= 0:
+            raise ValueError(f"system.resources.{key} must be a positive number")
+    return settings
+
+
+def _cpus(value):
+    return round(value, 2)
+
+
+def _megabytes(gigabytes):
+    return max(int(round(gigabytes * 1024)), 6)  # Docker refuses less than 6 MB
+
+
+def compose_resources(requirements, settings):
+    """
+    Build the compose resource keys for a service.
+
+    Args:
+        requirements: Catalog requirements with 'cpu' (cores) and 'ram' (GB)
+        settings: Effective settings from resource_settings()
+
+    Returns:
+        dict: 'deploy', 'mem_limit' and 'cpus' entries, or an empty dictionary if
+              resource limits are disabled
+    """
+    if not settings['enabled']:
+        return {}
+
+    reserved_cpus = _cpus(requirements.get('cpu', 0) * settings['scale'])
+    reserved_memory = _megabytes(requirements.get('ram', 0) * settings['scale'])
+    limit_cpus = _cpus(reserved_cpus * settings['headroom'])
+    limit_memory = _megabytes(reserved_memory * settings['headroom'] / 1024)
+
+    limits, reservations = {}, {}
+    if reserved_cpus > 0:
+        limits['cpus'] = str(limit_cpus)
+        reservations['cpus'] = str(reserved_cpus)
+    if requirements.get('ram'):
+        limits['memory'] = f"{limit_memory}M"
+        reservations['memory'] = f"{reserved_memory}M"
+    if not limits:
+        return {}
+
+    resources = {'deploy': {'resources': {'limits': limits, 'reservations': reservations}}}
+    # Honoured by docker-compose outside of swarm mode
+    if 'memory' in limits:
+        resources['mem_limit'] = limits['memory'].lower()
+    if 'cpus' in limits:
+        resources['cpus'] = limit_cpus
+    return resources
+
+
+def stack_footprint(requirements, catalog_ids, settings):
+    """
+    Sum the scaled requirements of a set of catalog services.
+
+    Args:
+        requirements: Catalog requirements keyed by catalog id
+        catalog_ids: Ids of the selected services; unknown ids are ignored
+        settings: Effective settings from resource_settings()
+
+    Returns:
+        dict: Total reserved 'cpu' cores and 'ram' in GB, 'storage' in GB, the
+              'limits' the containers may grow to, and the ids that were counted
+    """
+    counted = [catalog_id for catalog_id in dict.fromkeys(catalog_ids) if catalog_id in requirements]
+    total = {'cpu': 0.0, 'ram': 0.0, 'storage': 0.0}
+    for catalog_id in counted:
+        for key in total:
+            total[key] += requirements[catalog_id].get(key, 0)
+
+    scale, headroom = settings['scale'], settings['headroom']
+    return {
+        'cpu': _cpus(total['cpu'] * scale),
+        'ram': round(total['ram'] * scale, 2),
+        # Disk usage is neither limited nor scaled; data grows with the clinic, not the host
+        'storage': round(total['storage'], 2),
+        'limits': {
+            'cpu': _cpus(total['cpu'] * scale * headroom),
+            'ram': round(total['ram'] * scale * headroom, 2)
+        },
+        'scale': scale,
+        'services': counted
+    }
@@ -0,0 +1,120 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2024-2025 Iliya Yaroshevskiy
+"""
+Medocker Serialization
+
+This module is the single place where Medocker reads and writes YAML. It uses the
+libyaml C extension (CSafeLoader/CSafeDumper) when PyYAML was built with it and
+falls back to the pure-Python implementation otherwise.
+
+It also offers an optional binary sidecar cache for parsed YAML files: a pickle of
+the parsed document stored under ~/.medocker/cache/yaml and keyed by the SHA-256
+of the YAML text, so an unchanged file is never parsed twice.
+"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+import yaml
+
+try:
+    from yaml import CSafeDumper as _BaseDumper
+    from yaml import CSafeLoader as SafeLoader
+    have_libyaml = True
+except ImportError:
+    from yaml import SafeDumper as _BaseDumper
+    from yaml import SafeLoader
+    have_libyaml = False
+
+SIDECAR_DIR = os.path.join(os.path.expanduser('~'), '.medocker', 'cache', 'yaml')
+
+
+class SafeDumper(_BaseDumper):
+    """Safe dumper that also accepts dict subclasses and tuples (e.g. config snapshots)."""
+
+
+SafeDumper.add_multi_representer(dict, SafeDumper.represent_dict)
+SafeDumper.add_representer(tuple, SafeDumper.represent_list)
+
+
+def load_yaml(stream, loader=None):
+    """Parse a YAML document from a string or file object."""
+    return yaml.load(stream, Loader=loader or SafeLoader)
+
+
+def dump_yaml(data, stream=None, dumper=None, **kwargs):
+    """
+    Serialize data as block-style YAML.
+
+    Args:
+        data: The object to serialize
+        stream: File object to write to (optional, a string is returned if omitted)
+        dumper: Dumper class to use instead of the fastest available one (optional)
+        **kwargs: Extra arguments passed to yaml.dump
+
+    Returns:
+        str or None: The YAML text if no stream was given
+    """
+    kwargs.setdefault('default_flow_style', False)
+    return yaml.dump(data, stream, Dumper=dumper or SafeDumper, **kwargs)
+
+
+def _sidecar_paths(path, digest):
+    """Return (sidecar file, prefix shared by all sidecars of path)."""
+    prefix = hashlib.sha256(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(SIDECAR_DIR, f"{prefix}-{digest}.pickle"), prefix + '-'
+
+
+def _write_sidecar(sidecar_path, prefix, data):
+    """Atomically write a sidecar and remove stale ones for the same source file."""
+    os.makedirs(SIDECAR_DIR, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=SIDECAR_DIR)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, sidecar_path)
+    except OSError:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        return
+
+    for name in os.listdir(SIDECAR_DIR):
+        if name.startswith(prefix) and os.path.join(SIDECAR_DIR, name) != sidecar_path:
+            try:
+                os.unlink(os.path.join(SIDECAR_DIR, name))
+            except OSError:
+                pass
+
+
+def load_yaml_file(path, sidecar=False):
+    """
+    Load a YAML file, optionally through the binary sidecar cache.
+
+    Args:
+        path: Path to the YAML file
+        sidecar: Reuse/store a pickled copy keyed by the file's content hash
+
+    Returns:
+        The parsed document
+    """
+    if not sidecar:
+        with open(path, 'r') as f:
+            return load_yaml(f)
+
+    with open(path, 'rb') as f:
+        raw = f.read()
+    sidecar_path, prefix = _sidecar_paths(path, hashlib.sha256(raw).hexdigest())
+
+    try:
+        with open(sidecar_path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        pass
+
+    data = load_yaml(raw.decode('utf-8'))
+    _write_sidecar(sidecar_path, prefix, data)
+    return data
@@ -0,0 +1,679 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2024-2025 Iliya Yaroshevskiy
+"""
+Medocker Service Registry
+
+This module describes every Docker service Medocker can generate as data: the
+config section that enables it, its image, volumes, environment, Traefik routing,
+direct-port fallback and dependencies. String values may contain ${section.key}
+references into the configuration.
+
+The definitions are compiled once at import time, so generating a compose file only
+costs work for the services that are actually enabled. Supporting a new service is a
+matter of adding an entry to SERVICE_DEFINITIONS.
+
+IncrementalComposer keeps the last rendered fragment of every service and only
+re-renders services whose configuration inputs changed, reporting which services
+were added, removed or modified.
+"""
+
+import threading
+from collections import OrderedDict
+
+from .catalog import docker_requirements, load_catalog
+from .references import Template, get_value
+from .render_cache import stable_digest
+from .resources import RESOURCES_PATH, compose_resources, resource_settings, stack_footprint
+
+NETWORK = 'medocker_network'
+TRAEFIK_ENABLED = ('infrastructure', 'traefik', 'enabled')
+
+
+def _traefik_hook(service, config):
+    """Basic auth when there is no Keycloak, and HTTPS redirection when SSL is on."""
+    if not config['infrastructure']['keycloak']['enabled']:
+        # Using a default admin/password for demo purposes - should be changed in production
+        service['labels'].extend([
+            'traefik.http.middlewares.traefik-auth.basicauth.users=admin:$$apr1$$JY5M3OsG$$vKDvGPGAM8TO9el64HSVl1' # admin:password
+        ])
+
+    # Redirect HTTP to HTTPS if SSL is enabled
+    service['command'].append(
+        '--entrypoints.web.http.redirections.entrypoint.to=websecure' if config['system']['ssl_enabled'] else ''
+    )
+
+
+def _vaultwarden_hook(service, config):
+    """SMTP settings and Keycloak single sign-on for Vaultwarden."""
+    vaultwarden = config['components']['vaultwarden']
+
+    # Configure SMTP if settings provided
+    if vaultwarden['smtp_host']:
+        service['environment'].update({
+            'SMTP_HOST': vaultwarden['smtp_host'],
+            'SMTP_PORT': str(vaultwarden['smtp_port']),
+            'SMTP_SSL': str(vaultwarden['smtp_ssl']).lower(),
+            'SMTP_USERNAME': vaultwarden['smtp_username'],
+            'SMTP_PASSWORD': vaultwarden['smtp_password'],
+            'SMTP_FROM': config['system']['admin_email']
+        })
+
+    # Configure SSO with Keycloak if both are enabled
+    if config['infrastructure']['keycloak']['enabled'] and vaultwarden['sso_enabled']:
+        keycloak_url = f"https://keycloak.{config['system']['domain']}"
+        realm_url = f"{keycloak_url}/realms/{config['infrastructure']['keycloak']['realm_name']}"
+        service['environment'].update({
+            'OIDC_ENABLED': 'true',
+            'OIDC_CLIENT_ID': 'vaultwarden',
+            'OIDC_CLIENT_SECRET': 'vaultwarden-secret',  # This should be configured in Keycloak
+            'OIDC_ISSUER_URL': realm_url,
+            'OIDC_AUTHORIZATION_ENDPOINT': f"{realm_url}/protocol/openid-connect/auth",
+            'OIDC_TOKEN_ENDPOINT': f"{realm_url}/protocol/openid-connect/token",
+            'OIDC_USERINFO_ENDPOINT': f"{realm_url}/protocol/openid-connect/userinfo",
+            'OIDC_DISPLAY_NAME': 'Keycloak',
+            'OIDC_ALLOW_SIGNUP': 'true'
+        })
+
+
+def _healthcheck(test, start_period='30s', retries=10):
+    """Build a compose healthcheck; start_period covers first-start initialization."""
+    return {
+        'test': test,
+        'interval': '10s',
+        'timeout': '5s',
+        'retries': retries,
+        'start_period': start_period
+    }
+
+
+# Printed when both Traefik and Keycloak are enabled
+_KEYCLOAK_NOTICE = ('infrastructure.traefik.enabled', 'infrastructure.keycloak.enabled')
+
+SERVICE_DEFINITIONS = [
+    {
+        'name': 'traefik',
+        'section': 'infrastructure.traefik',
+        'catalog_id': 'traefik',
+        'image': 'traefik:${infrastructure.traefik.version}',
+        'ports': [
+            '${infrastructure.traefik.http_port}:80',
+            '${infrastructure.traefik.https_port}:443',
+            '${infrastructure.traefik.dashboard_port}:8080'
+        ],
+        'volumes': [
+            '/var/run/docker.sock:/var/run/docker.sock:ro',
+            './data/traefik/acme.json:/acme.json',
+            './data/traefik/config:/etc/traefik/config'
+        ],
+        'command': [
+            '--api.dashboard=true',
+            '--providers.docker=true',
+            '--providers.docker.exposedByDefault=false',
+            '--entrypoints.web.address=:80',
+            '--entrypoints.websecure.address=:443',
+            '--certificatesresolvers.myresolver.acme.email=${system.admin_email}',
+            '--certificatesresolvers.myresolver.acme.storage=/acme.json',
+            '--certificatesresolvers.myresolver.acme.tlschallenge=true'
+        ],
+        'labels': [
+            'traefik.enable=true',
+            'traefik.http.routers.traefik.rule=Host(`traefik.${system.domain}`)',
+            'traefik.http.routers.traefik.service=api@internal',
+            'traefik.http.routers.traefik.entrypoints=websecure',
+            'traefik.http.routers.traefik.tls=true',
+            'traefik.http.routers.traefik.middlewares=traefik-auth'
+        ],
+        'named_volumes': ['traefik_data'],
+        'hook': _traefik_hook,
+        'inputs': ['infrastructure.keycloak.enabled', 'system.ssl_enabled']
+    },
+    {
+        'name': 'postgres',
+        'section': 'databases.postgres',
+        'catalog_id': 'postgres',
+        'image': 'postgres:${databases.postgres.version}',
+        'environment': {
+            'POSTGRES_PASSWORD': '${databases.postgres.root_password}'
+        },
+        'volumes': ['./data/postgres:/var/lib/postgresql/data'],
+        'healthcheck': _healthcheck(['CMD-SHELL', 'pg_isready -U postgres'], start_period='10s'),
+        'named_volumes': ['postgres_data']
+    },
+    {
+        'name': 'keycloak',
+        'section': 'infrastructure.keycloak',
+        'catalog_id': 'keycloak',
+        'image': 'quay.io/keycloak/keycloak:${infrastructure.keycloak.version}',
+        'command': ['start-dev', '--import-realm'],
+        'environment': {
+            'KC_DB': 'postgres',
+            'KC_DB_URL': 'jdbc:postgresql://${infrastructure.keycloak.db_host}:5432/${infrastructure.keycloak.db_name}',
+            'KC_DB_USERNAME': '${infrastructure.keycloak.db_user}',
+            'KC_DB_PASSWORD': '${infrastructure.keycloak.db_password}',
+            'KEYCLOAK_ADMIN': '${infrastructure.keycloak.admin_user}',
+            'KEYCLOAK_ADMIN_PASSWORD': '${infrastructure.keycloak.admin_password}',
+            'KC_HOSTNAME': 'keycloak.${system.domain}',
+            'KC_PROXY': 'edge',
+            'KC_HEALTH_ENABLED': 'true'
+        },
+        # The image has no curl, so the readiness endpoint is probed through bash
+        'healthcheck': _healthcheck([
+            'CMD-SHELL',
+            "exec 3<>/dev/tcp/127.0.0.1/8080 && "
+            "printf 'GET /health/ready HTTP/1.1\\r\\nHost: localhost\\r\\nConnection: close\\r\\n\\r\\n' >&3 && "
+            "grep -q '200 OK' <&3"
+        ], start_period='60s'),
+        'volumes': ['./data/keycloak/realms:/opt/keycloak/data/import'],
+        'depends_on': ['postgres'],
+        'route': {'router': 'keycloak', 'port': 8080},
+        'fallback_ports': ['${infrastructure.keycloak.port}:8080'],
+        'named_volumes': ['keycloak_data']
+    },
+    {
+        'name': 'mariadb',
+        'section': 'databases.mariadb',
+        'catalog_id': 'mariadb',
+        'image': 'mariadb:${databases.mariadb.version}',
+        'environment': {
+            'MYSQL_ROOT_PASSWORD': '${databases.mariadb.root_password}'
+        },
+        'volumes': ['./data/mariadb:/var/lib/mysql'],
+        'healthcheck': _healthcheck(['CMD', 'healthcheck.sh', '--connect', '--innodb_initialized'], start_period='20s'),
+        'named_volumes': ['mariadb_data']
+    },
+    {
+        'name': 'vaultwarden',
+        'section': 'components.vaultwarden',
+        'catalog_id': 'vaultwarden',
+        'image': 'vaultwarden/server:${components.vaultwarden.version}',
+        'environment': {
+            'DATABASE_URL': 'postgresql://${components.vaultwarden.db_user}:${components.vaultwarden.db_pass}'
+                            '@${components.vaultwarden.db_host}:5432/${components.vaultwarden.db_name}',
+            'ADMIN_TOKEN': '${components.vaultwarden.admin_token}',
+            'DOMAIN': 'https://${components.vaultwarden.domain}',
+            'WEBSOCKET_ENABLED': 'true',
+            'SIGNUPS_ALLOWED': 'false',  # Disable public signups by default
+            'WEB_VAULT_ENABLED': 'true'
+        },
+        'volumes': ['./data/vaultwarden:/data'],
+        'depends_on': ['postgres'],
+        'route': {
+            'router': 'vaultwarden',
+            'port': 80,
+            # WebSocket support for real-time notifications
+            'extra_labels': [
+                'traefik.http.routers.vaultwarden-ws.rule=Host(`vaultwarden.${system.domain}`) && Path(`/notifications/hub`)',
+                'traefik.http.routers.vaultwarden-ws.entrypoints=websecure',
+                'traefik.http.routers.vaultwarden-ws.tls=true',
+                'traefik.http.services.vaultwarden-ws.loadbalancer.server.port=3012'
+            ]
+        },
+        'fallback_ports': [
+            '${components.vaultwarden.port}:80',
+            '3012:3012'  # WebSocket port
+        ],
+        'named_volumes': ['vaultwarden_data'],
+        'hook': _vaultwarden_hook,
+        'inputs': ['system.admin_email', 'infrastructure.keycloak']
+    },
+    {
+        'name': 'openemr',
+        'section': 'components.openemr',
+        'catalog_id': 'openemr',
+        'image': 'openemr/openemr:${components.openemr.version}',
+        'volumes': [
+            './data/openemr/sites:/var/www/localhost/htdocs/openemr/sites',
+            './data/openemr/logs:/var/log/apache2'
+        ],
+        'environment': {
+            'MYSQL_HOST': '${components.openemr.db_host}',
+            'MYSQL_ROOT_PASS': '${databases.mariadb.root_password}',
+            'MYSQL_USER': '${components.openemr.db_user}',
+            'MYSQL_PASS': '${components.openemr.db_pass}',
+            'MYSQL_DATABASE': '${components.openemr.db_name}',
+            'OE_USER': 'admin',
+            'OE_PASS': 'pass'
+        },
+        # The first start runs the OpenEMR installer, which takes several minutes
+        'healthcheck': _healthcheck(['CMD', 'curl', '-fsS', '-o', '/dev/null', 'http://localhost/'],
+                                    start_period='300s', retries=30),
+        'depends_on': ['mariadb'],
+        'route': {'router': 'openemr', 'port': 80},
+        'fallback_ports': ['${components.openemr.port}:80'],
+        'named_volumes': ['openemr_sites', 'openemr_logs'],
+        # Note: OpenEMR OIDC configuration needs to be done through the admin interface
+        'notices': [(_KEYCLOAK_NOTICE, "OpenEMR and Keycloak detected. You'll need to configure OIDC in OpenEMR manually after startup.")]
+    },
+    {
+        'name': 'nextcloud',
+        'section': 'components.nextcloud',
+        'catalog_id': 'nextcloud',
+        'image': 'nextcloud:${components.nextcloud.version}',
+        'volumes': ['./data/nextcloud:/var/www/html'],
+        'environment': {
+            'MYSQL_HOST': '${components.nextcloud.db_host}',
+            'MYSQL_DATABASE': '${components.nextcloud.db_name}',
+            'MYSQL_USER': '${components.nextcloud.db_user}',
+            'MYSQL_PASSWORD': '${components.nextcloud.db_pass}',
+            'NEXTCLOUD_ADMIN_USER': 'admin',
+            'NEXTCLOUD_ADMIN_PASSWORD': 'admin',
+            'NEXTCLOUD_TRUSTED_DOMAINS': '${system.domain} nextcloud.${system.domain}'
+        },
+        'healthcheck': _healthcheck(['CMD', 'curl', '-fsS', '-o', '/dev/null', 'http://localhost/status.php'],
+                                    start_period='120s', retries=30),
+        'depends_on': ['mariadb'],
+        'route': {'router': 'nextcloud', 'port': 80},
+        'fallback_ports': ['${components.nextcloud.port}:80'],
+        'named_volumes': ['nextcloud_data'],
+        # Note: Nextcloud OIDC configuration can be done through env vars or apps
+        'notices': [(_KEYCLOAK_NOTICE, "Nextcloud and Keycloak detected. You'll need to install the SSO & SAML app in Nextcloud.")]
+    },
+    {
+        'name': 'portainer',
+        'section': 'additional_services.portainer',
+        'image': 'portainer/portainer-ce:${additional_services.portainer.version}',
+        'volumes': [
+            './data/portainer:/data',
+            '/var/run/docker.sock:/var/run/docker.sock'
+        ],
+        'route': {'router': 'portainer', 'port': 9000},
+        'fallback_ports': ['${additional_services.portainer.port}:9443'],
+        'named_volumes': ['portainer_data']
+    },
+    {
+        'name': 'rustdesk-hbbs',
+        'section': 'additional_services.rustdesk',
+        'catalog_id': 'rustdesk',
+        'image': 'rustdesk/rustdesk-server:${additional_services.rustdesk.version}',
+        'container_name': 'rustdesk-hbbs',
+        'ports': [
+            '${additional_services.rustdesk.hbbs_port}:21115/tcp',
+            '${additional_services.rustdesk.hbbs_port}:21115/udp',
+            '${additional_services.rustdesk.hbbr_port}:21116/tcp',
+            '${additional_services.rustdesk.hbbr_port}:21116/udp',
+            '${additional_services.rustdesk.web_port}:8080'
+        ],
+        'volumes': ['./data/rustdesk:/root'],
+        'command': 'hbbs -r rustdesk-hbbr:21117',
+        'environment': {
+            'RUSTDESK_RELAY_SERVER': 'rustdesk-hbbr:21117',
+            'RUSTDESK_KEY': '${additional_services.rustdesk.key_base}'
+        },
+        'depends_on': ['rustdesk-hbbr'],
+        'route': {'router': 'rustdesk', 'port': 8080},
+        'named_volumes': ['rustdesk_data']
+    },
+    {
+        'name': 'rustdesk-hbbr',
+        'section': 'additional_services.rustdesk',
+        'image': 'rustdesk/rustdesk-server:${additional_services.rustdesk.version}',
+        'container_name': 'rustdesk-hbbr',
+        'ports': [
+            '${additional_services.rustdesk.relay_port}:21117/tcp',
+            '${additional_services.rustdesk.relay_port}:21117/udp'
+        ],
+        'command': 'hbbr',
+        'volumes': ['./data/rustdesk:/root']
+    },
+    {
+        'name': 'fasten-health',
+        'section': 'additional_services.fasten_health',
+        'image': 'fastenhealth/fasten-onprem:${additional_services.fasten_health.version}',
+        'container_name': 'fasten-health',
+        'environment': {
+            'FASTEN_HOST': '${additional_services.fasten_health.host}',
+            'FASTEN_PORT': '${additional_services.fasten_health.port}',
+            'FASTEN_USER_EMAIL': 'admin@example.com',
+            'FASTEN_USER_PASSWORD': 'changeme',
+            'FASTEN_ALLOW_SIGNUP': 'true'
+        },
+        'volumes': ['./data/fasten-health:/app/backend/storage'],
+        'route': {'router': 'fastenhealth', 'port': '${additional_services.fasten_health.port}'},
+        'fallback_ports': ['${additional_services.fasten_health.port}:${additional_services.fasten_health.port}'],
+        'named_volumes': ['fasten_health_data']
+    },
+    {
+        'name': 'orthanc',
+        'section': 'additional_services.orthanc',
+        'catalog_id': 'orthanc',
+        'image': 'jodogne/orthanc-plugins:${additional_services.orthanc.version}',
+        'volumes': ['./data/orthanc:/var/lib/orthanc/db'],
+        'route': {'router': 'orthanc', 'port': 8042},
+        'fallback_ports': ['${additional_services.orthanc.port}:8042'],
+        'named_volumes': ['orthanc_data']
+    },
+    {
+        'name': 'metabase',
+        'section': 'additional_services.metabase',
+        'catalog_id': 'metabase',
+        'image': 'metabase/metabase:${additional_services.metabase.version}',
+        'volumes': ['./data/metabase:/metabase-data'],
+        'environment': {
+            'MB_DB_FILE': '/metabase-data/metabase.db'
+        },
+        'route': {'router': 'metabase', 'port': 3000},
+        'fallback_ports': ['${additional_services.metabase.port}:3000'],
+        'named_volumes': ['metabase_data']
+    },
+    {
+        'name': 'hapi-fhir',
+        'section': 'additional_services.hapi_fhir',
+        'catalog_id': 'hapi-fhir',
+        'image': 'hapiproject/hapi:v${additional_services.hapi_fhir.version}',
+        'volumes': ['./data/hapi_fhir:/data/hapi'],
+        'route': {'router': 'hapi-fhir', 'host': 'fhir', 'port': 8080},
+        'fallback_ports': ['${additional_services.hapi_fhir.port}:8080'],
+        'named_volumes': ['hapi_fhir_data']
+    },
+    {
+        'name': 'minio',
+        'section': 'additional_services.minio',
+        'image': 'minio/minio:${additional_services.minio.version}',
+        'command': 'server /data --console-address ":9001"',
+        'environment': {
+            'MINIO_ROOT_USER': '${additional_services.minio.access_key}',
+            'MINIO_ROOT_PASSWORD': '${additional_services.minio.secret_key}'
+        },
+        'volumes': ['./data/minio:/data'],
+        'route': {'router': 'minio', 'port': 9001},
+        'fallback_ports': [
+            '${additional_services.minio.port}:9000',
+            '${additional_services.minio.console_port}:9001'
+        ],
+        'named_volumes': ['minio_data']
+    },
+    {
+        'name': 'prometheus',
+        'section': 'additional_services.prometheus',
+        'image': 'prom/prometheus:${additional_services.prometheus.version}',
+        'volumes': ['./data/prometheus:/prometheus'],
+        'route': {'router': 'prometheus', 'port': 9090},
+        'fallback_ports': ['${additional_services.prometheus.port}:9090'],
+        'named_volumes': ['prometheus_data']
+    },
+    {
+        'name': 'grafana',
+        'section': 'additional_services.grafana',
+        'image': 'grafana/grafana:${additional_services.grafana.version}',
+        'volumes': ['./data/grafana:/var/lib/grafana'],
+        'route': {'router': 'grafana', 'port': 3000},
+        'fallback_ports': ['${additional_services.grafana.port}:3000'],
+        'named_volumes': ['grafana_data']
+    },
+    {
+        'name': 'n8n',
+        'section': 'additional_services.n8n',
+        'image': 'n8nio/n8n:${additional_services.n8n.version}',
+        'environment': {
+            'GENERIC_TIMEZONE': '${system.timezone}'
+        },
+        'volumes': ['./data/n8n:/home/node/.n8n'],
+        'route': {'router': 'n8n', 'port': 5678},
+        'fallback_ports': ['${additional_services.n8n.port}:5678'],
+        'named_volumes': ['n8n_data']
+    },
+    {
+        'name': 'mattermost',
+        'section': 'additional_services.mattermost',
+        'image': 'mattermost/mattermost-team-edition:${additional_services.mattermost.version}',
+        'volumes': ['./data/mattermost:/mattermost/data'],
+        'route': {'router': 'mattermost', 'port': 8065},
+        'fallback_ports': ['${additional_services.mattermost.port}:8065'],
+        'named_volumes': ['mattermost_data']
+    }
+]
+
+
+def _compile(value):
+    """Turn every string in a definition value into a Template, recursively."""
+    if isinstance(value, str):
+        return Template((), value) if '${' in value else value
+    if isinstance(value, list):
+        return [_compile(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _compile(item) for key, item in value.items()}
+    return value
+
+
+def _references(value):
+    """Yield the config paths referenced by a value produced by _compile."""
+    if isinstance(value, Template):
+        yield from value.refs
+    elif isinstance(value, list):
+        for item in value:
+            yield from _references(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _references(item)
+
+
+def _render(value, config):
+    """Evaluate a value produced by _compile against a configuration."""
+    if isinstance(value, Template):
+        return value.evaluate(config)
+    if isinstance(value, list):
+        return [_render(item, config) for item in value]
+    if isinstance(value, dict):
+        return {key: _render(item, config) for key, item in value.items()}
+    return value
+
+
+class ServiceDefinition:
+    """A compiled entry of SERVICE_DEFINITIONS."""
+
+    # Compose keys copied from the definition, in the order they are rendered
+    COMPOSE_KEYS = ('image', 'container_name', 'command', 'environment', 'ports', 'volumes', 'labels', 'healthcheck')
+
+    def __init__(self, spec, requirements=None):
+        self.name = spec['name']
+        self.section = tuple(spec['section'].split('.'))
+        self.enabled_path = self.section + ('enabled',)
+        self.catalog_id = spec.get('catalog_id')
+        # Catalog cpu/ram requirements, turned into resource limits when rendering
+        self.requirements = (requirements or {}).get(self.catalog_id)
+        self.depends_on = tuple(spec.get('depends_on', ()))
+        # Start condition per dependency, filled in by the registry
+        self.depends_on_conditions = {name: 'service_started' for name in self.depends_on}
+        self.healthcheck = spec.get('healthcheck')
+        self.named_volumes = tuple(spec.get('named_volumes', ()))
+        self.hook = spec.get('hook')
+        self.notices = [(tuple(tuple(p.split('.')) for p in paths), message)
+                        for paths, message in spec.get('notices', ())]
+        self.fields = {key: _compile(spec[key]) for key in self.COMPOSE_KEYS if key in spec}
+
+        route = spec.get('route')
+        self.route_labels = None
+        if route:
+            router = route['router']
+            host = route.get('host', router)
+            self.route_labels = _compile([
+                'traefik.enable=true',
+                f'traefik.http.routers.{router}.rule=Host(`{host}.${{system.domain}}`)',
+                f'traefik.http.routers.{router}.entrypoints=websecure',
+                f'traefik.http.routers.{router}.tls=true',
+                f'traefik.http.services.{router}.loadbalancer.server.port={route["port"]}'
+            ] + route.get('extra_labels', []))
+        self.fallback_ports = _compile(spec['fallback_ports']) if 'fallback_ports' in spec else None
+
+        # Every config path the rendered fragment can depend on
+        inputs = {self.section, TRAEFIK_ENABLED}
+        if self.requirements:
+            inputs.add(RESOURCES_PATH)
+        for value in (self.fields, self.route_labels, self.fallback_ports):
+            inputs.update(_references(value))
+        inputs.update(tuple(path.split('.')) for path in spec.get('inputs', ()))
+        for paths, _ in self.notices:
+            inputs.update(paths)
+        self.inputs = tuple(sorted(inputs, key=lambda path: tuple(map(str, path))))
+
+    def enabled(self, config):
+        """Return True if the service's config section is enabled."""
+        return bool(get_value(config, self.enabled_path, False))
+
+    def fingerprint(self, config):
+        """Return a digest of the configuration values this service is rendered from."""
+        return stable_digest([get_value(config, path) for path in self.inputs])
+
+    def render(self, config):
+        """Return the compose service definition for this configuration."""
+        service = {'restart': 'unless-stopped', 'networks': [NETWORK]}
+        for key, value in self.fields.items():
+            service[key] = _render(value, config)
+        if self.depends_on:
+            service['depends_on'] = {name: {'condition': condition}
+                                     for name, condition in self.depends_on_conditions.items()}
+
+        if get_value(config, TRAEFIK_ENABLED, False):
+            # If Traefik is enabled, add labels for Traefik routing
+            if self.route_labels is not None:
+                service['labels'] = _render(self.route_labels, config)
+        elif self.fallback_ports is not None:
+            # If Traefik is not enabled, expose port directly
+            service['ports'] = service.get('ports', []) + _render(self.fallback_ports, config)
+
+        if self.hook:
+            self.hook(service, config)
+
+        if self.requirements:
+            service.update(compose_resources(self.requirements, resource_settings(config)))
+
+        for paths, message in self.notices:
+            if all(get_value(config, path, False) for path in paths):
+                print(message)
+        return service
+
+
+class ServiceRegistry:
+    """Index of compiled service definitions."""
+
+    def __init__(self, definitions, requirements=None):
+        self.requirements = requirements or {}
+        self.services = [ServiceDefinition(spec, self.requirements) for spec in definitions]
+        self.by_name = {service.name: service for service in self.services}
+        self.by_catalog_id = {service.catalog_id: service for service in self.services if service.catalog_id}
+
+        # Wait for dependencies to pass their healthcheck, where they have one
+        for service in self.services:
+            for name in service.depends_on:
+                if name in self.by_name and self.by_name[name].healthcheck:
+                    service.depends_on_conditions[name] = 'service_healthy'
+
+    def enabled_services(self, config):
+        """Return the definitions whose config section is enabled."""
+        return [service for service in self.services if service.enabled(config)]
+
+    def section_for_catalog_id(self, catalog_id):
+        """Return the config section (tuple of keys) enabling a catalog service, if known."""
+        service = self.by_catalog_id.get(catalog_id)
+        return service.section if service else None
+
+    def footprint(self, config, catalog_ids=None):
+        """
+        Sum the resources reserved by a stack.
+
+        Args:
+            config: The configuration dictionary (for the resource settings)
+            catalog_ids: Catalog ids of the selected services (default: the
+                         services enabled in config)
+
+        Returns:
+            dict: See resources.stack_footprint
+        """
+        if catalog_ids is None:
+            catalog_ids = [service.catalog_id for service in self.enabled_services(config)]
+        return stack_footprint(self.requirements, catalog_ids, resource_settings(config))
+
+    def build_compose(self, config, names=None):
+        """
+        Build the docker compose document for a configuration.
+
+        Args:
+            config: The configuration dictionary
+            names: Only include these services (default: all enabled services)
+
+        Returns:
+            dict: The compose document
+        """
+        services = self.enabled_services(config)
+        if names is not None:
+            services = [service for service in services if service.name in names]
+        return _assemble((service, service.render(config)) for service in services)
+
+
+def _assemble(fragments):
+    """Build a compose document from (ServiceDefinition, rendered service) pairs."""
+    compose = {
+        'version': '3.8',
+        'services': {},
+        'networks': {
+            NETWORK: {
+                'driver': 'bridge'
+            }
+        },
+        'volumes': {}
+    }
+    for service, fragment in fragments:
+        compose['services'][service.name] = fragment
+        for volume in service.named_volumes:
+            compose['volumes'][volume] = {'driver': 'local'}
+    return compose
+
+
+class IncrementalComposer:
+    """
+    Render compose documents, reusing per-service fragments between calls.
+
+    State is kept separately for each target (e.g. an output file), and only the
+    most recently used targets are remembered.
+    """
+
+    def __init__(self, registry, max_targets=16):
+        self.registry = registry
+        self.max_targets = max_targets
+        self._lock = threading.Lock()
+        self._targets = OrderedDict()
+
+    def render(self, config, target='default'):
+        """
+        Render the compose document for config and diff it against the last render.
+
+        Args:
+            config: The configuration dictionary
+            target: Name of the output whose previous render is compared against
+
+        Returns:
+            tuple: (compose dict, diff) where diff lists 'added', 'removed',
+                   'modified' and 'unchanged' service names and has a 'changed' flag.
+                   The compose dict shares fragments with the cache and must not be
+                   modified.
+        """
+        with self._lock:
+            previous = self._targets.get(target, {})
+            current = {}
+            diff = {'added': [], 'removed': [], 'modified': [], 'unchanged': []}
+
+            for service in self.registry.enabled_services(config):
+                key = service.fingerprint(config)
+                old = previous.get(service.name)
+                if old is not None and old[0] == key:
+                    current[service.name] = old
+                    diff['unchanged'].append(service.name)
+                    continue
+                current[service.name] = (key, service, service.render(config))
+                diff['added' if old is None else 'modified'].append(service.name)
+
+            diff['removed'] = sorted(name for name in previous if name not in current)
+            diff['changed'] = bool(diff['added'] or diff['removed'] or diff['modified'])
+
+            self._targets[target] = current
+            self._targets.move_to_end(target)
+            while len(self._targets) > self.max_targets:
+                self._targets.popitem(last=False)
+
+        compose = _assemble((service, fragment) for _, service, fragment in current.values())
+        return compose, diff
+
+
+# Compiled once at import time and shared by all generators
+default_registry = ServiceRegistry(SERVICE_DEFINITIONS, docker_requirements(load_catalog()))
+default_composer = IncrementalComposer(default_registry)
@@ -0,0 +1,232 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2024-2025 Iliya Yaroshevskiy
+"""
+Medocker SSH Connection Pool
+
+This module keeps authenticated SSH connections open between deployments, so that
+redeploying to a host that was used recently skips the TCP connect, key exchange
+and authentication. Connections are keyed by host, port, user and credentials,
+kept alive with SSH keepalive packets, health-checked before reuse and closed after
+sitting idle for a while. Each connection also keeps its SFTP session open.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import paramiko
+
+
+class PooledConnection:
+    """An SSH client checked out of the pool, with a reusable SFTP session."""
+
+    def __init__(self, key, client):
+        self.key = key
+        self.client = client
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.uses = 0
+        self._sftp = None
+
+    def exec_command(self, command, **kwargs):
+        """Run a command on a new channel of the pooled transport."""
+        return self.client.exec_command(command, **kwargs)
+
+    def sftp(self):
+        """Return the connection's SFTP session, opening it on first use."""
+        if self._sftp is None or self._sftp.get_channel().closed:
+            self._sftp = self.client.open_sftp()
+        return self._sftp
+
+    def is_active(self):
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active() and transport.is_authenticated()
+
+    def probe(self, timeout=5):
+        """Check that the server still answers by opening and closing a channel."""
+        try:
+            channel = self.client.get_transport().open_session(timeout=timeout)
+            channel.close()
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        if self._sftp is not None:
+            try:
+                self._sftp.close()
+            except Exception:
+                pass
+            self._sftp = None
+        self.client.close()
+
+
+class SSHConnectionPool:
+    """Thread-safe pool of authenticated SSH connections."""
+
+    def __init__(self, idle_timeout=300, keepalive=30, max_idle_per_key=4, connect_timeout=10):
+        """
+        Args:
+            idle_timeout: Seconds an unused connection is kept open
+            keepalive: Interval in seconds of SSH keepalive packets; connections idle
+                       for longer than this are probed before being reused
+            max_idle_per_key: Idle connections kept per host/user/credentials
+            connect_timeout: Timeout in seconds for new connections
+        """
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.max_idle_per_key = max_idle_per_key
+        self.connect_timeout = connect_timeout
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._reaper = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(host, port, username, password, key_path):
+        if key_path:
+            auth = ('key', os.path.abspath(os.path.expanduser(key_path)))
+        else:
+            # Never keep the password itself in the key
+            auth = ('password', hashlib.sha256((password or '').encode('utf-8')).hexdigest())
+        return (host, int(port), username, auth)
+
+    def _connect(self, key, host, port, username, password, key_path):
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+        # Connect with either password or key; key_filename loads any key type
+        if key_path:
+            client.connect(hostname=host, port=port, username=username,
+                           key_filename=os.path.expanduser(key_path), timeout=self.connect_timeout)
+        else:
+            client.connect(hostname=host, port=port, username=username, password=password,
+                           timeout=self.connect_timeout)
+
+        client.get_transport().set_keepalive(self.keepalive)
+        return PooledConnection(key, client)
+
+    def checkout(self, host, username, password=None, key_path=None, port=22):
+        """
+        Return a healthy connection, reusing an idle one when possible.
+
+        The connection is used exclusively by the caller until it is passed to
+        release().
+        """
+        key = self._key(host, port, username, password, key_path)
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                connection = idle.pop() if idle else None
+            if connection is None:
+                break
+            idle_for = time.monotonic() - connection.last_used
+            if connection.is_active() and (idle_for < self.keepalive or connection.probe()):
+                with self._lock:
+                    self.hits += 1
+                connection.uses += 1
+                return connection
+            connection.close()
+            with self._lock:
+                self.evictions += 1
+
+        connection = self._connect(key, host, port, username, password, key_path)
+        with self._lock:
+            self.misses += 1
+        connection.uses += 1
+        return connection
+
+    def release(self, connection, discard=False):
+        """Return a connection to the pool, or close it if it is broken or surplus."""
+        connection.last_used = time.monotonic()
+        if not discard and connection.is_active():
+            with self._lock:
+                idle = self._idle.setdefault(connection.key, [])
+                pooled = len(idle) < self.max_idle_per_key
+                if pooled:
+                    idle.append(connection)
+            if pooled:
+                self._start_reaper()
+                return
+        connection.close()
+
+    @contextmanager
+    def connection(self, host, username, password=None, key_path=None, port=22):
+        """
+        Check out a connection for the duration of a with block.
+
+        Connections are returned to the pool afterwards; a connection whose
+        transport failed is closed instead.
+        """
+        connection = self.checkout(host, username, password, key_path, port)
+        try:
+            yield connection
+        except (paramiko.SSHException, OSError, EOFError):
+            self.release(connection, discard=True)
+            raise
+        except BaseException:
+            self.release(connection)
+            raise
+        else:
+            self.release(connection)
+
+    def evict_idle(self):
+        """Close connections that have been idle for longer than idle_timeout."""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key, idle in list(self._idle.items()):
+                keep = [c for c in idle if now - c.last_used < self.idle_timeout]
+                expired.extend(c for c in idle if now - c.last_used >= self.idle_timeout)
+                if keep:
+                    self._idle[key] = keep
+                else:
+                    del self._idle[key]
+            self.evictions += len(expired)
+        for connection in expired:
+            connection.close()
+        return len(expired)
+
+    def _start_reaper(self):
+        """Start the background thread closing idle connections, once."""
+        with self._lock:
+            if self._reaper is not None and self._reaper.is_alive():
+                return
+            self._reaper = threading.Thread(target=self._reap, name='ssh-pool-reaper', daemon=True)
+            self._reaper.start()
+
+    def _reap(self):
+        while True:
+            time.sleep(min(self.idle_timeout, self.keepalive))
+            self.evict_idle()
+            with self._lock:
+                if not self._idle:
+                    self._reaper = None
+                    return
+
+    def close_all(self):
+        """Close every idle connection."""
+        with self._lock:
+            connections = [c for idle in self._idle.values() for c in idle]
+            self._idle.clear()
+        for connection in connections:
+            connection.close()
+
+    def stats(self):
+        """Return pool counters for diagnostics."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'idle': sum(len(idle) for idle in self._idle.values()),
+                'hosts': sorted(f"{key[2]}@{key[0]}:{key[1]}" for key in self._idle)
+            }
+
+
+# Shared by all deployments in this process
+default_pool = SSHConnectionPool()
@@ -0,0 +1,225 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2024-2025 Iliya Yaroshevskiy
+"""
+Medocker Streaming Helpers
+
+This module produces archives incrementally, so generated files can be sent to a
+client (for example as a Flask streaming response) without building the whole
+archive on disk or in memory first.
+
+Archives downloaded repeatedly are built once into an ArchiveCache: the archive is
+spooled to disk as it is produced and served from there, with the digest of its
+content as ETag, until the content of one of its files changes. Entries carry a
+fixed timestamp, so the same files always produce the same archive.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import zipfile
+from collections import OrderedDict, namedtuple
+
+from .render_cache import stable_digest
+
+CHUNK_SIZE = 64 * 1024
+
+# Timestamp of every archive entry, the earliest a zip file can hold
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+class _ChunkSink:
+    """Write-only, non-seekable file object collecting bytes until drained."""
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+
+def directory_entries(directory):
+    """Return (arcname, path) pairs for every file below directory, in a stable order."""
+    entries = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            entries.append((os.path.relpath(path, directory), path))
+    return entries
+
+
+def iter_zip(entries, chunk_size=CHUNK_SIZE):
+    """
+    Yield a DEFLATE-compressed zip archive piece by piece.
+
+    Files are read and compressed in chunks, so memory use is bounded by
+    chunk_size regardless of how large the files are.
+
+    Args:
+        entries: Iterable of (arcname, path) pairs
+        chunk_size: Number of bytes read from each file at a time
+
+    Yields:
+        bytes: Consecutive parts of the archive
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for arcname, path in entries:
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            info.date_time = ZIP_DATE_TIME
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with open(path, 'rb') as source, \
+                    archive.open(info, 'w', force_zip64=info.file_size >= zipfile.ZIP64_LIMIT) as target:
+                while True:
+                    chunk = source.read(chunk_size)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+                    if sink.size >= chunk_size:
+                        yield sink.drain()
+            if sink.size:
+                yield sink.drain()
+    # Central directory written when the archive is closed
+    yield sink.drain()
+
+
+Archive = namedtuple('Archive', ['path', 'etag', 'size'])
+
+
+def file_digest(path, chunk_size=CHUNK_SIZE):
+    """Return the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def entries_signature(entries, digests=None):
+    """
+    Return a digest of the names and contents of archive entries.
+
+    Args:
+        entries: Iterable of (arcname, path) pairs
+        digests: Dictionary reused across calls, mapping the path of a file to
+                 its size, modification time and content digest, so unchanged
+                 files are not read again (optional)
+    """
+    digests = {} if digests is None else digests
+    signature = []
+    for arcname, path in entries:
+        stat = os.stat(path)
+        size, mtime_ns, digest = digests.get(path, (None, None, None))
+        if (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            digest = file_digest(path)
+            digests[path] = (stat.st_size, stat.st_mtime_ns, digest)
+        signature.append((arcname, digest))
+    return stable_digest(signature)
+
+
+class ArchiveCache:
+    """Bounded LRU cache of zip archives spooled to disk, keyed by the content of their files."""
+
+    def __init__(self, directory=None, maxsize=8):
+        """
+        Args:
+            directory: Directory holding the built archives (default: a
+                       medocker-archives directory in the temporary directory)
+            maxsize: Number of archives kept; older ones are deleted
+        """
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'medocker-archives')
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._builds = {}
+        self._entries = OrderedDict()
+        self._digests = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, entries):
+        """
+        Return the archive of entries, building it unless its files are unchanged.
+
+        The archive is written to disk chunk by chunk, so memory use does not
+        depend on the size of the files. Concurrent requests for the same
+        archive share one build.
+
+        Args:
+            entries: List of (arcname, path) pairs
+
+        Returns:
+            Archive: (path, etag, size) of the built zip file
+        """
+        with self._lock:
+            digests = dict(self._digests)
+        key = entries_signature(entries, digests)
+        with self._lock:
+            self._digests.update(digests)
+            build_lock = self._builds.setdefault(key, threading.Lock())
+        with build_lock:
+            with self._lock:
+                archive = self._entries.get(key)
+                if archive is not None and os.path.exists(archive.path):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return archive
+                self.misses += 1
+            archive = self._build(key, entries)
+
+        with self._lock:
+            self._builds.pop(key, None)
+            self._entries[key] = archive
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.maxsize:
+                evicted.append(self._entries.popitem(last=False)[1])
+            kept = {entry.path for entry in self._entries.values()}
+        # Responses already streaming an evicted archive keep their open file
+        for old in evicted:
+            if old.path not in kept and os.path.exists(old.path):
+                os.remove(old.path)
+        return archive
+
+    def _build(self, key, entries):
+        os.makedirs(self.directory, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.build-', suffix='.zip')
+        try:
+            with os.fdopen(fd, 'wb') as target:
+                for chunk in iter_zip(entries):
+                    digest.update(chunk)
+                    target.write(chunk)
+                    size += len(chunk)
+            etag = digest.hexdigest()
+            path = os.path.join(self.directory, f"{etag}.zip")
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return Archive(path, etag, size)
+
+    def stats(self):
+        """Return cache counters for diagnostics."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'maxsize': self.maxsize,
+                'bytes': sum(archive.size for archive in self._entries.values())
+            }
@@ -15,7 +15,7 @@ import string
 import tempfile
 import json
 from pathlib import Path
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, session
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, jsonify, send_file, session
 from flask_wtf import CSRFProtect
 from flask_session import Session
 from flask_cors import CORS
@@ -23,33 +23,43 @@ from waitress import serve
 
 # Import configuration
 from .config import get_config
-from .configure import run_ansible_playbook
+from .artifact_cache import cached_client_artifacts, client_artifacts, default_cache as artifact_cache
+from .catalog import CatalogNotFound, default_store as catalog_store, find_catalog_file
+from .compose_validator import ComposeValidationError
+from .config_store import default_store as config_store, thaw
+from .configure import cache_ansible_artifacts, compose_cache, run_ansible_playbook
+from .fleet import DEFAULT_HOST_TIMEOUT, DEFAULT_WORKERS, deploy_fleet
+from .jobs import JobQueue, JobQueueFull
+from .references import ReferenceGraph, get_value
+from .service_registry import default_registry as default_service_registry
+from .ssh_pool import default_pool as ssh_pool
+from .streaming import ArchiveCache, directory_entries
 
 # Try different import paths for configure.py
 try:
     # Try relative import first (within the same package)
     from .configure import (
         generate_docker_compose,
+        render_docker_compose,
         generate_ansible_playbook,
-        load_config,
-        save_config,
         interactive_configuration,
         resolve_variable_references,
         create_directories,
         deploy_docker_compose_ssh,
+        deploy_placement_ssh,
         generate_password
     )
 except ImportError:
     # Fall back to direct import (for backward compatibility)
     from .configure import (
         generate_docker_compose,
+        render_docker_compose,
         generate_ansible_playbook,
-        load_config,
-        save_config,
         interactive_configuration,
         resolve_variable_references,
         create_directories,
         deploy_docker_compose_ssh,
+        deploy_placement_ssh,
         generate_password
     )
 
@@ -92,6 +102,35 @@ os.makedirs(config.STATIC_DIR, exist_ok=True)
 DEFAULT_CONFIG_FILE = config.DEFAULT_CONFIG_FILE
 CUSTOM_CONFIG_FILE = config.CUSTOM_CONFIG_FILE
 
+# Deployments run in the background, a few at a time
+deploy_jobs = JobQueue(workers=config.DEPLOY_WORKERS, max_queued=config.MAX_QUEUED_DEPLOYS)
+
+# Ansible bundles, rebuilt only when a playbook file changes
+bundle_cache = ArchiveCache(maxsize=config.ANSIBLE_BUNDLE_CACHE_SIZE)
+
+
+def submit_artifact_caching(config_data, playbook_dir):
+    """
+    Download missing client installers in a background job, or return None if
+    every installer the playbook needs is already cached.
+    
+    Raises:
+        JobQueueFull: If the job queue is full
+    """
+    cached = cached_client_artifacts(config_data, artifact_cache, fetch=False)
+    if not set(client_artifacts(config_data)) - set(cached):
+        return None
+    return deploy_jobs.submit('ansible_artifacts', 'Cache client installers', cache_ansible_artifacts,
+                              config_data, playbook_dir)
+
+
+def job_response(job):
+    """Return the 202 response for a submitted job, with links to follow it."""
+    data = job.to_dict()
+    data['status_url'] = url_for('api_job', job_id=job.id)
+    data['events_url'] = url_for('api_job_events', job_id=job.id)
+    return jsonify(data), 202
+
 
 @app.route('/')
 def index():
@@ -102,29 +141,41 @@ def index():
 @app.route('/config', methods=['GET', 'POST'])
 def config():
     """Render the configuration form and handle form submission."""
-    # Load current configuration
-    config_file = CUSTOM_CONFIG_FILE if os.path.exists(CUSTOM_CONFIG_FILE) else DEFAULT_CONFIG_FILE
-    config_data = load_config(config_file)
-    
     if request.method == 'POST':
-        # Update configuration with form data
-        update_config_from_form(config_data, request.form)
-        
-        # Save configuration
-        save_config(config_data, CUSTOM_CONFIG_FILE)
+        # Apply the form to the latest configuration and save it atomically, so
+        # concurrent submissions cannot overwrite each other's changes
+        _, config_data = config_store.update(
+            CUSTOM_CONFIG_FILE,
+            lambda current: update_config_from_form(current, request.form),
+            fallback=DEFAULT_CONFIG_FILE
+        )
         
-        # Generate docker-compose file
-        generate_docker_compose(config_data, 'docker-compose.yml')
+        # Generate docker-compose file, re-rendering only services that changed
+        try:
+            diff = generate_docker_compose(config_data, 'docker-compose.yml')
+        except ComposeValidationError as e:
+            flash('Configuration saved, but the Docker Compose file was not generated: ' + str(e), 'error')
+            return redirect(url_for('config'))
         
-        # Create directories
-        create_directories(config_data)
+        # Directories only need (re)creating when services were added or changed
+        if diff['added'] or diff['modified']:
+            create_directories(config_data)
         
-        flash('Configuration saved successfully!', 'success')
+        flash('Configuration saved successfully! ' + describe_compose_diff(diff), 'success')
         return redirect(url_for('config'))
     
+    config_data = config_store.get(CUSTOM_CONFIG_FILE, fallback=DEFAULT_CONFIG_FILE)
     return render_template('config.html', config=config_data)
 
 
+def describe_compose_diff(diff):
+    """Summarize a generate_docker_compose diff for display."""
+    parts = [f"{label}: {', '.join(diff[key])}"
+             for key, label in (('added', 'added'), ('modified', 'updated'), ('removed', 'removed'))
+             if diff[key]]
+    return 'Services ' + '; '.join(parts) + '.' if parts else 'No service changes.'
+
+
 @app.route('/services')
 def services():
     """Render the services page showing status of running containers."""
@@ -143,24 +194,18 @@ def generate_password_route():
 
 @app.route('/download_compose')
 def download_compose():
-    """Download the generated docker-compose.yml file."""
-    # Get the absolute path to docker-compose.yml
-    compose_file = os.path.abspath('docker-compose.yml')
-    
-    # Check if the file exists
-    if not os.path.exists(compose_file):
-        # Generate it if it doesn't exist
-        config_file = CUSTOM_CONFIG_FILE if os.path.exists(CUSTOM_CONFIG_FILE) else DEFAULT_CONFIG_FILE
-        config_data = load_config(config_file)
-        generate_docker_compose(config_data, compose_file)
-        
-        # Check again after generation
-        if not os.path.exists(compose_file):
-            flash('Error: Could not generate docker-compose.yml file.', 'error')
-            return redirect(url_for('deploy_page'))
-    
+    """Download the docker-compose.yml generated from the current configuration."""
     try:
-        return send_file(compose_file, as_attachment=True)
+        config_data = config_store.get(CUSTOM_CONFIG_FILE, fallback=DEFAULT_CONFIG_FILE)
+        
+        # Rendering is memoized by configuration hash, so unchanged configs are free
+        rendered = render_docker_compose(config_data)
+        
+        response = app.response_class(rendered.content, mimetype='application/x-yaml')
+        response.headers['Content-Disposition'] = 'attachment; filename=docker-compose.yml'
+        response.set_etag(rendered.etag)
+        # Answers If-None-Match with 304 Not Modified when the ETag matches
+        return response.make_conditional(request)
     except Exception as e:
         flash(f'Error downloading file: {str(e)}', 'error')
         return redirect(url_for('deploy_page'))
@@ -169,8 +214,7 @@ def download_compose():
 @app.route('/api/config', methods=['GET'])
 def api_config():
     """Return the current configuration as JSON."""
-    config_file = CUSTOM_CONFIG_FILE if os.path.exists(CUSTOM_CONFIG_FILE) else DEFAULT_CONFIG_FILE
-    config_data = load_config(config_file)
+    config_data = config_store.get(CUSTOM_CONFIG_FILE, fallback=DEFAULT_CONFIG_FILE)
     return jsonify(config_data)
 
 
@@ -188,9 +232,8 @@ def api_deploy():
 @app.route('/deploy', methods=['GET', 'POST'])
 def deploy_page():
     """Render the deployment page and handle deployment requests."""
-    # Load current configuration
-    config_file = CUSTOM_CONFIG_FILE if os.path.exists(CUSTOM_CONFIG_FILE) else DEFAULT_CONFIG_FILE
-    config_data = load_config(config_file)
+    # Load current configuration (read-only snapshot)
+    config_data = config_store.get(CUSTOM_CONFIG_FILE, fallback=DEFAULT_CONFIG_FILE)
     
     # If this is a POST request, handle the deployment
     if request.method == 'POST':
@@ -203,6 +246,7 @@ def deploy_page():
             username = request.form.get('ssh_username')
             password = request.form.get('ssh_password') if request.form.get('use_password') == 'true' else None
             key_path = request.form.get('ssh_key_path') if request.form.get('use_key') == 'true' else None
+            enforce_requirements = request.form.get('skip_requirements') != 'true'
             
             # Validate required fields
             if not host or not username:
@@ -213,20 +257,17 @@ def deploy_page():
                 flash('Either password or SSH key is required for SSH deployment', 'error')
                 return redirect(url_for('deploy_page'))
             
-            # Execute SSH deployment
-            result = deploy_docker_compose_ssh(
-                config_data, 
-                host, 
-                username, 
-                password, 
-                key_path, 
-                port
-            )
+            # Run the SSH deployment in the background and follow its log on the page
+            try:
+                job = deploy_jobs.submit('ssh_deploy', f"Deploy to {username}@{host}:{port}", deploy_docker_compose_ssh,
+                                         config_data, host, username, password, key_path, port,
+                                         enforce_requirements=enforce_requirements)
+            except JobQueueFull as e:
+                flash(str(e), 'error')
+                return redirect(url_for('deploy_page'))
             
-            if result['status'] == 'success':
-                flash(result['message'], 'success')
-            else:
-                flash(result['message'], 'error')
+            flash(f'Deployment to {host} started', 'info')
+            return redirect(url_for('deploy_page', job=job.id))
                 
         elif deployment_type == 'download':
             # Just generate docker-compose.yml for download
@@ -235,7 +276,8 @@ def deploy_page():
             
         return redirect(url_for('deploy_page'))
     
-    return render_template('deploy.html', config=config_data)
+    job = deploy_jobs.get(request.args.get('job', ''))
+    return render_template('deploy.html', config=config_data, job=job.to_dict() if job else None)
 
 
 @app.route('/api/ssh_deploy', methods=['POST'])
@@ -245,34 +287,124 @@ def api_ssh_deploy():
         # Get JSON data
         data = request.json
         
-        # Load configuration
-        config_file = CUSTOM_CONFIG_FILE if os.path.exists(CUSTOM_CONFIG_FILE) else DEFAULT_CONFIG_FILE
-        config_data = load_config(config_file)
-        
-        # Execute SSH deployment
-        result = deploy_docker_compose_ssh(
+        # Load configuration (read-only snapshot)
+        config_data = config_store.get(CUSTOM_CONFIG_FILE, fallback=DEFAULT_CONFIG_FILE)
+        
+        # Spread the stack over the hosts of the placement inventory
+        if data.get('placement'):
+            job = deploy_jobs.submit('placement_deploy', "Deploy placement", deploy_placement_ssh, config_data,
+                                     data['placement'] if isinstance(data['placement'], dict) else None,
+                                     data.get('password'))
+            return job_response(job)
+        
+        # Execute SSH deployment in the background
+        job = deploy_jobs.submit(
+            'ssh_deploy',
+            f"Deploy to {data.get('username')}@{data.get('host')}:{data.get('port', 22)}",
+            deploy_docker_compose_ssh,
             config_data,
             data.get('host'),
             data.get('username'),
             data.get('password'),
             data.get('key_path'),
-            data.get('port', 22)
+            data.get('port', 22),
+            force=bool(data.get('force')),
+            enforce_requirements=data.get('enforce_requirements', True) is not False,
+            refresh_images=bool(data.get('refresh_images'))
         )
-        
-        return jsonify(result)
+        return job_response(job)
+    except JobQueueFull as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 503
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/api/fleet_deploy', methods=['POST'])
+def api_fleet_deploy():
+    """API endpoint deploying the current configuration to many hosts concurrently."""
+    try:
+        data = request.json
+        hosts = data.get('hosts') or []
+        if not hosts:
+            return jsonify({'status': 'error', 'message': 'No hosts given'}), 400
+        for host in hosts:
+            host.setdefault('name', host.get('address'))
+            host.setdefault('address', host.get('name'))
+            # Per-site configuration files are only read from inventories given on the command line
+            host.pop('config', None)
+        
+        config_data = config_store.get(CUSTOM_CONFIG_FILE, fallback=DEFAULT_CONFIG_FILE)
+        job = deploy_jobs.submit(
+            'fleet_deploy',
+            f"Deploy to {len(hosts)} hosts",
+            lambda log: deploy_fleet(
+                hosts,
+                config_data,
+                password=data.get('password'),
+                workers=int(data.get('workers') or DEFAULT_WORKERS),
+                host_timeout=int(data.get('timeout') or DEFAULT_HOST_TIMEOUT),
+                enforce_requirements=data.get('enforce_requirements', True) is not False,
+                report=log
+            )
+        )
+        return job_response(job)
+    except JobQueueFull as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 503
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
+@app.route('/api/jobs')
+def api_jobs():
+    """API endpoint listing the background jobs, newest first."""
+    return jsonify({'status': 'success', 'jobs': [job.to_dict() for job in deploy_jobs.jobs()]})
+
+
+@app.route('/api/jobs/<job_id>')
+def api_job(job_id):
+    """API endpoint returning the status, log and result of a background job."""
+    job = deploy_jobs.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Job not found'}), 404
+    return jsonify(job.to_dict(include_log=True))
+
+
+@app.route('/api/jobs/<job_id>/events')
+def api_job_events(job_id):
+    """Stream the log of a background job as Server-Sent Events while it runs."""
+    job = deploy_jobs.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Job not found'}), 404
+    
+    # Browsers resume a dropped stream after the last event they received
+    try:
+        start = int(request.headers.get('Last-Event-ID', -1)) + 1
+    except ValueError:
+        start = 0
+    
+    def events():
+        yield "retry: 2000\n\n"
+        for event in job.follow(start):
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                index, line = event
+                yield f"id: {index}\ndata: {line}\n\n"
+        yield f"event: done\ndata: {json.dumps(job.to_dict())}\n\n"
+    
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @app.route('/ansible', methods=['GET', 'POST'])
 def ansible_page():
     """Render the Ansible playbook page and handle playbook generation."""
     # Load current configuration
-    config_file = CUSTOM_CONFIG_FILE if os.path.exists(CUSTOM_CONFIG_FILE) else DEFAULT_CONFIG_FILE
-    config_data = load_config(config_file)
+    config_data = config_store.get(CUSTOM_CONFIG_FILE, fallback=DEFAULT_CONFIG_FILE)
     
     # Initialize user_setup if not present
     if 'user_setup' not in config_data:
+        config_data = thaw(config_data)
         config_data['user_setup'] = {
             'client_apps': {},
             'configure_browser': False
@@ -283,19 +415,20 @@ def ansible_page():
         action = request.form.get('action')
         
         if action == 'generate':
-            # Update configuration with form data
-            config_data['user_setup']['configure_browser'] = request.form.get('configure_browser') == 'true'
-            
-            # Update client app settings
-            for component in ['nextcloud', 'vaultwarden', 'rustdesk']:
-                if component in config_data.get('components', {}):
-                    config_data['components'][component]['client_enabled'] = request.form.get(f'{component}_client') == 'true'
+            def apply_form(current):
+                current.setdefault('user_setup', {'client_apps': {}})
+                current['user_setup']['configure_browser'] = request.form.get('configure_browser') == 'true'
+                
+                # Update client app settings
+                for component in ['nextcloud', 'vaultwarden', 'rustdesk']:
+                    if component in current.get('components', {}):
+                        current['components'][component]['client_enabled'] = request.form.get(f'{component}_client') == 'true'
             
-            # Save configuration
-            save_config(config_data, CUSTOM_CONFIG_FILE)
+            # Update and save configuration atomically
+            _, config_data = config_store.update(CUSTOM_CONFIG_FILE, apply_form, fallback=DEFAULT_CONFIG_FILE)
             
-            # Generate Ansible playbook
-            playbook_path = generate_ansible_playbook(config_data)
+            # Generate Ansible playbook; installers are downloaded in the background
+            playbook_path = generate_ansible_playbook(config_data, fetch_artifacts=False)
             
             flash(f'Ansible playbook generated successfully at {playbook_path}', 'success')
             
@@ -303,72 +436,79 @@ def ansible_page():
             playbook_dir = os.path.dirname(playbook_path)
             session['playbook_dir'] = playbook_dir
             
+            try:
+                job = submit_artifact_caching(config_data, playbook_dir)
+            except JobQueueFull as e:
+                flash(f'Client installers not cached: {e}', 'error')
+                job = None
+            if job is not None:
+                flash('Caching client installers for the workstations', 'info')
+                return redirect(url_for('ansible_page', job=job.id))
             return redirect(url_for('ansible_page'))
             
         elif action == 'run':
-            # Run the playbook on localhost
+            # Run the playbook on localhost in the background and follow its log on the page
             inventory_path = os.path.join('playbooks', 'inventory.yml')
             playbook_path = os.path.join('playbooks', 'medocker-user-setup.yml')
             
-            result = run_ansible_playbook(playbook_path, inventory_path)
+            try:
+                job = deploy_jobs.submit('ansible', f"Run {os.path.basename(playbook_path)}", run_ansible_playbook,
+                                         playbook_path, inventory_path)
+            except JobQueueFull as e:
+                flash(str(e), 'error')
+                return redirect(url_for('ansible_page'))
             
-            if result['status'] == 'success':
-                flash('Ansible playbook executed successfully!', 'success')
-            else:
-                flash(f'Ansible playbook execution failed: {result["message"]}', 'error')
-                
-            return redirect(url_for('ansible_page'))
+            flash('Ansible playbook run started', 'info')
+            return redirect(url_for('ansible_page', job=job.id))
     
     # Check if playbook exists
     playbook_exists = os.path.exists(os.path.join('playbooks', 'medocker-user-setup.yml'))
     
-    return render_template('ansible.html', config=config_data, playbook_exists=playbook_exists)
+    job = deploy_jobs.get(request.args.get('job', ''))
+    return render_template('ansible.html', config=config_data, playbook_exists=playbook_exists,
+                           job=job.to_dict() if job else None)
+
+
+@app.route('/api/ansible_run', methods=['POST'])
+def api_ansible_run():
+    """API endpoint running the generated playbook as a background job."""
+    try:
+        data = request.json or {}
+        job = deploy_jobs.submit(
+            'ansible',
+            "Run medocker-user-setup.yml",
+            run_ansible_playbook,
+            os.path.join('playbooks', 'medocker-user-setup.yml'),
+            os.path.join('playbooks', 'inventory.yml'),
+            data.get('extra_vars')
+        )
+        return job_response(job)
+    except JobQueueFull as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 503
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
 @app.route('/download_ansible')
 def download_ansible():
     """Download the generated Ansible playbook as a zip file."""
     try:
-        import zipfile
-        from io import BytesIO
-        
         # Check if playbook directory exists
         playbook_dir = 'playbooks'
         if not os.path.exists(playbook_dir) or not os.path.isdir(playbook_dir):
             flash('Ansible playbook directory not found. Please generate the playbook first.', 'error')
             return redirect(url_for('ansible_page'))
-            
-        # Check if there are files in the directory
-        files_exist = False
-        for _, _, files in os.walk(playbook_dir):
-            if files:
-                files_exist = True
-                break
-                
-        if not files_exist:
+        
+        entries = directory_entries(playbook_dir)
+        if not entries:
             flash('No Ansible playbook files found. Please generate the playbook first.', 'error')
             return redirect(url_for('ansible_page'))
         
-        # Create a zip file in memory
-        memory_file = BytesIO()
-        
-        with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # Add all files from the playbook directory
-            for root, dirs, files in os.walk(playbook_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, playbook_dir)
-                    zipf.write(file_path, arcname)
-        
-        # Seek to the beginning of the BytesIO object
-        memory_file.seek(0)
-        
-        return send_file(
-            memory_file,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name='medocker-ansible-playbook.zip'
-        )
+        # Built once per playbook content and streamed from disk; answers
+        # If-None-Match with 304 Not Modified when the bundle is unchanged
+        archive = bundle_cache.get_or_build(entries)
+        return send_file(archive.path, mimetype='application/zip', as_attachment=True,
+                         download_name='medocker-ansible-playbook.zip', conditional=True, etag=archive.etag)
     except Exception as e:
         flash(f'Error creating Ansible playbook zip: {str(e)}', 'error')
         return redirect(url_for('ansible_page'))
@@ -381,31 +521,73 @@ def api_generate_ansible():
         # Get JSON data
         data = request.json
         
-        # Load configuration
-        config_file = CUSTOM_CONFIG_FILE if os.path.exists(CUSTOM_CONFIG_FILE) else DEFAULT_CONFIG_FILE
-        config_data = load_config(config_file)
-        
-        # Update configuration with API data
-        if 'user_setup' in data:
-            config_data['user_setup'] = data['user_setup']
-        
-        # Update client app settings if provided
-        if 'components' in data:
-            for component, settings in data['components'].items():
-                if component in config_data.get('components', {}):
-                    if 'client_enabled' in settings:
-                        config_data['components'][component]['client_enabled'] = settings['client_enabled']
+        def apply_data(config_data):
+            # Update configuration with API data
+            if 'user_setup' in data:
+                config_data['user_setup'] = data['user_setup']
+            
+            # Update client app settings if provided
+            if 'components' in data:
+                for component, settings in data['components'].items():
+                    if component in config_data.get('components', {}):
+                        if 'client_enabled' in settings:
+                            config_data['components'][component]['client_enabled'] = settings['client_enabled']
         
-        # Save configuration
-        save_config(config_data, CUSTOM_CONFIG_FILE)
+        # Update and save configuration atomically
+        _, config_data = config_store.update(CUSTOM_CONFIG_FILE, apply_data, fallback=DEFAULT_CONFIG_FILE)
         
-        # Generate Ansible playbook
-        playbook_path = generate_ansible_playbook(config_data)
+        # Generate Ansible playbook; installers are downloaded in the background
+        playbook_path = generate_ansible_playbook(config_data, fetch_artifacts=False)
         
-        return jsonify({
+        result = {
             'status': 'success',
             'message': 'Ansible playbook generated successfully',
             'playbook_path': playbook_path
+        }
+        try:
+            job = submit_artifact_caching(config_data, os.path.dirname(playbook_path))
+        except JobQueueFull as e:
+            result['message'] += f'; client installers not cached: {e}'
+            job = None
+        if job is not None:
+            result['artifacts_job'] = job.to_dict()
+            result['artifacts_job']['status_url'] = url_for('api_job', job_id=job.id)
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/artifacts/<sha256>/<filename>')
+def download_artifact(sha256, filename):
+    """Serve a cached client installer to workstations, by checksum."""
+    path = artifact_cache.path(sha256, filename)
+    if path is None:
+        return jsonify({'status': 'error', 'message': 'Artifact not found'}), 404
+    artifact_cache.touch(sha256)
+    # The content never changes for a checksum, so the checksum is the ETag
+    return send_file(path, mimetype='application/octet-stream', as_attachment=True, download_name=filename,
+                     conditional=True, etag=sha256, max_age=31536000)
+
+
+@app.route('/api/artifacts', methods=['GET'])
+def api_artifacts():
+    """List the cached client installers."""
+    return jsonify({'status': 'success', 'artifacts': artifact_cache.entries(), **artifact_cache.stats()})
+
+
+@app.route('/api/artifacts/verify', methods=['POST'])
+def api_artifacts_verify():
+    """Verify the checksums of the cached client installers and enforce the cache size."""
+    try:
+        result = artifact_cache.verify()
+        evicted = artifact_cache.evict()
+        return jsonify({
+            'status': 'success',
+            'message': f"{len(result['ok'])} installers verified, {len(result['removed'])} corrupted and "
+                       f"{len(evicted)} evicted",
+            'ok': result['ok'],
+            'removed': result['removed'],
+            'evicted': evicted
         })
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
@@ -417,85 +599,27 @@ def cart_page():
     return render_template('cart.html')
 
 
-def find_catalog_file():
-    """Find the service catalog file in various possible locations."""
-    possible_paths = [
-        # Primary path - project_root/data
-        os.path.join(project_root, 'data/service_catalog.json'),
-        
-        # Alternative paths if the primary fails
-        os.path.join(os.getcwd(), 'data/service_catalog.json'),
-        os.path.join(os.path.dirname(os.getcwd()), 'data/service_catalog.json'),
-        os.path.abspath('./data/service_catalog.json'),
-        
-        # Check in the directory where the executable is located (for packaged versions)
-        os.path.join(os.path.dirname(sys.executable), 'data/service_catalog.json')
-    ]
-    
-    # For debugging
-    results = []
-    
-    for path in possible_paths:
-        exists = os.path.exists(path)
-        results.append({"path": path, "exists": exists})
-        if exists:
-            return path, results
-    
-    return None, results
-
-
 @app.route('/api/service_catalog', methods=['GET'])
 def api_service_catalog():
     """Return the service catalog data."""
     try:
-        catalog_path, search_results = find_catalog_file()
-        
-        # Add debug logging
-        print(f"DEBUG: Search results for catalog: {search_results}")
-        
-        if catalog_path:
-            try:
-                with open(catalog_path, 'r', encoding='utf-8') as f:
-                    catalog_text = f.read()
-                
-                print(f"DEBUG: Catalog file read from {catalog_path}, length: {len(catalog_text)}")
-                
-                if not catalog_text.strip():
-                    print("DEBUG: Catalog file is empty")
-                    return jsonify({
-                        'status': 'error',
-                        'message': 'Service catalog file is empty'
-                    }), 500
-                
-                try:
-                    catalog = json.loads(catalog_text)
-                    print("DEBUG: Catalog JSON parsed successfully")
-                    return jsonify(catalog)
-                except json.JSONDecodeError as json_err:
-                    print(f"DEBUG: JSON decode error: {json_err}")
-                    return jsonify({
-                        'status': 'error',
-                        'message': f'Invalid JSON in service catalog: {str(json_err)}',
-                        'content_sample': catalog_text[:200] if len(catalog_text) > 200 else catalog_text
-                    }), 500
-            except Exception as read_err:
-                print(f"DEBUG: Error reading catalog file: {read_err}")
-                return jsonify({
-                    'status': 'error',
-                    'message': f'Error reading service catalog: {str(read_err)}'
-                }), 500
-        else:
-            return jsonify({
-                'status': 'error',
-                'message': 'Service catalog file not found',
-                'search_results': search_results
-            }), 404
+        snapshot = catalog_store.get()
+    except CatalogNotFound as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e),
+            'search_results': e.search_results
+        }), 404
     except Exception as e:
-        print(f"DEBUG: Unexpected error in api_service_catalog: {e}")
         return jsonify({
             'status': 'error',
-            'message': str(e)
+            'message': f'Error reading service catalog: {str(e)}'
         }), 500
+    
+    # The catalog is serialized once per version of the file
+    response = app.response_class(snapshot.json, mimetype='application/json')
+    response.set_etag(snapshot.etag)
+    return response.make_conditional(request)
 
 
 @app.route('/api/generate_from_cart', methods=['POST'])
@@ -512,53 +636,60 @@ def api_generate_from_cart():
                 'message': 'Cart is empty'
             }), 400
         
-        # Load current configuration
-        config_file = CUSTOM_CONFIG_FILE if os.path.exists(CUSTOM_CONFIG_FILE) else DEFAULT_CONFIG_FILE
-        config_data = load_config(config_file)
-        
-        # Load service catalog
-        catalog_file = os.path.join(project_root, 'data/service_catalog.json')
-        with open(catalog_file, 'r') as f:
-            catalog = json.load(f)
+        # Service catalog, indexed by id
+        catalog = catalog_store.get()
         
-        # Update configuration based on cart items
-        for item in cart_items:
-            service_id = item.get('id')
-            service_type = item.get('type')
+        def apply_cart(config_data):
+            # Update configuration based on cart items
+            for item in cart_items:
+                service_id = item.get('id')
+                service_type = item.get('type')
             
-            if service_type == 'docker':
-                # Find service in catalog
-                service = next((s for s in catalog['docker_services'] if s['id'] == service_id), None)
-                if service:
-                    # Enable the service in configuration
-                    if service_id in config_data.get('components', {}):
-                        config_data['components'][service_id]['enabled'] = True
-                    elif service_id in config_data.get('infrastructure', {}):
-                        config_data['infrastructure'][service_id]['enabled'] = True
-                    elif service_id in config_data.get('databases', {}):
-                        config_data['databases'][service_id]['enabled'] = True
-                    elif service_id in config_data.get('additional_services', {}):
-                        config_data['additional_services'][service_id]['enabled'] = True
-            elif service_type == 'ai':
-                # Handle AI services
-                # For now, just keep track of them in the cart
-                if 'ai_services' not in config_data:
-                    config_data['ai_services'] = {}
-                config_data['ai_services'][service_id] = {
-                    'enabled': True,
-                    'api_key': '',  # Will be filled by user later
-                    'local': True if 'local' in item.get('tags', []) else False
-                }
-        
-        # Save updated configuration
-        save_config(config_data, CUSTOM_CONFIG_FILE)
-        
-        # Generate docker-compose file
-        generate_docker_compose(config_data, 'docker-compose.yml')
+                if service_type == 'docker':
+                    # Find service in catalog
+                    service = catalog.service(service_id, 'docker')
+                    if service:
+                        # Enable the service in configuration; the registry knows
+                        # where catalog ids like 'hapi-fhir' live in the config
+                        section = default_service_registry.section_for_catalog_id(service_id)
+                        if section and isinstance(get_value(config_data, section), dict):
+                            get_value(config_data, section)['enabled'] = True
+                        elif service_id in config_data.get('components', {}):
+                            config_data['components'][service_id]['enabled'] = True
+                        elif service_id in config_data.get('infrastructure', {}):
+                            config_data['infrastructure'][service_id]['enabled'] = True
+                        elif service_id in config_data.get('databases', {}):
+                            config_data['databases'][service_id]['enabled'] = True
+                        elif service_id in config_data.get('additional_services', {}):
+                            config_data['additional_services'][service_id]['enabled'] = True
+                elif service_type == 'ai':
+                    # Handle AI services
+                    # For now, just keep track of them in the cart
+                    if 'ai_services' not in config_data:
+                        config_data['ai_services'] = {}
+                    config_data['ai_services'][service_id] = {
+                        'enabled': True,
+                        'api_key': '',  # Will be filled by user later
+                        'local': True if 'local' in item.get('tags', []) else False
+                    }
+        
+        # Update and save configuration atomically
+        _, config_data = config_store.update(CUSTOM_CONFIG_FILE, apply_cart, fallback=DEFAULT_CONFIG_FILE)
+        
+        # Generate docker-compose file, re-rendering only services that changed
+        try:
+            diff = generate_docker_compose(config_data, 'docker-compose.yml')
+        except ComposeValidationError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e),
+                'issues': e.issues
+            }), 400
         
         return jsonify({
             'status': 'success',
-            'message': 'Configuration generated successfully'
+            'message': 'Configuration generated successfully',
+            'changes': diff
         })
     except Exception as e:
         return jsonify({
@@ -567,14 +698,52 @@ def api_generate_from_cart():
         }), 500
 
 
+@app.route('/api/cart_footprint', methods=['POST'])
+def api_cart_footprint():
+    """Return the resources the docker services in a cart will reserve."""
+    try:
+        cart_items = (request.json or {}).get('cart', [])
+        config_data = config_store.get(CUSTOM_CONFIG_FILE, fallback=DEFAULT_CONFIG_FILE)
+        catalog_ids = [item.get('id') for item in cart_items if item.get('type') == 'docker']
+        return jsonify({
+            'status': 'success',
+            'footprint': default_service_registry.footprint(config_data, catalog_ids)
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+def default_reference_graph():
+    """Return the reference graph compiled from the default configuration's templates."""
+    global _reference_graph
+    version, default_config = config_store.get_versioned(DEFAULT_CONFIG_FILE)
+    if _reference_graph is None or _reference_graph[0] != version:
+        _reference_graph = (version, ReferenceGraph.compile(default_config))
+    return _reference_graph[1]
+
+
+_reference_graph = None
+
+
 def update_config_from_form(config, form_data):
     """Update configuration dictionary with form data."""
+    # Remember referenced values so only dependents of edited keys are re-resolved
+    graph = default_reference_graph()
+    previous = graph.capture(config)
+    
     # System settings
     config['system']['domain'] = form_data.get('system_domain', config['system']['domain'])
     config['system']['ssl_enabled'] = form_data.get('system_ssl_enabled') == 'true'
     config['system']['admin_email'] = form_data.get('system_admin_email', config['system']['admin_email'])
     config['system']['timezone'] = form_data.get('system_timezone', config['system']['timezone'])
     config['system']['data_directory'] = form_data.get('system_data_directory', config['system']['data_directory'])
+    if 'system_resources_scale' in form_data:
+        resources = config['system'].setdefault('resources', {})
+        resources['enabled'] = form_data.get('system_resources_enabled') == 'true'
+        resources['scale'] = float(form_data.get('system_resources_scale') or 1.0)
     
     # Infrastructure services
     
@@ -654,7 +823,7 @@ def update_config_from_form(config, form_data):
             config['additional_services'][service]['enabled'] = form_data.get(enabled_key) == 'true'
     
     # Resolve any variable references
-    config = resolve_variable_references(config)
+    config = resolve_variable_references(config, graph, previous)
     
     return config
 
@@ -681,7 +850,8 @@ def debug_catalog():
         'executable_path': sys.executable,
         'python_path': sys.path,
         'catalog_search_results': search_results,
-        'found_catalog_path': catalog_path
+        'found_catalog_path': catalog_path,
+        'catalog_store': catalog_store.stats()
     }
     
     # Try to read catalog file if it was found
@@ -706,6 +876,30 @@ def debug_catalog():
     return jsonify(result)
 
 
+@app.route('/api/debug/config_cache', methods=['GET'])
+def debug_config_cache():
+    """Debug endpoint reporting configuration cache hit/miss counters."""
+    return jsonify(config_store.stats())
+
+
+@app.route('/api/debug/compose_cache', methods=['GET'])
+def debug_compose_cache():
+    """Debug endpoint reporting compose render cache counters."""
+    return jsonify(compose_cache.stats())
+
+
+@app.route('/api/debug/bundle_cache', methods=['GET'])
+def debug_bundle_cache():
+    """Debug endpoint reporting Ansible bundle cache counters."""
+    return jsonify(bundle_cache.stats())
+
+
+@app.route('/api/debug/ssh_pool', methods=['GET'])
+def debug_ssh_pool():
+    """Debug endpoint reporting pooled SSH connections."""
+    return jsonify(ssh_pool.stats())
+
+
 @app.route('/api/test-mount', methods=['GET'])
 def test_mount():
     """Simple endpoint to test if volume mounting is working."""